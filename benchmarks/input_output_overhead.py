@@ -0,0 +1,105 @@
+BATCH = 2
+HEIGHT = 64
+WIDTH = 64
+ITERS = 2000
+DEVICE = "cuda"
+
+import argparse
+import time
+
+import oneflow as flow  # usort: skip
+import torch
+
+from onediff.infer_compiler.backends.oneflow.call_signature import CallSignatureCache
+from onediff.infer_compiler.backends.oneflow.utils.hash_utils import (
+    generate_input_structure_key,
+)
+from oneflow.framework.args_tree import ArgsTree
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Per-call Python overhead of converting the inputs and outputs of a compiled UNet"
+    )
+    parser.add_argument("--batch", type=int, default=BATCH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--iters", type=int, default=ITERS)
+    parser.add_argument("--device", type=str, default=DEVICE)
+    return parser.parse_args()
+
+
+def make_unet_inputs(batch, height, width, device):
+    args = (
+        torch.randn(batch, 4, height, width, device=device, dtype=torch.float16),
+        torch.tensor(981, device=device),
+    )
+    kwargs = {
+        "encoder_hidden_states": torch.randn(
+            batch, 77, 2048, device=device, dtype=torch.float16
+        ),
+        "added_cond_kwargs": {
+            "text_embeds": torch.randn(batch, 1280, device=device, dtype=torch.float16),
+            "time_ids": torch.randn(batch, 6, device=device, dtype=torch.float16),
+        },
+        "return_dict": False,
+    }
+    return args, kwargs
+
+
+def args_tree_call(args, kwargs, output):
+    def input_fn(value):
+        if isinstance(value, torch.Tensor):
+            return flow.utils.tensor.from_torch(value.contiguous())
+        else:
+            return value
+
+    def output_fn(value):
+        if isinstance(value, flow.Tensor):
+            return flow.utils.tensor.to_torch(value)
+        else:
+            return value
+
+    args_tree = ArgsTree((args, kwargs), False, tensor_type=torch.Tensor)
+    generate_input_structure_key(args_tree)
+    args_tree.map_leaf(input_fn)
+    out_tree = ArgsTree((output, None), False)
+    return out_tree.map_leaf(output_fn)[0]
+
+
+input_cache = CallSignatureCache(torch.Tensor)
+output_cache = CallSignatureCache(flow.Tensor, with_structure_key=False)
+
+
+def call_plan_call(args, kwargs, output):
+    leaves, plan = input_cache.flatten((args, kwargs))
+    plan.structure_key
+    plan.unflatten(
+        plan.map_tensors(leaves, lambda t: flow.utils.tensor.from_torch(t.contiguous()))
+    )
+    leaves, plan = output_cache.flatten(output)
+    return plan.unflatten(plan.map_tensors(leaves, flow.utils.tensor.to_torch))
+
+
+def benchmark(name, fn, args, kwargs, output, iters):
+    for _ in range(10):
+        fn(args, kwargs, output)
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn(args, kwargs, output)
+    cost = (time.perf_counter() - start) / iters * 1e6
+    print(f"{name}: {cost:.1f} us per call")
+    return cost
+
+
+def main():
+    args = parse_args()
+    inputs, kwargs = make_unet_inputs(args.batch, args.height, args.width, args.device)
+    output = (flow.utils.tensor.from_torch(inputs[0]),)
+    baseline = benchmark("ArgsTree", args_tree_call, inputs, kwargs, output, args.iters)
+    cost = benchmark("CallPlan", call_plan_call, inputs, kwargs, output, args.iters)
+    print(f"Speedup: {baseline / cost:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+MODEL = "runwayml/stable-diffusion-v1-5"
+CHANGED_CONVS = "0,8,32,all"
+REPEATS = 5
+HEIGHT = 512
+WIDTH = 512
+DEVICE = "cuda"
+
+import argparse
+import time
+
+import oneflow as flow  # usort: skip
+import torch
+
+from diffusers import UNet2DConditionModel
+from onediff.infer_compiler import oneflow_compile
+from onediff.infer_compiler.backends.oneflow.param_utils import (
+    get_constant_folding_info,
+    update_graph_with_constant_folding_info,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Latency of refreshing the constant folded conv weights of a compiled UNet after swapping LoRAs"
+    )
+    parser.add_argument("--model", type=str, default=MODEL)
+    parser.add_argument(
+        "--changed-convs",
+        type=str,
+        default=CHANGED_CONVS,
+        help="Numbers of conv weights changed by the swap, or all",
+    )
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--device", type=str, default=DEVICE)
+    return parser.parse_args()
+
+
+def make_unet_inputs(height, width, device):
+    return (
+        torch.randn(2, 4, height // 8, width // 8, device=device, dtype=torch.float16),
+        torch.tensor(981, device=device),
+        torch.randn(2, 77, 768, device=device, dtype=torch.float16),
+    )
+
+
+def swap_weights(unet, names):
+    # What loading and fusing a LoRA does to the weights it patches
+    state_dict = {name: torch.randn_like(unet.get_parameter(name)) for name in names}
+    unet.load_state_dict(state_dict, strict=False)
+
+
+def per_weight_refresh(unet):
+    # The refresh before batching, a oneflow copy per constant folded weight
+    torch_module = unet._torch_module
+    for name, target in get_constant_folding_info(unet).items():
+        source = torch_module.get_parameter(name)
+        target.copy_(flow.utils.tensor.from_torch(source.permute(0, 2, 3, 1)))
+    flow.cuda.synchronize()
+
+
+def timed(fn, *args, **kwargs):
+    torch.cuda.synchronize()
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+    config = UNet2DConditionModel.load_config(args.model, subfolder="unet")
+    unet = UNet2DConditionModel.from_config(config).to(args.device, torch.float16)
+    unet = oneflow_compile(unet.eval())
+    inputs = make_unet_inputs(args.height, args.width, args.device)
+    with torch.inference_mode():
+        unet(*inputs)
+        unet(*inputs)
+    info = get_constant_folding_info(unet)
+    if not info:
+        raise RuntimeError("No conv weight is constant folded in the graph")
+    names = list(info)
+    print(f"{len(names)} constant folded conv weights")
+
+    for changed in args.changed_convs.split(","):
+        count = len(names) if changed == "all" else min(int(changed), len(names))
+        costs = {
+            "per weight refresh": [],
+            "batched full refresh": [],
+            "incremental refresh": [],
+            "swap and call": [],
+        }
+        for _ in range(args.repeats):
+            swap_weights(unet, names[:count])
+            costs["per weight refresh"].append(timed(per_weight_refresh, unet))
+            swap_weights(unet, names[:count])
+            costs["batched full refresh"].append(
+                timed(update_graph_with_constant_folding_info, unet)
+            )
+            swap_weights(unet, names[:count])
+            costs["incremental refresh"].append(
+                timed(update_graph_with_constant_folding_info, unet, only_changed=True)
+            )
+            with torch.inference_mode():
+                swap_weights(unet, names[:count])
+                costs["swap and call"].append(timed(unet, *inputs))
+        print(
+            f"{count} changed: "
+            + ", ".join(
+                f"{name} {min(cost) * 1000:.2f}ms" for name, cost in costs.items()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+MODELS = "sd15,sdxl"
+DEVICE = "cuda"
+DTYPE = "float16"
+
+import argparse
+import time
+
+import torch
+
+from diffusers import UNet2DConditionModel
+from onediff.optimization.quant_optimizer import quantize_model
+
+UNETS = {
+    "sd15": "runwayml/stable-diffusion-v1-5",
+    "sdxl": "stabilityai/stable-diffusion-xl-base-1.0",
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Wall time and peak device memory of quantizing the weights of UNets by quantize_model"
+    )
+    parser.add_argument("--models", type=str, default=MODELS)
+    parser.add_argument("--device", type=str, default=DEVICE)
+    parser.add_argument("--dtype", type=str, default=DTYPE)
+    parser.add_argument("--no-conv", action="store_true")
+    parser.add_argument("--no-linear", action="store_true")
+    return parser.parse_args()
+
+
+def load_unet(name, device, dtype):
+    # Random weights, the time of quantization doesn't depend on them
+    config = UNet2DConditionModel.load_config(UNETS[name], subfolder="unet")
+    return UNet2DConditionModel.from_config(config).to(device, getattr(torch, dtype))
+
+
+def main():
+    args = parse_args()
+    for name in args.models.split(","):
+        unet = load_unet(name, args.device, args.dtype)
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        memory_before = torch.cuda.memory_allocated()
+        start = time.perf_counter()
+        quantize_model(
+            unet, quantize_conv=not args.no_conv, quantize_linear=not args.no_linear
+        )
+        torch.cuda.synchronize()
+        cost = time.perf_counter() - start
+        peak = (torch.cuda.max_memory_allocated() - memory_before) / 1024**2
+        print(f"{name}: quantized in {cost:.3f}s, peak memory {peak:+.1f} MB")
+        del unet
+        torch.cuda.empty_cache()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+MODEL = "stabilityai/sd-turbo"
+STEPS = "1,2,3,4"
+REPEATS = 10
+HEIGHT = 256
+WIDTH = 256
+PROMPT = "a photo of a cat"
+
+import argparse
+import time
+
+import torch
+
+from diffusers import AutoPipelineForText2Image
+from onediff.infer_compiler import oneflow_compile, OneflowCompileOptions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Latency of few step, small resolution text to image with and without static IO buffers"
+    )
+    parser.add_argument("--model", type=str, default=MODEL)
+    parser.add_argument(
+        "--steps", type=str, default=STEPS, help="Comma separated numbers of steps"
+    )
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--prompt", type=str, default=PROMPT)
+    return parser.parse_args()
+
+
+def load_pipe(model, static_io_buffers):
+    pipe = AutoPipelineForText2Image.from_pretrained(
+        model, torch_dtype=torch.float16, variant="fp16"
+    ).to("cuda")
+    options = OneflowCompileOptions()
+    options.static_io_buffers = static_io_buffers
+    # Both with CUDA graphs, the difference is the conversion of inputs and outputs
+    options.kernel_enable_cuda_graph = True
+    pipe.unet = oneflow_compile(pipe.unet, options=options)
+    return pipe
+
+
+def timed(fn, *args, **kwargs):
+    torch.cuda.synchronize()
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+    steps = [int(step) for step in args.steps.split(",")]
+    results = {}
+    for static_io_buffers in (False, True):
+        pipe = load_pipe(args.model, static_io_buffers)
+        call_kwargs = dict(
+            prompt=args.prompt,
+            height=args.height,
+            width=args.width,
+            guidance_scale=0.0,
+        )
+        # Builds the graph, then warms up the CUDA graphs
+        for _ in range(3):
+            pipe(num_inference_steps=max(steps), **call_kwargs)
+        for num_steps in steps:
+            costs = [
+                timed(pipe, num_inference_steps=num_steps, **call_kwargs)
+                for _ in range(args.repeats)
+            ]
+            results[(static_io_buffers, num_steps)] = min(costs)
+        del pipe
+        torch.cuda.empty_cache()
+
+    print(f"{args.model} at {args.height}x{args.width}")
+    for num_steps in steps:
+        baseline = results[(False, num_steps)]
+        cost = results[(True, num_steps)]
+        print(
+            f"{num_steps} steps: {baseline * 1000:.2f}ms without static IO buffers, "
+            f"{cost * 1000:.2f}ms with them, {baseline / cost:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+MODELS = "sd15,sdxl,svd"
+REPEATS = 3
+DEVICE = "cuda"
+DTYPE = "float16"
+CLASS_PROXY_TABLE = None
+
+import argparse
+import time
+
+import oneflow as flow  # usort: skip
+import torch
+
+from diffusers import UNet2DConditionModel, UNetSpatioTemporalConditionModel
+from onediff.infer_compiler.backends.oneflow.transform import torch2oflow, transform_mgr
+
+UNETS = {
+    "sd15": ("runwayml/stable-diffusion-v1-5", UNet2DConditionModel),
+    "sdxl": ("stabilityai/stable-diffusion-xl-base-1.0", UNet2DConditionModel),
+    "svd": (
+        "stabilityai/stable-video-diffusion-img2vid-xt",
+        UNetSpatioTemporalConditionModel,
+    ),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Time of converting torch UNets to oneflow by torch2oflow"
+    )
+    parser.add_argument("--models", type=str, default=MODELS)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--device", type=str, default=DEVICE)
+    parser.add_argument("--dtype", type=str, default=DTYPE)
+    parser.add_argument(
+        "--class-proxy-table",
+        type=str,
+        default=CLASS_PROXY_TABLE,
+        help="Load the class proxy table before converting if it exists, save it after",
+    )
+    return parser.parse_args()
+
+
+def load_unet(name, device, dtype):
+    model_id, unet_cls = UNETS[name]
+    # Random weights, the conversion doesn't depend on them
+    config = unet_cls.load_config(model_id, subfolder="unet")
+    return unet_cls.from_config(config).to(device, getattr(torch, dtype)).eval()
+
+
+def main():
+    args = parse_args()
+    if args.class_proxy_table is not None:
+        try:
+            start = time.perf_counter()
+            transform_mgr.load_class_proxy_table(args.class_proxy_table)
+            print(f"Class proxy table loaded in {time.perf_counter() - start:.3f}s")
+        except FileNotFoundError:
+            pass
+
+    for name in args.models.split(","):
+        unet = load_unet(name, args.device, args.dtype)
+        costs = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            torch2oflow(unet)
+            costs.append(time.perf_counter() - start)
+        # The first conversion mocks and caches the classes of the UNet
+        warm = min(costs[1:]) if len(costs) > 1 else float("nan")
+        print(f"{name}: first conversion {costs[0]:.3f}s, cached {warm:.3f}s")
+        del unet
+        torch.cuda.empty_cache()
+
+    if args.class_proxy_table is not None:
+        transform_mgr.save_class_proxy_table(args.class_proxy_table)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,11 @@ from ..modules.oneflow.config import ONEDIFF_QUANTIZED_OPTIMIZED_MODELS
 from ..modules.oneflow.utils import load_graph, OUTPUT_FOLDER, save_graph
 
 if is_onediff_quant_available() and not is_community_version():
+    from onediff.quantization.calibrate_info import (
+        CALIBRATE_INFO_FILES,
+        find_calibrate_info,
+    )
+
     from ..modules.oneflow.booster_quantization import (
         OnelineQuantizationBoosterExecutor,
     )  # type: ignore
@@ -562,7 +567,7 @@ if is_onediff_quant_available() and not is_community_version():
             for search_path in folder_paths.get_folder_paths("unet_int8"):
                 if os.path.exists(search_path):
                     for root, subdir, files in os.walk(search_path, followlinks=True):
-                        if "calibrate_info.txt" in files:
+                        if any(f in files for f in CALIBRATE_INFO_FILES):
                             paths.append(os.path.relpath(root, start=search_path))
 
             return {
@@ -592,7 +597,7 @@ if is_onediff_quant_available() and not is_community_version():
                         break
 
             unet_sd_path = os.path.join(model_path, "unet_int8.safetensors")
-            calibrate_info_path = os.path.join(model_path, "calibrate_info.txt")
+            calibrate_info_path = find_calibrate_info(model_path)
 
             model = comfy.sd.load_unet(unet_sd_path)
             replace_module_with_quantizable_module(
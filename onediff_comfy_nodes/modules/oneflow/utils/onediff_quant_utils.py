@@ -70,17 +70,9 @@ def modify_sub_module(module, sub_module_name, new_value):
 
 
 def _load_calibrate_info(calibrate_info_path):
-    calibrate_info = {}
-    with open(calibrate_info_path, "r") as f:
-        for line in f.readlines():
-            line = line.strip()
-            items = line.split(" ")
-            calibrate_info[items[0]] = [
-                float(items[1]),
-                int(items[2]),
-                [float(x) for x in items[3].split(",")],
-            ]
-    return calibrate_info
+    from onediff.quantization.calibrate_info import load_calibrate_info
+
+    return load_calibrate_info(calibrate_info_path)
 
 
 def search_modules(root, match_fn: callable, name=""):
@@ -311,15 +303,17 @@ def quantize_and_save_model(
         )
     save_model(diffusion_model, os.path.join(output_dir, "unet_int8.safetensors"))
 
-    print(f'save calibrate_info to {os.path.join(output_dir, "calibrate_info.txt")}')
+    from onediff.quantization.calibrate_info import (
+        CALIBRATE_INFO_FILES,
+        save_calibrate_info,
+    )
 
-    with open(os.path.join(output_dir, "calibrate_info.txt"), "w") as f:
-        for name, info in calibrate_info.items():
-            input_scale = 0
-            input_zero_point = 0
-            weight_scale = [str(x) for x in info[0].reshape(-1).tolist()]
-            f.write(
-                f"{name} {input_scale} {input_zero_point} {','.join(weight_scale)}\n"
-            )
+    calibrate_info_path = os.path.join(output_dir, CALIBRATE_INFO_FILES[0])
+    print(f"save calibrate_info to {calibrate_info_path}")
+    # [input_scale, input_zero_point, weight_scale]
+    save_calibrate_info(
+        {name: [0, 0, info[0]] for name, info in calibrate_info.items()},
+        calibrate_info_path,
+    )
 
     print(f"Quantize module time: {time.time() - start_time}s")
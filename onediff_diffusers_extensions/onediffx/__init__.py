@@ -5,6 +5,7 @@ from .compilers.diffusion_pipeline_compiler import (
     load_pipe,
     quantize_pipe,
     save_pipe,
+    warmup_pipe,
 )
 
 try:
@@ -19,4 +20,5 @@ __all__ = [
     "load_pipe",
     "OneflowCompileOptions",
     "quantize_pipe",
+    "warmup_pipe",
 ]
@@ -1,4 +1,5 @@
 import functools
+import inspect
 import json
 import os
 
@@ -61,6 +62,7 @@ def compile_pipe(
     options=None,
     ignores=(),
     fuse_qkv_projections=False,
+    warmup_shapes=None,
 ):
     if fuse_qkv_projections:
         pipe = fuse_qkv_projections_in_pipe(pipe)
@@ -103,9 +105,41 @@ def compile_pipe(
 
         patch_image_prcessor_(pipe.image_processor)
 
+    if warmup_shapes:
+        warmup_pipe(pipe, warmup_shapes)
+
     return pipe
 
 
+def warmup_pipe(pipe, warmup_shapes, **kwargs):
+    """Runs the pipeline once per shape so that the graphs of all compiled parts are
+    compiled, or loaded from their graph files, before serving.
+
+    `warmup_shapes` is a list of WarmupShape, (height, width, batch_size, dtype, kwargs)
+    tuples or dicts, or a JSON file of such a list. The dtype of a shape is ignored as the
+    pipeline runs in its own dtype. `kwargs` and the kwargs of each shape are passed to the
+    pipeline call, `num_inference_steps` defaults to 1.
+
+    Returns a list of WarmupResult with the time and device memory of each shape.
+    """
+    from onediff.infer_compiler.backends.warmup import parse_warmup_manifest, run_warmup
+
+    call_params = inspect.signature(pipe.__call__).parameters
+
+    def run(shape):
+        call_kwargs = {"num_inference_steps": 1}
+        if "prompt" in call_params:
+            call_kwargs["prompt"] = "warmup"
+        if "num_images_per_prompt" in call_params:
+            call_kwargs["num_images_per_prompt"] = shape.batch_size
+        call_kwargs.update(height=shape.height, width=shape.width)
+        call_kwargs.update(kwargs)
+        call_kwargs.update(shape.kwargs)
+        pipe(**call_kwargs)
+
+    return run_warmup(run, parse_warmup_manifest(warmup_shapes))
+
+
 def fuse_qkv_projections_in_pipe(pipe):
     if hasattr(pipe, "fuse_qkv_projections"):
         pipe.fuse_qkv_projections()
@@ -221,7 +255,31 @@ def quantize_pipe(
     #         return True
     #     return name in allowed_fqns
 
-    if quant_submodules_config_path:
+    quantization_plan = kwargs.pop("quantization_plan", None)
+    if quantization_plan is not None:
+        # The QuantizationPlan, or the path of one, of each part by name, e.g.
+        # {"unet": "unet_quant_plan.json"}, the names of the submodules of the parts
+        # may be the same
+        from onediff.quantization.plan import QuantizationPlan
+
+        if not isinstance(quantization_plan, dict):
+            raise TypeError(
+                f"quantization_plan must be a dict of the plan of each part, e.g. {{'unet': plan}}, got {type(quantization_plan)}"
+            )
+        quant_types = kwargs.pop("quant_types", None)
+        for part, plan in quantization_plan.items():
+            if part in ignores:
+                continue
+            module = _recursive_getattr(pipe, part, None)
+            if module is None:
+                raise ValueError(f"{type(pipe).__name__} has no part {part}")
+            if not isinstance(plan, QuantizationPlan):
+                plan = QuantizationPlan.load(plan)
+            logger.info(f"Quantizing {part} by {plan}")
+            _recursive_setattr(
+                pipe, part, plan.apply(module, "nexfort", quant_types=quant_types)
+            )
+    elif quant_submodules_config_path:
         allowed_fqns = load_quant_submodules_from_json(
             quant_submodules_config_path, top_percentage
         )
@@ -154,7 +154,7 @@ def _set_adapter(
     if delta_weight is not None:
         fused_weight = self.weight.data.float() + delta_weight
         self.weight.data.copy_(fused_weight.to(device=device, dtype=dtype))
-        update_graph_related_tensor(self)
+        update_graph_related_tensor(self, defer=True)
 
 
 def _delete_adapter(
@@ -268,7 +268,7 @@ def _load_lora_and_optionally_fuse(
         lora_weight = get_delta_weight(self, w_up, w_down, self.scaling[adapter_name])
         fused_weight = self.weight.data.float() + lora_weight
         self.weight.data.copy_(fused_weight.to(device=device, dtype=dtype))
-        update_graph_related_tensor(self)
+        update_graph_related_tensor(self, defer=True)
 
 
 def _unfuse_lora(
@@ -307,7 +307,7 @@ def _unfuse_lora(
 
     if delta_weight is not None:
         self.weight.data -= delta_weight
-        update_graph_related_tensor(self)
+        update_graph_related_tensor(self, defer=True)
 
 
 # the code is referenced from https://github.com/huggingface/diffusers/blob/ce9825b56bd8a6849e68b9590022e935400659e6/src/diffusers/loaders/lora_conversion_utils.py#L24
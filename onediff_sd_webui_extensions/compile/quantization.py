@@ -7,12 +7,15 @@ from onediff.optimization.quant_optimizer import (
     quantize_model,
     varify_can_use_quantization,
 )
+from onediff.quantization.calibrate_info import load_calibrate_info
 from onediff.utils import logger
 
 
 def quant_unet_oneflow(compiled_unet):
     if varify_can_use_quantization():
         calibrate_info = get_calibrate_info(
+            f"{Path(select_checkpoint().filename).stem}_sd_calibrate_info.safetensors"
+        ) or get_calibrate_info(
             f"{Path(select_checkpoint().filename).stem}_sd_calibrate_info.txt"
         )
         compiled_unet = quantize_model(
@@ -27,14 +30,4 @@ def get_calibrate_info(filename: str) -> Union[None, Dict]:
         return None
 
     logger.info(f"Got calibrate info at {str(calibration_path)}")
-    calibrate_info = {}
-    with open(calibration_path, "r") as f:
-        for line in f.readlines():
-            line = line.strip()
-            items = line.split(" ")
-            calibrate_info[items[0]] = [
-                float(items[1]),
-                int(items[2]),
-                [float(x) for x in items[3].split(",")],
-            ]
-    return calibrate_info
+    return load_calibrate_info(calibration_path)
@@ -317,20 +317,18 @@ def convert_unet_calibrate_dict(state_dict) -> str:
 
 
 def convert_unet_calibrate_info_sdxl(calibration_path, dst_path):
-    if not Path(calibration_path).exists():
+    from onediff.quantization.calibrate_info import (
+        load_calibrate_info,
+        save_calibrate_info,
+    )
+
+    if calibration_path is None or not Path(calibration_path).exists():
         print(f"File {calibration_path} not found, only convert model")
         return
 
-    calibrate_info = {}
-    with open(calibration_path, "r") as f:
-        for line in f.readlines():
-            line = line.strip()
-            items = line.split(" ")
-            calibrate_info[items[0]] = " ".join(items[1:])
+    calibrate_info = dict(load_calibrate_info(calibration_path))
     dst_info = convert_unet_calibrate_dict(calibrate_info)
-    with open(dst_path, "w") as f:
-        for name, info in dst_info.items():
-            f.write(f"{name} {info}\n")
+    save_calibrate_info(dst_info, dst_path)
 
 
 if __name__ == "__main__":
@@ -444,13 +442,16 @@ if __name__ == "__main__":
         state_dict = {"state_dict": state_dict}
         torch.save(state_dict, args.checkpoint_path)
 
+    from onediff.quantization.calibrate_info import find_calibrate_info
+
+    # Converted in the format of the calibrate info of the model
+    calibrate_info_path = find_calibrate_info(args.model_path)
+    suffix = Path(calibrate_info_path).suffix if calibrate_info_path else ".txt"
     calibrate_info_save_path = (
         Path(args.checkpoint_path).parent
-        / f"{Path(args.checkpoint_path).stem}_sd_calibrate_info.txt"
-    )
-    convert_unet_calibrate_info_sdxl(
-        args.model_path + "/calibrate_info.txt", calibrate_info_save_path
+        / f"{Path(args.checkpoint_path).stem}_sd_calibrate_info{suffix}"
     )
+    convert_unet_calibrate_info_sdxl(calibrate_info_path, calibrate_info_save_path)
 
 
 # def get_unet_state_dict(model_path):
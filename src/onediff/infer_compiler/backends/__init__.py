@@ -1,3 +1,6 @@
+from .auto import AutoCompileOptions, get_backend_report
 from .compiler import compile, oneflow_compile
 from .deployable_module import DeployableModule
 from .env_var import OneflowCompileOptions
+from .stats import register_stats_exporter, unregister_stats_exporter
+from .warmup import WarmupShape
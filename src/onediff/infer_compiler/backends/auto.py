@@ -0,0 +1,240 @@
+"""backend="auto": compiles a module with the best backend that can run it.
+
+The candidates are the available backends that support the module and provide
+the required capabilities, by priority. Backends compile lazily, so the first
+call runs the module with each candidate in turn until one succeeds, falling
+back to eager torch if none does:
+
+    >>> unet = compile(pipe.unet, backend="auto")
+    >>> controlnet = compile(pipe.controlnet, backend="auto")
+    >>> pipe(...)
+    >>> for selection in get_backend_report():
+    ...     print(selection)
+    UNet2DConditionModel: oneflow, 2.31x faster than eager
+    ControlNetModel: nexfort, oneflow failed: ...
+
+The backend is selected for the compiled module as a whole. If a backend fails on
+one of its submodules, the whole module falls back to the next candidate, so
+compile the submodules separately, like the unet and the controlnet above, for
+each to get its own backend. If no backend can run a module and
+`fallback_to_eager` is False, the failure is cached and later calls raise it again
+without trying the backends.
+"""
+import dataclasses
+import time
+import weakref
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+
+from onediff.utils import logger
+from onediff.utils.import_utils import is_oneflow_available
+from .deployable_module import DeployableModule
+from .registry import (
+    get_backend_capabilities,
+    list_available_backends,
+    lookup_backend,
+    register_backend,
+)
+
+__all__ = ["AutoCompileOptions", "BackendSelection", "get_backend_report"]
+
+EAGER = "eager"
+
+
+@dataclasses.dataclass
+class AutoCompileOptions:
+    # candidate backends, all the available ones by default
+    backends: Optional[Sequence[str]] = None
+    # options passed to each backend, e.g. {"oneflow": OneflowCompileOptions()}
+    backend_options: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    # capabilities the backend must provide, e.g. ("graph_save_load",)
+    required_capabilities: Sequence[str] = ()
+    # run eagerly if no backend can run the module, raise RuntimeError otherwise
+    fallback_to_eager: bool = True
+    # time the second call with the backend and eagerly to report the speedup
+    measure_speedup: bool = False
+
+
+@dataclasses.dataclass
+class BackendSelection:
+    module: str
+    backend: Optional[str] = None
+    # why the other candidates were skipped or failed
+    errors: Dict[str, str] = dataclasses.field(default_factory=dict)
+    eager_time: Optional[float] = None
+    compiled_time: Optional[float] = None
+
+    @property
+    def speedup(self) -> Optional[float]:
+        if self.eager_time is None or not self.compiled_time:
+            return None
+        return self.eager_time / self.compiled_time
+
+    def __str__(self) -> str:
+        result = f"{self.module}: {self.backend or 'not selected yet'}"
+        if self.speedup is not None:
+            result += f", {self.speedup:.2f}x faster than eager"
+        for backend, error in self.errors.items():
+            result += f", {backend} {error}"
+        return result
+
+
+# Weak references, a selection is dropped with its compiled module
+_selections: List["weakref.ref[BackendSelection]"] = []
+
+
+def _add_selection(selection: BackendSelection):
+    _selections[:] = [ref for ref in _selections if ref() is not None]
+    _selections.append(weakref.ref(selection))
+
+
+def get_backend_report() -> List[BackendSelection]:
+    """Returns what backend runs every live module compiled with backend="auto"."""
+    selections = (ref() for ref in _selections)
+    return [selection for selection in selections if selection is not None]
+
+
+def _clear_backend_state(torch_module):
+    # A backend may fail after patching the module, e.g. oneflow adds hooks and
+    # patches the copy_ of the constant folded weights
+    if is_oneflow_available():
+        from .oneflow.param_utils import clear_onediff_state
+
+        clear_onediff_state(torch_module)
+
+
+def _synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def _timed(fn, *args, **kwargs):
+    _synchronize()
+    start_time = time.perf_counter()
+    output = fn(*args, **kwargs)
+    _synchronize()
+    return output, time.perf_counter() - start_time
+
+
+class AutoDeployableModule(DeployableModule):
+    def __init__(self, torch_module, candidates, options, selection):
+        torch.nn.Module.__init__(self)
+        object.__setattr__(self, "_torch_module", torch_module)
+        object.__setattr__(self, "_deployable_module_model", None)
+        object.__setattr__(self, "_deployable_module_candidates", candidates)
+        object.__setattr__(self, "_deployable_module_options", options)
+        object.__setattr__(self, "_deployable_module_selection", selection)
+        object.__setattr__(self, "_deployable_module_error", None)
+        object.__setattr__(self, "_modules", torch_module._modules)
+        object.__setattr__(self, "_parameters", torch_module._parameters)
+        object.__setattr__(self, "_buffers", torch_module._buffers)
+
+    def _select_backend(self, *args, **kwargs):
+        selection = self._deployable_module_selection
+        for name in self._deployable_module_candidates:
+            options = self._deployable_module_options.backend_options.get(name, None)
+            try:
+                deployable_module = lookup_backend(name)(
+                    self._torch_module, options=options
+                )
+                output = deployable_module(*args, **kwargs)
+            except Exception as e:
+                selection.errors[name] = f"failed: {type(e).__name__}: {e}"
+                logger.warning(
+                    f"Backend {name} failed to run {selection.module}, trying the next one. {e}"
+                )
+                # The next candidate or eager torch runs the module as it was
+                _clear_backend_state(self._torch_module)
+                continue
+            object.__setattr__(self, "_deployable_module_model", deployable_module)
+            selection.backend = name
+            logger.info(f"{selection.module} runs with backend {name}")
+            return output
+
+        if not self._deployable_module_options.fallback_to_eager:
+            error = RuntimeError(f"No backend can run {selection}")
+            object.__setattr__(self, "_deployable_module_error", error)
+            raise error
+        object.__setattr__(self, "_deployable_module_model", self._torch_module)
+        selection.backend = EAGER
+        logger.warning(f"{selection.module} runs eagerly, no backend can run it")
+        return self._torch_module(*args, **kwargs)
+
+    def _measure_speedup(self, *args, **kwargs):
+        selection = self._deployable_module_selection
+        output, selection.compiled_time = _timed(
+            self._deployable_module_model, *args, **kwargs
+        )
+        _, selection.eager_time = _timed(self._torch_module, *args, **kwargs)
+        logger.info(f"{selection}")
+        return output
+
+    def forward(self, *args, **kwargs):
+        deployable_module = self._deployable_module_model
+        if deployable_module is None:
+            if self._deployable_module_error is not None:
+                raise self._deployable_module_error
+            return self._select_backend(*args, **kwargs)
+        selection = self._deployable_module_selection
+        if (
+            self._deployable_module_options.measure_speedup
+            and selection.eager_time is None
+            and selection.backend != EAGER
+        ):
+            return self._measure_speedup(*args, **kwargs)
+        return deployable_module(*args, **kwargs)
+
+    def get_backend_selection(self) -> BackendSelection:
+        return self._deployable_module_selection
+
+    def __getattr__(self, name):
+        deployable_module = self.__dict__.get("_deployable_module_model", None)
+        if deployable_module is None:
+            deployable_module = self.__dict__["_torch_module"]
+        return getattr(deployable_module, name)
+
+
+def _get_candidates(torch_module, options: AutoCompileOptions, selection):
+    names = options.backends
+    if names is None:
+        names = list_available_backends()
+    candidates = []
+    for name in names:
+        capabilities = get_backend_capabilities(name)
+        if capabilities is None:
+            # Registered without capabilities, assume it can run anything
+            candidates.append(name)
+            continue
+        required = tuple(options.required_capabilities)
+        if not capabilities.provides(required):
+            selection.errors[name] = f"skipped: doesn't provide all of {required}"
+            continue
+        supported, reason = capabilities.supports(torch_module)
+        if not supported:
+            selection.errors[name] = f"skipped: {reason}"
+            continue
+        candidates.append(name)
+    return candidates
+
+
+@register_backend("auto")
+def compile(torch_module: torch.nn.Module, *, options=None):
+    options = options if options is not None else AutoCompileOptions()
+    if isinstance(torch_module, DeployableModule):
+        torch_module = torch_module._torch_module
+    if not isinstance(torch_module, torch.nn.Module):
+        raise TypeError(
+            f"backend auto only compiles torch.nn.Module, got {type(torch_module)}"
+        )
+
+    selection = BackendSelection(module=type(torch_module).__name__)
+    candidates = _get_candidates(torch_module, options, selection)
+    _add_selection(selection)
+    module_cls = type(torch_module)
+
+    class MixedAutoDeployableModule(AutoDeployableModule, module_cls):
+        def _get_name(self):
+            return f"{self.__class__.__name__}(of {module_cls.__name__})"
+
+    return MixedAutoDeployableModule(torch_module, candidates, options, selection)
@@ -1,7 +1,9 @@
-from typing import Any
+from typing import Any, Dict
 
 import torch
 
+from .stats import ModuleStats
+
 
 class DeployableModule(torch.nn.Module):
     def __init__(self):
@@ -9,3 +11,24 @@ class DeployableModule(torch.nn.Module):
 
     def forward(self, *args, **kwargs) -> Any:
         raise NotImplementedError()
+
+    def _get_deployable_module_stats(self) -> ModuleStats:
+        stats = self.__dict__.get("_deployable_module_stats", None)
+        if stats is None:
+            torch_module = self.__dict__.get("_torch_module", self)
+            stats = ModuleStats(type(torch_module).__name__)
+            object.__setattr__(self, "_deployable_module_stats", stats)
+        return stats
+
+    def enable_stats(self, enabled: bool = True) -> None:
+        """Enables or disables recording the stats returned by get_stats."""
+        self._get_deployable_module_stats().enabled = enabled
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns the counters, timers (count, total, max and mean in seconds) and
+        device memory deltas (MB) recorded since the stats were enabled or reset.
+        """
+        return self._get_deployable_module_stats().snapshot()
+
+    def reset_stats(self) -> None:
+        self._get_deployable_module_stats().reset()
@@ -1,10 +1,12 @@
 import dataclasses
 import os
-from typing import Optional
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
 
 import torch
 
-from onediff.utils import set_boolean_env_var, set_integer_env_var
+from onediff.utils import logger
 
 
 @dataclasses.dataclass
@@ -15,6 +17,25 @@ class OneflowCompileOptions:
     max_cached_graph_size: int = 9
     graph_file: str = None
     graph_file_device: torch.device = None
+    # "full", "mmap" or "weightless", see backends/oneflow/graph_file_format.py
+    graph_file_format: str = "full"
+    # Content-addressed graph cache, see backends/oneflow/graph_cache_store.py
+    graph_cache_dir: str = None
+    # Max total size of the graph cache in bytes, None for unbounded
+    graph_cache_max_size: int = None
+    # Verify the checksum of a cached graph file before its first load in a process
+    graph_cache_verify_checksum: bool = True
+    # Graph pool related options, see backends/oneflow/graph_pool.py
+    shape_bucketing: Callable = None
+    pin_graph_after_hits: int = None
+    # Tensor properties telling graphs apart, any of "dtype", "rank", "device" and "shape"
+    input_signature: Tuple[str, ...] = ()
+    # Refuse to build graphs if any weight is copied instead of shared with torch
+    strict_param_sharing: bool = False
+    # Serve unseen input shapes eagerly while their graphs compile in background
+    compile_in_background: bool = False
+    # Copy inputs and outputs through persistent buffers, for CUDA graph replay
+    static_io_buffers: bool = False
     # Optimization related environment variables
     run_graph_by_vm: bool = None
     graph_delay_variable_op_execution: bool = None
@@ -47,52 +68,133 @@ class OneflowCompileOptions:
     kernel_glu_quant_enable_dual_gemm_impl: bool = None
 
 
-def _set_env_vars(field2env_var, options):
+# Compile option -> the oneflow environment variable it sets
+_ONEFLOW_ENV_VARS = {
+    "run_graph_by_vm": "ONEFLOW_RUN_GRAPH_BY_VM",
+    "graph_delay_variable_op_execution": "ONEFLOW_GRAPH_DELAY_VARIABLE_OP_EXECUTION",
+    "mlir_cse": "ONEFLOW_MLIR_CSE",
+    "mlir_enable_inference_optimization": "ONEFLOW_MLIR_ENABLE_INFERENCE_OPTIMIZATION",
+    "mlir_enable_round_trip": "ONEFLOW_MLIR_ENABLE_ROUND_TRIP",
+    "mlir_fuse_forward_ops": "ONEFLOW_MLIR_FUSE_FORWARD_OPS",
+    "mlir_fuse_ops_with_backward_impl": "ONEFLOW_MLIR_FUSE_OPS_WITH_BACKWARD_IMPL",
+    "mlir_group_matmul": "ONEFLOW_MLIR_GROUP_MATMUL",
+    "mlir_prefer_nhwc": "ONEFLOW_MLIR_PREFER_NHWC",
+    "mlir_fuse_kernel_launch": "ONEFLOW_MLIR_FUSE_KERNEL_LAUNCH",
+    "kernel_enable_cuda_graph": "ONEFLOW_KERNEL_ENABLE_CUDA_GRAPH",
+    "kernel_enable_fused_conv_bias": "ONEFLOW_KERNEL_ENABLE_FUSED_CONV_BIAS",
+    "kernel_enable_fused_linear": "ONEFLOW_KERNEL_ENABLE_FUSED_LINEAR",
+    "kernel_conv_cutlass_impl_enable_tuning_warmup": "ONEFLOW_KERNEL_CONV_CUTLASS_IMPL_ENABLE_TUNING_WARMUP",
+    "kernel_gemm_cutlass_impl_enable_tuning_warmup": "ONEFLOW_KERNEL_GEMM_CUTLASS_IMPL_ENABLE_TUNING_WARMUP",
+    "kernel_conv_enable_cutlass_impl": "ONEFLOW_KERNEL_CONV_ENABLE_CUTLASS_IMPL",
+    "kernel_enable_conv2d_tuning_warmup": "ONEFLOW_CONV2D_KERNEL_ENABLE_TUNING_WARMUP",
+    "kernel_gemm_enable_cutlass_impl": "ONEFLOW_KERNEL_GEMM_ENABLE_CUTLASS_IMPL",
+    "kernel_glu_enable_dual_gemm_impl": "ONEFLOW_KERNEL_GLU_ENABLE_DUAL_GEMM_IMPL",
+    "kernel_glu_enable_y_gemm_impl": "ONEFLOW_KERNEL_GLU_ENABLE_Y_GEMM_IMPL",
+    "kernel_glu_quant_enable_dual_gemm_impl": "ONEFLOW_KERNEL_GLU_QUANT_ENABLE_DUAL_GEMM_IMPL",
+    "conv_allow_half_precision_accumulation": "ONEFLOW_CONV_ALLOW_HALF_PRECISION_ACCUMULATION",
+    "matmul_allow_half_precision_accumulation": "ONEFLOW_MATMUL_ALLOW_HALF_PRECISION_ACCUMULATION",
+    "attention_allow_half_precision_accumulation": "ONEFLOW_ATTENTION_ALLOW_HALF_PRECISION_ACCUMULATION",
+    "attention_allow_half_precision_score_accumulation_max_m": "ONEFLOW_ATTENTION_ALLOW_HALF_PRECISION_SCORE_ACCUMULATION_MAX_M",
+}
+
+# Read by the kernels as the graphs run rather than while the graphs are
+# compiled. Graphs run outside of oneflow_env_vars_scope, so these take the
+# values of the process.
+ONEFLOW_RUN_TIME_ENV_VARS = frozenset(
+    (
+        "ONEFLOW_CONV_ALLOW_HALF_PRECISION_ACCUMULATION",
+        "ONEFLOW_MATMUL_ALLOW_HALF_PRECISION_ACCUMULATION",
+        "ONEFLOW_ATTENTION_ALLOW_HALF_PRECISION_ACCUMULATION",
+        "ONEFLOW_ATTENTION_ALLOW_HALF_PRECISION_SCORE_ACCUMULATION_MAX_M",
+    )
+)
+
+# Read when an nn.Graph is constructed and as it runs, not only while it's
+# compiled, so the modules setting these set them for the whole process. The
+# value of the module compiled last wins.
+ONEFLOW_PROCESS_ENV_VARS = frozenset(
+    (
+        "ONEFLOW_RUN_GRAPH_BY_VM",
+        "ONEFLOW_GRAPH_DELAY_VARIABLE_OP_EXECUTION",
+    )
+)
+
+# Environment variables are process-global, graphs of different options are
+# compiled one at a time
+_env_vars_lock = threading.RLock()
+
+# Values of ONEFLOW_PROCESS_ENV_VARS set by compiled modules
+_process_env_vars: Dict[str, str] = {}
+
+
+def get_oneflow_env_vars(options) -> Dict[str, str]:
+    """The environment variables set by the options that are not None."""
+    env_vars = {}
     for field in dataclasses.fields(options):
         field_name = field.name
         field_value = getattr(options, field_name)
-        if field_value is None or field_name not in field2env_var:
+        if field_value is None or field_name not in _ONEFLOW_ENV_VARS:
             continue
-        env_var = field2env_var[field_name]
-        set_env_var = None
         if field.type in (bool, Optional[bool]):
-            set_env_var = set_boolean_env_var
+            value = "1" if field_value else "0"
         elif field.type in (int, Optional[int]):
-            set_env_var = set_integer_env_var
+            value = str(int(field_value))
         else:
             raise ValueError(f"Unsupported type {field.type}")
-        set_env_var(env_var, field_value)
+        env_vars[_ONEFLOW_ENV_VARS[field_name]] = value
+    return env_vars
+
+
+@contextmanager
+def oneflow_env_vars_scope(env_vars: Dict[str, str]):
+    """Sets `env_vars` while a graph is built and compiled, and restores them after.
+
+    The scope holds a process-wide lock, keep it to the compilation, see
+    OneflowGraph._compile. Variables in ONEFLOW_RUN_TIME_ENV_VARS are not read in
+    the scope, set them for the whole process with set_oneflow_env_vars. Those in
+    ONEFLOW_PROCESS_ENV_VARS are set for the whole process by
+    set_oneflow_process_env_vars.
+    """
+    if not env_vars:
+        yield
+        return
+    with _env_vars_lock:
+        saved = {name: os.environ.get(name, None) for name in env_vars}
+        os.environ.update(env_vars)
+        try:
+            yield
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def set_oneflow_process_env_vars(env_vars: Dict[str, str], module_name: str):
+    """Sets the variables of `env_vars` in ONEFLOW_PROCESS_ENV_VARS for the whole
+    process, and warns if another module set them to other values.
+    """
+    with _env_vars_lock:
+        for name, value in env_vars.items():
+            if name not in ONEFLOW_PROCESS_ENV_VARS:
+                continue
+            previous = _process_env_vars.get(name, None)
+            if previous is not None and previous != value:
+                logger.warning(
+                    f"{module_name} sets {name}={value} for the whole process, other compiled modules set it to {previous}"
+                )
+            _process_env_vars[name] = value
+            os.environ[name] = value
 
 
 def set_oneflow_env_vars(options):
-    field2env_var = {
-        "run_graph_by_vm": "ONEFLOW_RUN_GRAPH_BY_VM",
-        "graph_delay_variable_op_execution": "ONEFLOW_GRAPH_DELAY_VARIABLE_OP_EXECUTION",
-        "mlir_cse": "ONEFLOW_MLIR_CSE",
-        "mlir_enable_inference_optimization": "ONEFLOW_MLIR_ENABLE_INFERENCE_OPTIMIZATION",
-        "mlir_enable_round_trip": "ONEFLOW_MLIR_ENABLE_ROUND_TRIP",
-        "mlir_fuse_forward_ops": "ONEFLOW_MLIR_FUSE_FORWARD_OPS",
-        "mlir_fuse_ops_with_backward_impl": "ONEFLOW_MLIR_FUSE_OPS_WITH_BACKWARD_IMPL",
-        "mlir_group_matmul": "ONEFLOW_MLIR_GROUP_MATMUL",
-        "mlir_prefer_nhwc": "ONEFLOW_MLIR_PREFER_NHWC",
-        "mlir_fuse_kernel_launch": "ONEFLOW_MLIR_FUSE_KERNEL_LAUNCH",
-        "kernel_enable_cuda_graph": "ONEFLOW_KERNEL_ENABLE_CUDA_GRAPH",
-        "kernel_enable_fused_conv_bias": "ONEFLOW_KERNEL_ENABLE_FUSED_CONV_BIAS",
-        "kernel_enable_fused_linear": "ONEFLOW_KERNEL_ENABLE_FUSED_LINEAR",
-        "kernel_conv_cutlass_impl_enable_tuning_warmup": "ONEFLOW_KERNEL_CONV_CUTLASS_IMPL_ENABLE_TUNING_WARMUP",
-        "kernel_gemm_cutlass_impl_enable_tuning_warmup": "ONEFLOW_KERNEL_GEMM_CUTLASS_IMPL_ENABLE_TUNING_WARMUP",
-        "kernel_conv_enable_cutlass_impl": "ONEFLOW_KERNEL_CONV_ENABLE_CUTLASS_IMPL",
-        "kernel_enable_conv2d_tuning_warmup": "ONEFLOW_CONV2D_KERNEL_ENABLE_TUNING_WARMUP",
-        "kernel_gemm_enable_cutlass_impl": "ONEFLOW_KERNEL_GEMM_ENABLE_CUTLASS_IMPL",
-        "kernel_glu_enable_dual_gemm_impl": "ONEFLOW_KERNEL_GLU_ENABLE_DUAL_GEMM_IMPL",
-        "kernel_glu_enable_y_gemm_impl": "ONEFLOW_KERNEL_GLU_ENABLE_Y_GEMM_IMPL",
-        "kernel_glu_quant_enable_dual_gemm_impl": "ONEFLOW_KERNEL_GLU_QUANT_ENABLE_DUAL_GEMM_IMPL",
-        "conv_allow_half_precision_accumulation": "ONEFLOW_CONV_ALLOW_HALF_PRECISION_ACCUMULATION",
-        "matmul_allow_half_precision_accumulation": "ONEFLOW_MATMUL_ALLOW_HALF_PRECISION_ACCUMULATION",
-        "attention_allow_half_precision_accumulation": "ONEFLOW_ATTENTION_ALLOW_HALF_PRECISION_ACCUMULATION",
-        "attention_allow_half_precision_score_accumulation_max_m": "ONEFLOW_ATTENTION_ALLOW_HALF_PRECISION_SCORE_ACCUMULATION_MAX_M",
-    }
-    _set_env_vars(field2env_var, options)
+    """Sets the environment variables of the options for the whole process.
+
+    Compiled modules don't call it, they set their options in the scope of their
+    graphs only, see oneflow_env_vars_scope.
+    """
+    os.environ.update(get_oneflow_env_vars(options))
 
 
 def set_oneflow_default_env_vars():
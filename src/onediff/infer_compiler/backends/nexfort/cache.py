@@ -0,0 +1,53 @@
+"""Persistent compilation caches of the nexfort backend.
+
+nexfort compiles with torch.compile, whose caches live in temporary directories
+by default, so every worker compiles its modules again on start. With the option
+"cache_dir", the compiled graphs of nexfort (NEXFORT_GRAPH_CACHE), the FX graphs
+and autotuning results of inductor and the kernels of triton are kept there:
+
+    >>> unet = compile(pipe.unet, backend="nexfort", options={"mode": "max-autotune", "cache_dir": "/data/nexfort_cache"})
+    >>> unet.warmup([(1024, 1024, 1, torch.float16)], unet_inputs)
+
+Entries are keyed by the caches themselves, by the traced graph, the shapes of
+its inputs, the compile options and the versions of torch and triton, so a cache
+directory is shared by all modules and processes. The directories are set for the
+whole process, the first one set wins.
+"""
+import os
+
+from onediff.utils import logger
+
+__all__ = ["enable_compile_cache"]
+
+_cache_dir = None
+
+
+def enable_compile_cache(cache_dir) -> str:
+    """Keeps the compilation caches of nexfort, inductor and triton in `cache_dir`,
+    and returns the cache directory in use.
+    """
+    global _cache_dir
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    if _cache_dir is not None:
+        if _cache_dir != cache_dir:
+            logger.warning(
+                f"Compilation cache of nexfort is in {_cache_dir} already, ignored {cache_dir}"
+            )
+        return _cache_dir
+
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["NEXFORT_GRAPH_CACHE"] = "1"
+    os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] = "1"
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.join(cache_dir, "inductor")
+    os.environ["TRITON_CACHE_DIR"] = os.path.join(cache_dir, "triton")
+
+    from torch._inductor import config
+
+    # Read from the environment when inductor is imported, which may be earlier
+    for name in ("fx_graph_cache", "autotune_local_cache"):
+        if hasattr(config, name):
+            setattr(config, name, True)
+
+    _cache_dir = cache_dir
+    logger.info(f"Compilation cache of nexfort is in {cache_dir}")
+    return cache_dir
@@ -3,8 +3,11 @@ from typing import Type, Union
 
 import torch
 from torch import nn
+from torch.utils._pytree import tree_flatten, tree_unflatten
 
 from ..deployable_module import DeployableModule
+from ..static_io_buffers import StaticIOBuffers
+from ..stats import ModuleStats
 
 DISABLE_DEPLOYABLE = False
 
@@ -21,10 +24,26 @@ def fallback_to_eager(value: bool = False):
 
 
 class NexfortDeployableModule(DeployableModule):
-    def __init__(self, compiled_module, torch_module):
+    def __init__(
+        self,
+        compiled_module,
+        torch_module,
+        static_io_buffers=False,
+        persistent_outputs=False,
+    ):
         torch.nn.Module.__init__(self)
         object.__setattr__(self, "_torch_module", torch_module)
         object.__setattr__(self, "_deployable_module_model", compiled_module)
+        object.__setattr__(
+            self, "_deployable_module_stats", ModuleStats(type(torch_module).__name__)
+        )
+        object.__setattr__(
+            self,
+            "_deployable_module_static_io_buffers",
+            StaticIOBuffers(persistent_outputs=persistent_outputs)
+            if static_io_buffers
+            else None,
+        )
         # https://github.com/pytorch/pytorch/blob/main/torch/_dynamo/eval_frame.py#L148
         if isinstance(torch_module, nn.Module) and isinstance(
             compiled_module, torch._dynamo.eval_frame.OptimizedModule
@@ -38,8 +57,64 @@ class NexfortDeployableModule(DeployableModule):
     def forward(self, *args, **kwargs):
         if DISABLE_DEPLOYABLE:
             return self._torch_module(*args, **kwargs)
-        with torch._dynamo.utils.disable_cache_limit():
-            return self._deployable_module_model(*args, **kwargs)
+        static_io_buffers = self._deployable_module_static_io_buffers
+        if static_io_buffers is not None:
+            return self._forward_with_static_io_buffers(static_io_buffers, args, kwargs)
+        # Includes the compilation of new shapes by torch.compile
+        with self._deployable_module_stats.timer("execution_time", cuda=True):
+            with torch._dynamo.utils.disable_cache_limit():
+                return self._deployable_module_model(*args, **kwargs)
+
+    def _forward_with_static_io_buffers(self, static_io_buffers, args, kwargs):
+        leaves, spec = tree_flatten((args, kwargs))
+        indices = [i for i, leaf in enumerate(leaves) if isinstance(leaf, torch.Tensor)]
+        # Buffers are told apart by the input tensors only, torch.compile guards the rest
+        entry, buffers = static_io_buffers.copy_inputs(
+            None, [leaves[i] for i in indices]
+        )
+        for i, buffer in zip(indices, buffers):
+            leaves[i] = buffer
+        args, kwargs = tree_unflatten(leaves, spec)
+        # The outputs are copied out, so CUDA graphs may overwrite them
+        if hasattr(torch.compiler, "cudagraph_mark_step_begin"):
+            torch.compiler.cudagraph_mark_step_begin()
+        with self._deployable_module_stats.timer("execution_time", cuda=True):
+            with torch._dynamo.utils.disable_cache_limit():
+                output = self._deployable_module_model(*args, **kwargs)
+        leaves, spec = tree_flatten(output)
+        indices = [i for i, leaf in enumerate(leaves) if isinstance(leaf, torch.Tensor)]
+        outputs = static_io_buffers.copy_outputs(entry, [leaves[i] for i in indices])
+        for i, buffer in zip(indices, outputs):
+            leaves[i] = buffer
+        return tree_unflatten(leaves, spec)
+
+    def warmup(self, manifest, input_fn=None, *, raise_on_error=True):
+        """Compiles the module for every manifest entry ahead of time, like the oneflow
+        backend does. With the option "cache_dir", compiling is loading from the cache
+        once another process compiled the same entries, see cache.py.
+
+        Args:
+            manifest: a list of WarmupShape, (height, width, batch_size, dtype, kwargs) tuples,
+                dicts, explicit (args, kwargs) pairs, or a JSON file of such a list.
+            input_fn: builds the (args, kwargs) of this module from a WarmupShape.
+
+        Returns:
+            A list of WarmupResult with the compile time and device memory of each entry.
+        """
+        from ..warmup import (
+            make_module_inputs,
+            parse_module_warmup_manifest,
+            run_warmup,
+        )
+
+        manifest = parse_module_warmup_manifest(manifest)
+
+        def run(entry):
+            args, kwargs = make_module_inputs(entry, input_fn)
+            with torch.inference_mode():
+                self(*args, **kwargs)
+
+        return run_warmup(run, manifest, raise_on_error=raise_on_error)
 
     def __getattr__(self, name):
         return getattr(self._deployable_module_model, name)
@@ -58,25 +133,44 @@ def _create_deployable_function(
 
 
 def _create_mixed_deployable_module(
-    compiled_model, torch_module: nn.Module
+    compiled_model,
+    torch_module: nn.Module,
+    static_io_buffers=False,
+    persistent_outputs=False,
 ) -> Type[NexfortDeployableModule]:
     module_cls = type(torch_module)
 
     class MixedNexfortDeployableModule(NexfortDeployableModule, module_cls):
-        def __init__(self, compiled_module, torch_module):
-            super().__init__(compiled_module, torch_module)
+        def __init__(
+            self,
+            compiled_module,
+            torch_module,
+            static_io_buffers=False,
+            persistent_outputs=False,
+        ):
+            super().__init__(
+                compiled_module, torch_module, static_io_buffers, persistent_outputs
+            )
 
         def _get_name(self):
             return f"{self.__class__.__name__}(of {module_cls.__name__})"
 
     return MixedNexfortDeployableModule(
-        compiled_module=compiled_model, torch_module=torch_module
+        compiled_module=compiled_model,
+        torch_module=torch_module,
+        static_io_buffers=static_io_buffers,
+        persistent_outputs=persistent_outputs,
     )
 
 
 def get_deployable_module(
-    torch_module: Union[nn.Module, FunctionType], compiled_model
+    torch_module: Union[nn.Module, FunctionType],
+    compiled_model,
+    static_io_buffers=False,
+    persistent_outputs=False,
 ) -> Union[Type[NexfortDeployableModule], FunctionType]:
     if not isinstance(torch_module, nn.Module):
         return _create_deployable_function(compiled_model, torch_module)
-    return _create_mixed_deployable_module(compiled_model, torch_module)
+    return _create_mixed_deployable_module(
+        compiled_model, torch_module, static_io_buffers, persistent_outputs
+    )
@@ -2,11 +2,19 @@ from typing import Callable
 
 import torch
 
-from ..registry import register_backend
+from ..registry import BackendCapabilities, register_backend
 from .deployable_module import get_deployable_module, NexfortDeployableModule
 
 
-@register_backend("nexfort")
+@register_backend(
+    "nexfort",
+    capabilities=BackendCapabilities(
+        dynamic_shapes=True,
+        quantization=True,
+        device_types=("cuda",),
+        priority=20,
+    ),
+)
 def compile(torch_module: torch.nn.Module, *, options=None):
     from nexfort.compilers import nexfort_compile
 
@@ -29,8 +37,20 @@ def compile(torch_module: torch.nn.Module, *, options=None):
         # TODO(): using jsonschema to define the options schema
         options = json.loads(options)
 
-    nexfort_options = options if options is not None else dict()
+    nexfort_options = dict(options) if options is not None else dict()
+    # Handled by the deployable module, see static_io_buffers.py
+    static_io_buffers = nexfort_options.pop("static_io_buffers", False)
+    cache_dir = nexfort_options.pop("cache_dir", None)
+    if cache_dir is not None:
+        from .cache import enable_compile_cache
+
+        enable_compile_cache(cache_dir)
+
+    # The outputs of CUDA graphs are static tensors, overwritten by the next replay
+    persistent_outputs = "cudagraphs" in str(nexfort_options.get("mode", ""))
 
     compiled_model = nexfort_compile(torch_module, **nexfort_options)
 
-    return get_deployable_module(torch_module, compiled_model)
+    return get_deployable_module(
+        torch_module, compiled_model, static_io_buffers, persistent_outputs
+    )
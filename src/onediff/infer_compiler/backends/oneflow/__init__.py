@@ -1,3 +1,4 @@
 from ..env_var import OneflowCompileOptions
 from . import oneflow as _oneflow_backend
+from .autotune import autotune, load_autotune_profile
 from .deployable_module import OneflowDeployableModule
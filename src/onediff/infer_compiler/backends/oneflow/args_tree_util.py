@@ -1,79 +1,169 @@
 import torch
 import oneflow as flow  # usort: skip
 import functools
-
-from oneflow.framework.args_tree import ArgsTree
+import time
 
 from onediff.utils import logger
+from ..stats import device_memory_used_mb
+from .call_signature import CallSignatureCache
 from .graph_management_utils import graph_file_management
 
-from .utils.hash_utils import generate_input_structure_key
-
 
 def input_output_processor(func):
-    def process_input(*args, **kwargs):
-        def input_fn(value):
-            if isinstance(value, torch.Tensor):
-                # TODO: https://github.com/siliconflow/sd-team/issues/109
-                return flow.utils.tensor.from_torch(value.contiguous())
-            else:
-                return value
-
-        args_tree = ArgsTree((args, kwargs), False, tensor_type=torch.Tensor)
-
-        input_structure_key = generate_input_structure_key(args_tree)
-        out = args_tree.map_leaf(input_fn)
-        mapped_args = out[0]
-        mapped_kwargs = out[1]
-        return mapped_args, mapped_kwargs, input_structure_key
-
-    def process_output(output):
-        def output_fn(value):
-            if isinstance(value, flow.Tensor):
-                return flow.utils.tensor.to_torch(value)
-            else:
-                return value
-
-        out_tree = ArgsTree((output, None), False)
-        out = out_tree.map_leaf(output_fn)
-        return out[0]
+    input_signature_cache = CallSignatureCache(torch.Tensor)
+    output_signature_cache = CallSignatureCache(flow.Tensor, with_structure_key=False)
+
+    def input_fn(value):
+        # TODO: https://github.com/siliconflow/sd-team/issues/109
+        return flow.utils.tensor.from_torch(value.contiguous())
+
+    def process_input(self, *args, **kwargs):
+        leaves, plan = input_signature_cache.flatten((args, kwargs))
+        input_signature = self._deployable_module_input_signature
+        signature = input_signature.signature(plan.structure_key, plan.tensors(leaves))
+        return leaves, plan, input_signature.key(signature), signature
+
+    def map_input(self, leaves, plan):
+        with self._deployable_module_stats.timer("input_conversion_time"):
+            return plan.unflatten(plan.map_tensors(leaves, input_fn))
+
+    def map_static_input(self, leaves, plan, input_structure_key):
+        with self._deployable_module_stats.timer("input_conversion_time"):
+            entry, buffers = self._deployable_module_static_io_buffers.copy_inputs(
+                input_structure_key, plan.tensors(leaves)
+            )
+            buffers_iter = iter(buffers)
+            mapped_args, mapped_kwargs = plan.unflatten(
+                plan.map_tensors(leaves, lambda _: next(buffers_iter))
+            )
+            return mapped_args, mapped_kwargs, entry
+
+    def explain_miss(self, plan, signature):
+        graph_pool = self._deployable_module_graph_cache
+        input_structure_key = self._deployable_module_input_signature.key(signature)
+        reason = self._deployable_module_input_signature.explain_miss(
+            signature, graph_pool.keys(), plan.tensor_paths
+        )
+        graph_pool.set_miss_reason(input_structure_key, reason)
+        return reason
+
+    def process_output(self, output, static_entry=None):
+        with self._deployable_module_stats.timer("output_conversion_time"):
+            leaves, plan = output_signature_cache.flatten(output)
+            leaves = plan.map_tensors(leaves, flow.utils.tensor.to_torch)
+            if static_entry is not None:
+                outputs_iter = iter(
+                    self._deployable_module_static_io_buffers.copy_outputs(
+                        static_entry, plan.tensors(leaves)
+                    )
+                )
+                leaves = plan.map_tensors(leaves, lambda _: next(outputs_iter))
+            return plan.unflatten(leaves)
+
+    def clone_input(*args, **kwargs):
+        leaves, plan = input_signature_cache.flatten((args, kwargs))
+        return plan.unflatten(plan.map_tensors(leaves, torch.Tensor.clone))
+
+    def run_eagerly(self, *args, **kwargs):
+        torch_module = self._torch_module
+        if func.__name__ == "forward":
+            return torch_module(*args, **kwargs)
+        return getattr(torch_module, func.__name__)(*args, **kwargs)
+
+    def run(self, *args, **kwargs):
+        return (
+            graph_file_management(func)(self, *args, **kwargs)
+            if self._load_graph_first_run
+            else func(self, *args, **kwargs)
+        )
+
+    def run_timed(self, *args, **kwargs):
+        # Host time, the kernels run asynchronously on the streams of oneflow
+        with self._deployable_module_stats.timer("launch_time"):
+            return run(self, *args, **kwargs)
 
     @functools.wraps(func)
     def wrapper(self: "OneflowDeployableModule", *args, **kwargs):
-        mapped_args, mapped_kwargs, input_structure_key = process_input(*args, **kwargs)
-        if (
+        leaves, plan, input_structure_key, signature = process_input(
+            self, *args, **kwargs
+        )
+        if not (
             self._deployable_module_options.use_graph
             and self._deployable_module_enable_dynamic
-            and self._deployable_module_dpl_graph is not None
-            and self._deployable_module_input_structure_key != input_structure_key
         ):
-            # Retrieve the deployable module graph from cache using the input structure key
-            dpl_graph = self._deployable_module_graph_cache.get(
-                input_structure_key, None
-            )
-            self._deployable_module_graph_cache.put(
-                self._deployable_module_input_structure_key,
-                self._deployable_module_dpl_graph,
-            )
+            mapped_args, mapped_kwargs = map_input(self, leaves, plan)
+            return process_output(self, run_timed(self, *mapped_args, **mapped_kwargs))
 
-            # If a cached graph is found, update the deployable module graph and input structure key
-            if dpl_graph is not None:
-                self._deployable_module_dpl_graph = dpl_graph
-                self._deployable_module_input_structure_key = input_structure_key
-            else:
-                logger.warning(
-                    f"Input structure key {self._deployable_module_input_structure_key} to {input_structure_key} has changed. Resetting the deployable module graph. This may slow down the process."
+        stats = self._deployable_module_stats
+        graph_pool = self._deployable_module_graph_cache
+        dpl_graph = graph_pool.lookup(input_structure_key)
+        stats.inc("graph_pool_hits" if dpl_graph is not None else "graph_pool_misses")
+        if dpl_graph is not None:
+            self._deployable_module_dpl_graph = dpl_graph
+            self._deployable_module_input_structure_key = input_structure_key
+            if self._deployable_module_static_io_buffers is not None:
+                mapped_args, mapped_kwargs, entry = map_static_input(
+                    self, leaves, plan, input_structure_key
                 )
-                self._deployable_module_dpl_graph = None
-                self._deployable_module_input_structure_key = None
-                self._load_graph_first_run = True
+                output = run_timed(self, *mapped_args, **mapped_kwargs)
+                return process_output(self, output, entry)
+            mapped_args, mapped_kwargs = map_input(self, leaves, plan)
+            return process_output(self, run_timed(self, *mapped_args, **mapped_kwargs))
 
-        output = (
-            graph_file_management(func)(self, *mapped_args, **mapped_kwargs)
-            if self._load_graph_first_run
-            else func(self, *mapped_args, **mapped_kwargs)
-        )
+        if self._deployable_module_options.compile_in_background and not getattr(
+            self._deployable_module_compile_in_foreground, "enabled", False
+        ):
+            if input_structure_key not in self._deployable_module_compile_futures:
+                reason = explain_miss(self, plan, signature)
+                logger.info(
+                    f"Compiling a graph for {input_structure_key} in background, {reason}"
+                )
+                # The caller may modify the inputs in place after this call returns
+                cloned_args, cloned_kwargs = clone_input(*args, **kwargs)
+                cloned_leaves, cloned_plan, *_ = process_input(
+                    self, *cloned_args, **cloned_kwargs
+                )
+                cloned_args, cloned_kwargs = map_input(self, cloned_leaves, cloned_plan)
+                self._compile_graph_in_background(
+                    input_structure_key, func, *cloned_args, **cloned_kwargs
+                )
+            stats.inc("eager_runs")
+            return run_eagerly(self, *args, **kwargs)
 
-        return process_output(output)
+        reason = explain_miss(self, plan, signature)
+        # A graph loaded by load_graph has no key yet
+        if (
+            self._deployable_module_dpl_graph is not None
+            and self._deployable_module_input_structure_key is not None
+            and self._deployable_module_input_structure_key != input_structure_key
+        ):
+            logger.info(
+                f"Input structure key {self._deployable_module_input_structure_key} to {input_structure_key} has changed, {reason}. Building a new graph for it."
+            )
+            self._deployable_module_dpl_graph = None
+            self._load_graph_first_run = True
+        self._deployable_module_input_structure_key = input_structure_key
+
+        mapped_args, mapped_kwargs = map_input(self, leaves, plan)
+        need_build = self._deployable_module_dpl_graph is None
+        memory_before = (
+            device_memory_used_mb() if need_build and stats.enabled else None
+        )
+        start_time = time.perf_counter()
+        # The build time is recorded apart
+        output = (run if need_build else run_timed)(self, *mapped_args, **mapped_kwargs)
+        if self._deployable_module_dpl_graph is not None:
+            build_time = time.perf_counter() - start_time if need_build else 0.0
+            if need_build:
+                stats.inc("graph_builds")
+                stats.record_time("graph_build_time", build_time)
+                if memory_before is not None:
+                    stats.record_memory(
+                        "graph_build_memory", device_memory_used_mb() - memory_before
+                    )
+            graph_pool.put(
+                input_structure_key, self._deployable_module_dpl_graph, build_time
+            )
+        return process_output(self, output)
 
     return wrapper
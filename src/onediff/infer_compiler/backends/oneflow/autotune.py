@@ -0,0 +1,339 @@
+"""Autotuning of the optimization options of OneflowCompileOptions.
+
+The options are searched greedily, one at a time: each value of an option is
+tried on top of the best options so far, and kept if the module gets faster
+while its outputs stay within `max_error` of the eager module. The best options
+are saved as a JSON profile, which `compile()` takes as `options`:
+
+    >>> result = autotune(unet, [((latents, t, embeds), {})], cache_dir="autotune")
+    >>> unet = compile(unet, backend="oneflow", options=result.profile_path)
+
+Profiles are cached per GPU model, module architecture and input signature in
+`cache_dir`, so later runs on the same GPU load the profile instead of searching.
+Thanks to per-module option scoping (see env_var.oneflow_env_vars_scope), trials
+don't leak their options into each other or into other modules. The options read
+as graphs run, ONEFLOW_RUN_TIME_ENV_VARS, are set for the whole of each trial.
+"""
+import dataclasses
+import gc
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+import oneflow as flow  # usort: skip
+
+from onediff.utils import logger
+from ..env_var import (
+    get_oneflow_env_vars,
+    oneflow_env_vars_scope,
+    ONEFLOW_RUN_TIME_ENV_VARS,
+    OneflowCompileOptions,
+)
+from .call_signature import flatten
+from .param_utils import clear_onediff_state
+
+__all__ = [
+    "AutotuneResult",
+    "DEFAULT_SEARCH_SPACE",
+    "autotune",
+    "load_autotune_profile",
+]
+
+_PROFILE_VERSION = 1
+
+# Options read when building graphs, the process-wide ones like run_graph_by_vm
+# are left out
+DEFAULT_SEARCH_SPACE: Dict[str, Tuple[Any, ...]] = {
+    "kernel_conv_enable_cutlass_impl": (True, False),
+    "kernel_gemm_enable_cutlass_impl": (True, False),
+    "kernel_enable_fused_conv_bias": (True, False),
+    "kernel_enable_fused_linear": (True, False),
+    "kernel_glu_enable_dual_gemm_impl": (True, False),
+    "conv_allow_half_precision_accumulation": (True, False),
+    "matmul_allow_half_precision_accumulation": (True, False),
+    "attention_allow_half_precision_accumulation": (True, False),
+    "mlir_fuse_forward_ops": (True, False),
+    "mlir_group_matmul": (True, False),
+    "mlir_prefer_nhwc": (True, False),
+    "kernel_enable_cuda_graph": (True, False),
+}
+
+
+@dataclasses.dataclass
+class AutotuneResult:
+    options: OneflowCompileOptions
+    # seconds per call of all example inputs
+    latency: float
+    baseline_latency: float
+    # max absolute difference to the outputs of the eager module
+    error: float
+    trials: List[Dict[str, Any]] = dataclasses.field(default_factory=list)
+    profile_path: Optional[str] = None
+
+    @property
+    def speedup(self) -> float:
+        return self.baseline_latency / self.latency
+
+
+def _options_to_dict(options: OneflowCompileOptions, fields) -> Dict[str, Any]:
+    return {
+        field: getattr(options, field)
+        for field in fields
+        if getattr(options, field) is not None
+    }
+
+
+def load_autotune_profile(
+    profile_path, options: Optional[OneflowCompileOptions] = None
+) -> OneflowCompileOptions:
+    """Returns `options`, new OneflowCompileOptions by default, updated by the
+    options of an autotune profile.
+    """
+    with open(profile_path, "r") as f:
+        profile = json.load(f)
+    if profile.get("version") != _PROFILE_VERSION:
+        raise RuntimeError(
+            f"Unsupported version {profile.get('version')} of autotune profile {profile_path}"
+        )
+    options = options if options is not None else OneflowCompileOptions()
+    return dataclasses.replace(options, **profile["options"])
+
+
+def _max_error(output, reference) -> float:
+    leaves, references = [], []
+    flatten(output, leaves)
+    flatten(reference, references)
+    if len(leaves) != len(references):
+        return float("inf")
+    error = 0.0
+    for leaf, ref in zip(leaves, references):
+        if isinstance(ref, torch.Tensor):
+            if not isinstance(leaf, torch.Tensor) or leaf.shape != ref.shape:
+                return float("inf")
+            diff = (leaf.float() - ref.float()).abs().max().item()
+            error = max(error, diff if diff == diff else float("inf"))
+    return error
+
+
+def _synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def _run(module, example_inputs):
+    return [module(*args, **kwargs) for args, kwargs in example_inputs]
+
+
+def _measure(module, example_inputs, warmup: int, iters: int) -> float:
+    for _ in range(warmup):
+        _run(module, example_inputs)
+    _synchronize()
+    start_time = time.perf_counter()
+    for _ in range(iters):
+        _run(module, example_inputs)
+    _synchronize()
+    return (time.perf_counter() - start_time) / iters
+
+
+def _device_name() -> str:
+    name = torch.cuda.get_device_name() if torch.cuda.is_available() else "cpu"
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+
+def _options_key(options: OneflowCompileOptions) -> str:
+    # Options that aren't plain values, e.g. shape_bucketing, by type only
+    return repr(
+        [
+            (
+                field.name,
+                value
+                if isinstance(value, (bool, int, float, str, tuple, type(None)))
+                else type(value).__qualname__,
+            )
+            for field in dataclasses.fields(options)
+            for value in (getattr(options, field.name),)
+        ]
+    )
+
+
+def _profile_key(
+    torch_module, example_inputs, search_space, max_error, base_options
+) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(f"{type(torch_module).__qualname__}\0{torch_module}".encode())
+    for args, kwargs in example_inputs:
+        leaves = []
+        spec = flatten((args, kwargs), leaves)
+        signature = [
+            (str(leaf.dtype), tuple(leaf.shape))
+            for leaf in leaves
+            if isinstance(leaf, torch.Tensor)
+        ]
+        hasher.update(f"{spec}{signature}".encode())
+    hasher.update(f"{sorted(search_space.items())}{max_error}".encode())
+    hasher.update(_options_key(base_options).encode())
+    hasher.update(f"oneflow={flow.__version__}".encode())
+    return hasher.hexdigest()[:16]
+
+
+def _greedy_search(
+    search_space: Dict[str, Sequence[Any]],
+    evaluate: Callable[[OneflowCompileOptions], Tuple[float, float]],
+    base_options: OneflowCompileOptions,
+    max_error: float,
+    min_improvement: float,
+):
+    """Returns the best options, their latency and error, the baseline latency and
+    every trial. `evaluate` returns (latency, error) and raises if the options fail.
+    """
+    trials = []
+
+    def trial(options):
+        record = _options_to_dict(options, search_space)
+        try:
+            latency, error = evaluate(options)
+        except Exception as e:
+            logger.warning(f"Autotune trial {record} failed: {e}")
+            trials.append({"options": record, "failure": str(e)})
+            return None, None
+        trials.append({"options": record, "latency": latency, "error": error})
+        logger.info(f"Autotune trial {record}: {latency * 1000:.2f}ms, error {error}")
+        return latency, error
+
+    best_options = base_options
+    best_latency, best_error = trial(base_options)
+    if best_latency is None:
+        raise RuntimeError("The module fails to run with the base options")
+    baseline_latency = best_latency
+    for field, values in search_space.items():
+        for value in values:
+            if getattr(best_options, field) == value:
+                continue
+            options = dataclasses.replace(best_options, **{field: value})
+            latency, error = trial(options)
+            if latency is None or error > max_error:
+                continue
+            if latency < best_latency * (1 - min_improvement):
+                best_options, best_latency, best_error = options, latency, error
+    return best_options, best_latency, best_error, baseline_latency, trials
+
+
+def autotune(
+    torch_module: torch.nn.Module,
+    example_inputs: Sequence[Tuple[Sequence[Any], Dict[str, Any]]],
+    *,
+    base_options: Optional[OneflowCompileOptions] = None,
+    search_space: Optional[Dict[str, Sequence[Any]]] = None,
+    max_error: float = 1e-2,
+    min_improvement: float = 0.01,
+    warmup: int = 2,
+    iters: int = 10,
+    cache_dir: Optional[str] = None,
+) -> AutotuneResult:
+    """Searches the optimization options of OneflowCompileOptions for `torch_module`.
+
+    Args:
+        example_inputs: representative (args, kwargs) of the module, all of them are
+            run in every trial.
+        base_options: the options to start from, their graph related options are kept.
+        search_space: option name -> the values to try, DEFAULT_SEARCH_SPACE by default.
+        max_error: the max absolute difference to the outputs of the eager module.
+        min_improvement: the fraction of latency an option must save to be kept.
+        cache_dir: the directory of cached profiles, searched per GPU model.
+
+    Returns:
+        An AutotuneResult, whose `profile_path` is set if `cache_dir` is.
+    """
+    from .oneflow import compile
+
+    search_space = dict(search_space or DEFAULT_SEARCH_SPACE)
+    base_options = base_options if base_options is not None else OneflowCompileOptions()
+    example_inputs = [(tuple(args), dict(kwargs)) for args, kwargs in example_inputs]
+
+    profile_path = None
+    if cache_dir is not None:
+        key = _profile_key(
+            torch_module, example_inputs, search_space, max_error, base_options
+        )
+        profile_path = os.path.join(cache_dir, _device_name(), f"{key}.json")
+        if os.path.exists(profile_path):
+            with open(profile_path, "r") as f:
+                profile = json.load(f)
+            logger.info(f"Loaded autotune profile {profile_path}")
+            return AutotuneResult(
+                options=load_autotune_profile(profile_path, base_options),
+                latency=profile["latency"],
+                baseline_latency=profile["baseline_latency"],
+                error=profile["error"],
+                trials=profile["trials"],
+                profile_path=profile_path,
+            )
+
+    with torch.inference_mode():
+        references = _run(torch_module, example_inputs)
+
+    def evaluate(options):
+        run_time_env_vars = {
+            name: value
+            for name, value in get_oneflow_env_vars(options).items()
+            if name in ONEFLOW_RUN_TIME_ENV_VARS
+        }
+        with oneflow_env_vars_scope(run_time_env_vars):
+            return evaluate_in_scope(options)
+
+    def evaluate_in_scope(options):
+        compiled_module = compile(torch_module, options=dataclasses.replace(options))
+        try:
+            with torch.inference_mode():
+                outputs = _run(compiled_module, example_inputs)
+                error = max(
+                    _max_error(output, reference)
+                    for output, reference in zip(outputs, references)
+                )
+                latency = _measure(compiled_module, example_inputs, warmup, iters)
+            return latency, error
+        finally:
+            del compiled_module
+            # Every trial compiles the same module, not to stack their hooks
+            clear_onediff_state(torch_module)
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    options, latency, error, baseline_latency, trials = _greedy_search(
+        search_space, evaluate, base_options, max_error, min_improvement
+    )
+    result = AutotuneResult(
+        options=options,
+        latency=latency,
+        baseline_latency=baseline_latency,
+        error=error,
+        trials=trials,
+        profile_path=profile_path,
+    )
+    logger.info(
+        f"Autotuned {type(torch_module).__name__}: {_options_to_dict(options, search_space)}, "
+        f"{result.speedup:.2f}x faster than the base options"
+    )
+
+    if profile_path is not None:
+        os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+        profile = {
+            "version": _PROFILE_VERSION,
+            "device": _device_name(),
+            "module": type(torch_module).__name__,
+            "options": _options_to_dict(options, search_space),
+            "latency": latency,
+            "baseline_latency": baseline_latency,
+            "error": error,
+            "trials": trials,
+        }
+        tmp_path = f"{profile_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(profile, f, indent=2)
+        os.replace(tmp_path, profile_path)
+    return result
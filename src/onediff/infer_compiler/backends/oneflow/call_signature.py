@@ -0,0 +1,213 @@
+"""Cached flatten/unflatten plans of call arguments.
+
+`ArgsTree` rebuilds its tree and the input structure key hashes a joined string
+of node type names on every call. Instead, arguments are flattened into a list
+of leaves and a spec, a hashable tuple describing the containers and leaf types.
+The plan of a spec, i.e. its structure key and the positions of its tensors, is
+compiled once, and reused without even hashing the spec when it equals the spec
+of the previous call.
+"""
+import collections
+import dataclasses
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+from oneflow.framework.args_tree import ArgsTree
+
+from .utils.hash_utils import generate_input_structure_key
+
+__all__ = [
+    "CallPlan",
+    "CallSignatureCache",
+    "flatten",
+    "generate_call_graph_pool_key",
+    "unflatten",
+]
+
+_SEQUENCE_TYPES = (tuple, list)
+_MAPPING_TYPES = (dict, collections.OrderedDict)
+
+# Kinds of container specs
+_SEQUENCE = 0
+_MAPPING = 1
+_NAMEDTUPLE = 2
+_DATACLASS = 3
+
+_dataclass_field_names: Dict[type, Tuple[str, ...]] = {}
+
+
+def _get_dataclass_field_names(value_type) -> Tuple[str, ...]:
+    names = _dataclass_field_names.get(value_type, None)
+    if names is None:
+        names = tuple(field.name for field in dataclasses.fields(value_type))
+        _dataclass_field_names[value_type] = names
+    return names
+
+
+def flatten(value, leaves: List[Any]):
+    """Appends the leaves of `value` to `leaves` and returns the spec of `value`.
+
+    The spec of a leaf is its type, the spec of a container is a tuple
+    (kind, container type, keys, specs of children).
+    """
+    value_type = type(value)
+    if value_type in _SEQUENCE_TYPES:
+        return (_SEQUENCE, value_type, None, tuple([flatten(v, leaves) for v in value]))
+    if value_type in _MAPPING_TYPES:
+        return (
+            _MAPPING,
+            value_type,
+            tuple(value.keys()),
+            tuple([flatten(v, leaves) for v in value.values()]),
+        )
+    if hasattr(value_type, "__dataclass_fields__"):
+        names = _get_dataclass_field_names(value_type)
+        children = tuple([flatten(getattr(value, name), leaves) for name in names])
+        return (_DATACLASS, value_type, names, children)
+    if isinstance(value, tuple) and hasattr(value_type, "_fields"):
+        children = tuple([flatten(v, leaves) for v in value])
+        return (_NAMEDTUPLE, value_type, None, children)
+    leaves.append(value)
+    return value_type
+
+
+def _unflatten(spec, leaves_iter):
+    if type(spec) is not tuple:
+        return next(leaves_iter)
+    kind, value_type, keys, children = spec
+    values = [_unflatten(child, leaves_iter) for child in children]
+    if kind == _SEQUENCE:
+        return value_type(values)
+    if kind == _MAPPING:
+        return value_type(zip(keys, values))
+    if kind == _DATACLASS:
+        return value_type(**dict(zip(keys, values)))
+    return value_type(*values)
+
+
+def unflatten(spec, leaves: List[Any]):
+    """Rebuilds a value of `spec` from its leaves."""
+    return _unflatten(spec, iter(leaves))
+
+
+def _leaf_types(spec, types: List[type]) -> None:
+    if type(spec) is not tuple:
+        types.append(spec)
+        return
+    for child in spec[3]:
+        _leaf_types(child, types)
+
+
+def _leaf_paths(spec, path: str, paths: List[str]) -> None:
+    if type(spec) is not tuple:
+        paths.append(path)
+        return
+    kind, _, keys, children = spec
+    for i, child in enumerate(children):
+        if kind == _MAPPING:
+            child_path = f"{path}[{keys[i]!r}]"
+        elif kind == _DATACLASS:
+            child_path = f"{path}.{keys[i]}"
+        else:
+            child_path = f"{path}[{i}]"
+        _leaf_paths(child, child_path, paths)
+
+
+def _call_leaf_paths(spec) -> List[str]:
+    """Paths of the leaves of (args, kwargs), like args[0] or kwargs['sample']."""
+    paths = []
+    if type(spec) is tuple and spec[0] == _SEQUENCE and len(spec[3]) == 2:
+        args_spec, kwargs_spec = spec[3]
+        _leaf_paths(args_spec, "args", paths)
+        if type(kwargs_spec) is tuple and kwargs_spec[0] == _MAPPING:
+            for key, child in zip(kwargs_spec[2], kwargs_spec[3]):
+                _leaf_paths(child, key, paths)
+        else:
+            _leaf_paths(kwargs_spec, "kwargs", paths)
+    else:
+        _leaf_paths(spec, "", paths)
+    return paths
+
+
+class CallPlan:
+    """The compiled plan of a spec."""
+
+    __slots__ = ("spec", "structure_key", "tensor_indices", "_tensor_paths")
+
+    def __init__(self, spec, value, tensor_type, with_structure_key=True):
+        self.spec = spec
+        # Same key as ArgsTree based callers, e.g. OneflowDeployableModule.pin_graph
+        self.structure_key = (
+            generate_input_structure_key(
+                ArgsTree(value, False, tensor_type=tensor_type)
+            )
+            if with_structure_key
+            else None
+        )
+        types = []
+        _leaf_types(spec, types)
+        self.tensor_indices = tuple(
+            i for i, leaf_type in enumerate(types) if issubclass(leaf_type, tensor_type)
+        )
+        self._tensor_paths = None
+
+    @property
+    def tensor_paths(self) -> List[str]:
+        """Paths of the tensors in the call arguments, for reporting."""
+        if self._tensor_paths is None:
+            paths = _call_leaf_paths(self.spec)
+            self._tensor_paths = [paths[i] for i in self.tensor_indices]
+        return self._tensor_paths
+
+    def tensors(self, leaves: List[Any]):
+        return (leaves[i] for i in self.tensor_indices)
+
+    def map_tensors(self, leaves: List[Any], fn: Callable[[Any], Any]) -> List[Any]:
+        for i in self.tensor_indices:
+            leaves[i] = fn(leaves[i])
+        return leaves
+
+    def unflatten(self, leaves: List[Any]):
+        return unflatten(self.spec, leaves)
+
+
+class CallSignatureCache:
+    """Plans of the specs seen so far, at most `max_size` of them."""
+
+    def __init__(self, tensor_type, max_size=64, with_structure_key=True):
+        self.tensor_type = tensor_type
+        self.max_size = max_size
+        self.with_structure_key = with_structure_key
+        self._plans: Dict[Any, CallPlan] = {}
+        self._last: Optional[Tuple[Any, CallPlan]] = None
+
+    def flatten(self, value) -> Tuple[List[Any], CallPlan]:
+        leaves = []
+        spec = flatten(value, leaves)
+        return leaves, self.get_plan(spec, value)
+
+    def get_plan(self, spec, value) -> CallPlan:
+        # Read once, another thread may replace it
+        last = self._last
+        if last is not None and last[0] == spec:
+            return last[1]
+        plan = self._plans.get(spec, None)
+        if plan is None:
+            plan = CallPlan(spec, value, self.tensor_type, self.with_structure_key)
+            if len(self._plans) >= self.max_size:
+                self._plans.clear()
+            self._plans[spec] = plan
+        self._last = (spec, plan)
+        return plan
+
+
+_call_signature_cache = CallSignatureCache(torch.Tensor)
+
+
+def generate_call_graph_pool_key(deployable_module, args, kwargs) -> str:
+    """The graph pool key of torch inputs, the same as input_output_processor computes."""
+    leaves, plan = _call_signature_cache.flatten((args, kwargs))
+    input_signature = deployable_module._deployable_module_input_signature
+    return input_signature.key(
+        input_signature.signature(plan.structure_key, plan.tensors(leaves))
+    )
@@ -1,27 +1,45 @@
+import dataclasses
+import os
+import threading
+import time
 import types
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps
+from typing import List, Optional
 
 import torch
 
 import oneflow as flow  # usort: skip
 
 from onediff.utils import logger
-from onediff.utils.chache_utils import LRUCache
 
 from ..deployable_module import DeployableModule
-from ..env_var import OneflowCompileOptions
+from ..env_var import (
+    get_oneflow_env_vars,
+    ONEFLOW_RUN_TIME_ENV_VARS,
+    OneflowCompileOptions,
+    set_oneflow_process_env_vars,
+)
+from ..static_io_buffers import StaticIOBuffers
+from ..stats import ModuleStats
 from .args_tree_util import input_output_processor
+from .call_signature import generate_call_graph_pool_key
 
 from .dual_module import DualModule, get_mixed_dual_module
+from .graph_file_format import rebind_graph_states
 from .graph_management_utils import graph_file_management
+from .graph_pool import GraphPool, InputSignature
 from .oneflow_exec_mode import oneflow_exec_mode, oneflow_exec_mode_enabled
 from .online_quantization_utils import quantize_and_deploy_wrapper
+from .param_sharing import ParamSharingReport, verify_param_sharing
 from .param_utils import (
     check_device,
     generate_constant_folding_info,
     parse_device,
+    replicate_torch_module,
     update_graph_with_constant_folding_info,
 )
+from .rebind_weights import rebind_weights, RebindWeightsReport
 from .transform.builtin_transform import torch2oflow
 
 from .transform.manager import transform_mgr
@@ -40,10 +58,10 @@ def handle_deployable_exception(func):
     return wrapper
 
 
-def get_oneflow_graph(model, size=9, dynamic_graph=True):
+def get_oneflow_graph(model, size=9, dynamic_graph=True, env_vars=None):
     from .graph import OneflowGraph
 
-    g = OneflowGraph(model)
+    g = OneflowGraph(model, env_vars)
     g._dynamic_input_graph_cache.set_cache_size(size)
     g._dynamic_input_graph_cache.enable_shared(dynamic_graph)
     return g
@@ -71,12 +89,54 @@ class OneflowDeployableModule(DeployableModule):
             options if options is not None else OneflowCompileOptions()
         )
         self._deployable_module_dpl_graph = None
-        self._deployable_module_graph_cache = LRUCache(
-            self._deployable_module_options.max_cached_graph_size
+        self._deployable_module_graph_cache = GraphPool(
+            self._deployable_module_options.max_cached_graph_size,
+            self._deployable_module_options.pin_graph_after_hits,
+        )
+        self._deployable_module_input_signature = InputSignature(
+            self._deployable_module_options.input_signature,
+            self._deployable_module_options.shape_bucketing,
+        )
+        # Persistent inputs and outputs of the graphs, see static_io_buffers.py
+        self._deployable_module_static_io_buffers = (
+            StaticIOBuffers(
+                self._deployable_module_options.max_cached_graph_size,
+                input_fn=flow.utils.tensor.from_torch,
+                # The outputs of a graph replayed by CUDA graphs are views of its
+                # output buffers, reused by every run
+                persistent_outputs=bool(
+                    self._deployable_module_options.kernel_enable_cuda_graph
+                ),
+            )
+            if self._deployable_module_options.static_io_buffers
+            else None
+        )
+        self._deployable_module_stats = ModuleStats(type(torch_module).__name__)
+        # ONEFLOW_* environment variables of the options, set while compiling graphs
+        self._deployable_module_env_vars = get_oneflow_env_vars(
+            self._deployable_module_options
+        )
+        run_time_env_vars = [
+            name
+            for name, value in self._deployable_module_env_vars.items()
+            if name in ONEFLOW_RUN_TIME_ENV_VARS and os.environ.get(name) != value
+        ]
+        if run_time_env_vars:
+            logger.warning(
+                f"{run_time_env_vars} are read as graphs run and take the values of the process, set them with set_oneflow_env_vars instead"
+            )
+        set_oneflow_process_env_vars(
+            self._deployable_module_env_vars, type(torch_module).__name__
         )
         self._is_raw_deployable_module = True
         self._load_graph_first_run = True
         self._deployable_module_input_structure_key = None
+        self._deployable_module_compile_executor = None
+        self._deployable_module_compile_futures = {}
+        # graph being compiled by the current (background) thread
+        self._deployable_module_building_graph = threading.local()
+        # set by warmup, which compiles in the current thread whatever the options
+        self._deployable_module_compile_in_foreground = threading.local()
 
     @classmethod
     def from_existing(cls, existing_module, dynamic=True, options=None):
@@ -91,6 +151,19 @@ class OneflowDeployableModule(DeployableModule):
         instance._deployable_module_graph_cache = (
             existing_module._deployable_module_graph_cache
         )
+        instance._deployable_module_compile_futures = (
+            existing_module._deployable_module_compile_futures
+        )
+        instance._deployable_module_input_signature = (
+            existing_module._deployable_module_input_signature
+        )
+        if instance._deployable_module_static_io_buffers is not None and getattr(
+            existing_module, "_deployable_module_static_io_buffers", None
+        ):
+            instance._deployable_module_static_io_buffers = (
+                existing_module._deployable_module_static_io_buffers
+            )
+        instance._deployable_module_stats = existing_module._deployable_module_stats
         instance._load_graph_first_run = existing_module._load_graph_first_run
         instance._deployable_module_input_structure_key = (
             existing_module._deployable_module_input_structure_key
@@ -101,23 +174,123 @@ class OneflowDeployableModule(DeployableModule):
 
         return instance
 
-    def get_graph(self):
-        if self._deployable_module_dpl_graph is not None:
-            return self._deployable_module_dpl_graph
-        self._deployable_module_dpl_graph = get_oneflow_graph(
+    def _create_graph(self):
+        if self._deployable_module_options.strict_param_sharing:
+            verify_param_sharing(self, strict=True)
+        dpl_graph = get_oneflow_graph(
             self._deployable_module_model.oneflow_module,
             self._deployable_module_options.max_cached_graph_size,
             self._deployable_module_enable_dynamic,
+            self._deployable_module_env_vars,
         )
         # Enable debug mode
         if transform_mgr.debug_mode:
-            self._deployable_module_dpl_graph.debug(0)
+            dpl_graph.debug(0)
         if self._deployable_module_options.debug_level > 0:
-            self._deployable_module_dpl_graph.debug(
-                self._deployable_module_options.debug_level
-            )
+            dpl_graph.debug(self._deployable_module_options.debug_level)
+        return dpl_graph
+
+    def get_graph(self):
+        building_graph = getattr(self._deployable_module_building_graph, "graph", None)
+        if building_graph is not None:
+            return building_graph
+        if self._deployable_module_dpl_graph is not None:
+            return self._deployable_module_dpl_graph
+        self._deployable_module_dpl_graph = self._create_graph()
         return self._deployable_module_dpl_graph
 
+    def _compile_graph_in_background(self, key, func, *args, **kwargs) -> Future:
+        """Compiles the graph of `key` on a background thread by running `func` with
+        a new graph, then puts the graph into the graph pool.
+        """
+
+        def build():
+            stats = self._deployable_module_stats
+            start_time = time.perf_counter()
+            self._deployable_module_building_graph.graph = self._create_graph()
+            try:
+                func(self, *args, **kwargs)
+                dpl_graph = self._deployable_module_building_graph.graph
+            finally:
+                self._deployable_module_building_graph.graph = None
+            build_time = time.perf_counter() - start_time
+            stats.inc("graph_builds")
+            stats.record_time("graph_build_time", build_time)
+            self._deployable_module_graph_cache.put(key, dpl_graph, build_time)
+            logger.info(f"Graph {key} compiled in background in {build_time:.2f}s")
+            return key
+
+        def log_exception(future):
+            if future.exception() is not None:
+                logger.error(
+                    f"Failed to compile graph {key} in background, keep running eagerly. {future.exception()}"
+                )
+
+        if self._deployable_module_compile_executor is None:
+            self._deployable_module_compile_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="onediff_graph_compile"
+            )
+        future = self._deployable_module_compile_executor.submit(build)
+        future.add_done_callback(log_exception)
+        self._deployable_module_compile_futures[key] = future
+        return future
+
+    def get_compile_future(self, *args, **kwargs) -> Optional[Future]:
+        """Returns the future of the background compilation of the graph serving the
+        given example inputs, or None if no background compilation was started for them.
+
+        The result of the future is the graph pool key once the graph is ready, e.g.
+            >>> future = unet.get_compile_future(latents, t, encoder_hidden_states)
+            >>> future.add_done_callback(lambda f: print(f"{f.result()} is hot"))
+        """
+        key = generate_call_graph_pool_key(self, args, kwargs)
+        return self._deployable_module_compile_futures.get(key, None)
+
+    def warmup(self, manifest, input_fn=None, *, raise_on_error=True):
+        """Compiles, or loads from `graph_file`, the graph of every manifest entry ahead of time.
+
+        Args:
+            manifest: a list of WarmupShape, (height, width, batch_size, dtype, kwargs) tuples,
+                dicts, explicit (args, kwargs) pairs, or a JSON file of such a list.
+            input_fn: builds the (args, kwargs) of this module from a WarmupShape.
+
+        Returns:
+            A list of WarmupResult with the compile time and device memory of each entry.
+
+        Example:
+            >>> def unet_inputs(shape):
+            ...     latents = torch.randn(shape.batch_size * 2, 4, shape.height // 8, shape.width // 8,
+            ...                           dtype=shape.dtype, device="cuda")
+            ...     embeds = torch.randn(shape.batch_size * 2, 77, 768, dtype=shape.dtype, device="cuda")
+            ...     return (latents, 999, embeds), {}
+            >>> unet.warmup([(512, 512, 1, torch.float16), (768, 768, 2, torch.float16)], unet_inputs)
+        """
+        from ..warmup import (
+            make_module_inputs,
+            parse_module_warmup_manifest,
+            run_warmup,
+        )
+
+        manifest = parse_module_warmup_manifest(manifest)
+
+        def run(entry):
+            args, kwargs = make_module_inputs(entry, input_fn)
+            with torch.inference_mode():
+                self(*args, **kwargs)
+
+        # Not by changing the options, they may be shared with other modules and threads
+        compile_in_foreground = self._deployable_module_compile_in_foreground
+        compile_in_foreground.enabled = True
+        try:
+            return run_warmup(run, manifest, raise_on_error=raise_on_error)
+        finally:
+            compile_in_foreground.enabled = False
+
+    def wait_for_background_compilation(self, timeout=None) -> None:
+        """Blocks until all graphs being compiled in background are ready."""
+        for future in list(self._deployable_module_compile_futures.values()):
+            future.exception(timeout=timeout)
+
     @handle_deployable_exception
     @graph_file_management
     @input_output_processor
@@ -148,6 +321,8 @@ class OneflowDeployableModule(DeployableModule):
         return output
 
     def to(self, *args, **kwargs):
+        if self._deployable_module_static_io_buffers is not None:
+            self._deployable_module_static_io_buffers.clear()
         if self._deployable_module_dpl_graph is None:
             self._deployable_module_model.to(*args, **kwargs)
             return self
@@ -164,6 +339,8 @@ class OneflowDeployableModule(DeployableModule):
                     f"After graph built, the device of graph can't be modified, current device: {current_device}, target device: {target_device}"
                 )
         self._deployable_module_model.to(*args, **kwargs)
+        if self._deployable_module_options.strict_param_sharing:
+            verify_param_sharing(self, strict=True)
         return self
 
     # TODO(): Just for transformers VAE decoder
@@ -198,8 +375,12 @@ class OneflowDeployableModule(DeployableModule):
         update_graph_with_constant_folding_info(self)
         self._load_graph_first_run = False
 
-    def save_graph(self, file_path, *, process_state_dict=lambda x: x):
-        self.get_graph().save_graph(file_path, process_state_dict=process_state_dict)
+    def save_graph(self, file_path, *, process_state_dict=None, file_format=None):
+        if file_format is None:
+            file_format = self._deployable_module_options.graph_file_format
+        self.get_graph().save_graph(
+            file_path, process_state_dict=process_state_dict, file_format=file_format
+        )
 
     def extra_repr(self) -> str:
         return self._deployable_module_model.extra_repr()
@@ -222,11 +403,115 @@ class OneflowDeployableModule(DeployableModule):
         self._load_graph_first_run = True
         self._deployable_module_dpl_graph = None
         self._deployable_module_input_structure_key = None
+        self._deployable_module_graph_cache.clear()
         del self._deployable_module_model.oneflow_module
 
     def get_graph_file(self):
         return self._deployable_module_options.graph_file
 
+    def pin_graph(self, *args, **kwargs):
+        """Pins the graph serving the given example inputs so that it is never
+        evicted from the graph pool. The graph must have been built already.
+        """
+        key = generate_call_graph_pool_key(self, args, kwargs)
+        self._deployable_module_graph_cache.pin(key)
+
+    def replicate(
+        self, devices, torch_modules=None, run_warmup=True
+    ) -> List["OneflowDeployableModule"]:
+        """Deploys the graphs built by this module to other devices in this process,
+        without compiling them again.
+
+        The runtime state dict of every graph in the graph pool is taken once, converted
+        to each device by `flow.nn.Graph.runtime_state_dict_to` and loaded into a new
+        deployable module, whose graph variables are rebound to its own weights.
+
+        To deploy to sibling processes instead, save the graph with
+        `save_graph(path, file_format="weightless")` and set `graph_file_device`
+        in the other processes.
+
+        Args:
+            devices: the target devices, e.g. ["cuda:1", "cuda:2", "cuda:3"].
+            torch_modules: torch modules already on the target devices, one per device.
+                By default, the torch module is copied to every device, see
+                param_utils.replicate_torch_module.
+            run_warmup: whether to run the loaded graphs once.
+
+        Returns:
+            A deployable module per device.
+        """
+        from .oneflow import compile
+
+        graphs = self._deployable_module_graph_cache.items()
+        if len(graphs) == 0 and self._deployable_module_dpl_graph is not None:
+            graphs = [
+                (
+                    self._deployable_module_input_structure_key,
+                    self._deployable_module_dpl_graph,
+                )
+            ]
+        if len(graphs) == 0:
+            raise RuntimeError("The graph of deployable_module is not built yet")
+        if torch_modules is not None and len(torch_modules) != len(devices):
+            raise ValueError("torch_modules must have one module per device")
+
+        state_dicts = [(key, graph.get_runtime_state_dict()) for key, graph in graphs]
+        replicas = []
+        for i, device in enumerate(devices):
+            device = flow.device(str(device))
+            if torch_modules is not None:
+                torch_module = torch_modules[i]
+            else:
+                torch_module = replicate_torch_module(self._torch_module, str(device))
+            replica = compile(
+                torch_module,
+                options=dataclasses.replace(self._deployable_module_options),
+            )
+            for key, state_dict in state_dicts:
+                # A new graph for every key
+                replica._deployable_module_dpl_graph = None
+                state_dict = rebind_graph_states(
+                    state_dict, replica._deployable_module_model.oneflow_module, device
+                )
+                replica.load_graph(None, device, run_warmup, state_dict=state_dict)
+                if key is not None:
+                    replica._deployable_module_graph_cache.put(
+                        key, replica._deployable_module_dpl_graph
+                    )
+                replica._deployable_module_input_structure_key = key
+            logger.info(f"Replicated {len(state_dicts)} graphs to {device}")
+            replicas.append(replica)
+        return replicas
+
+    def verify_param_sharing(self, strict=False) -> ParamSharingReport:
+        """Reports the parameters and buffers whose memory is not shared between the
+        torch and oneflow modules, and the memory saved by those that are.
+
+        Example:
+            >>> report = unet.verify_param_sharing()
+            >>> print(report)
+            686 tensors shared (4897.3 MB saved), 0 not shared (0.0 MB duplicated)
+        """
+        return verify_param_sharing(self, strict=strict)
+
+    def rebind_weights(self, state_dict, strict=True) -> RebindWeightsReport:
+        """Switches the module to a checkpoint of the same architecture by copying
+        `state_dict` into the module and its graphs in place, without compiling or
+        loading graphs again.
+
+        Example:
+            >>> report = unet.rebind_weights(load_file("another_finetune.safetensors"))
+            >>> print(report)
+            686 tensors updated (3278.8 MB), 0 unchanged, 0 graph variables updated
+        """
+        return rebind_weights(self, state_dict, strict=strict)
+
+    def graph_pool_stats(self):
+        """Returns the hits, misses, build time and the reason of the first miss
+        (the arguments whose signature changed) of every graph in the graph pool.
+        """
+        return self._deployable_module_graph_cache.stats()
+
     def apply_online_quant(self, quant_config):
         """
         Applies the provided quantization configuration for online use.
@@ -1,6 +1,16 @@
+import os
+
 import oneflow as flow  # usort: skip
 
 from onediff.utils import logger
+from ..env_var import oneflow_env_vars_scope
+from .graph_file_format import (
+    copy_graph_file,
+    get_graph_file_format,
+    is_split_graph_file,
+    load_graph_file,
+    save_graph_file,
+)
 from .transform.builtin_transform import reverse_proxy_class
 from .transform.manager import transform_mgr
 from .utils.cost_util import cost_cnt
@@ -8,9 +18,11 @@ from .utils.cost_util import cost_cnt
 
 class OneflowGraph(flow.nn.Graph):
     @flow.nn.Graph.with_dynamic_input_shape()
-    def __init__(self, model):
+    def __init__(self, model, env_vars=None):
         super().__init__(enable_get_runtime_state_dict=True)
         self.model = model
+        # ONEFLOW_* environment variables of the module, read while compiling
+        self.env_vars = env_vars or {}
         logger.info(f"Building a graph for {model.__class__.__name__} ...")
         # self.config.enable_cudnn_conv_heuristic_search_algo(False)
         self.config.allow_fuse_add_to_output(True)
@@ -18,20 +30,54 @@ class OneflowGraph(flow.nn.Graph):
     def build(self, *args, **kwargs):
         return self.model(*args, **kwargs)
 
+    def _compile(self, *args, **kwargs):
+        # Only the compilation is in the scope, the runs of the graph don't lock
+        with oneflow_env_vars_scope(self.env_vars):
+            return super()._compile(*args, **kwargs)
+
     @cost_cnt(transform_mgr.debug_mode)
     def load_graph(self, file_path, device=None, run_warmup=True, *, state_dict=None):
-        state_dict = state_dict if state_dict is not None else flow.load(file_path)
-        self.graph_state_dict = state_dict  # used for OneflowGraph.save_graph
+        if state_dict is None and is_split_graph_file(file_path):
+            state_dict = load_graph_file(file_path, device, live_module=self.model)
+            # Keep the file instead of the variables for OneflowGraph.save_graph
+            self.graph_file_source = file_path
+        else:
+            state_dict = state_dict if state_dict is not None else flow.load(file_path)
+            self.graph_state_dict = state_dict  # used for OneflowGraph.save_graph
 
         if device is not None:
             state_dict = flow.nn.Graph.runtime_state_dict_to(state_dict, device)
 
-        self.load_runtime_state_dict(state_dict, warmup_with_run=run_warmup)
+        with oneflow_env_vars_scope(self.env_vars):
+            self.load_runtime_state_dict(state_dict, warmup_with_run=run_warmup)
 
-    @cost_cnt(transform_mgr.debug_mode)
-    def save_graph(self, file_path, *, process_state_dict: lambda x: x):
+    def get_runtime_state_dict(self):
+        """The runtime state dict of the graph, the loaded one if the graph was loaded."""
         if hasattr(self, "graph_state_dict"):
-            flow.save(self.graph_state_dict, file_path)
+            return self.graph_state_dict
+        return self.runtime_state_dict()
+
+    @cost_cnt(transform_mgr.debug_mode)
+    def save_graph(self, file_path, *, process_state_dict=None, file_format="full"):
+        graph_file_source = getattr(self, "graph_file_source", None)
+        if graph_file_source is not None and os.path.exists(graph_file_source):
+            # The file is copied as it is if nothing would change it
+            if (
+                process_state_dict is None
+                and get_graph_file_format(graph_file_source) == file_format
+            ):
+                copy_graph_file(graph_file_source, file_path)
+                return
+            # Variables owned by the module are aliased, not read from the file
+            state_dict = load_graph_file(graph_file_source, live_module=self.model)
+        elif hasattr(self, "graph_state_dict"):
+            state_dict = self.graph_state_dict
+        else:
+            state_dict = None
+        if state_dict is not None:
+            if process_state_dict is not None:
+                state_dict = process_state_dict(state_dict)
+            save_graph_file(state_dict, file_path, file_format, live_module=self.model)
             return
 
         state_dict = self.runtime_state_dict()
@@ -61,5 +107,6 @@ class OneflowGraph(flow.nn.Graph):
 
         args_tree._is_dataclass = original_is_dataclass
 
-        state_dict = process_state_dict(state_dict)
-        flow.save(state_dict, file_path)
+        if process_state_dict is not None:
+            state_dict = process_state_dict(state_dict)
+        save_graph_file(state_dict, file_path, file_format, live_module=self.model)
@@ -0,0 +1,315 @@
+"""A content-addressed on-disk store of compiled graph files.
+
+Layout of a cache directory:
+    index.json             key -> {file, size, mtime, checksum, created, last_access, meta}
+    .lock                  lock file serializing index updates between processes
+    ab/abcdef....graph     graph files, named by their cache key
+    ab/abcdef....graph.pin lock file pinning a graph file while it's loaded
+
+Graph files are written to a temporary path and renamed into place, so several
+workers can share one cache directory. The checksum of a graph file is computed
+once, when it's put. Lookups compare its size and mtime, and verify the checksum
+outside of the index lock the first time a process loads the entry, unless
+`verify_checksum` is False. A graph file pinned by a process is neither evicted
+nor replaced until it's unpinned.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from onediff.utils import logger
+
+__all__ = ["GraphCacheStore", "get_graph_cache_store"]
+
+_INDEX_VERSION = 1
+
+
+def _path_size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(path)
+            for name in files
+        )
+    return os.path.getsize(path)
+
+
+def _path_checksum(path: str) -> str:
+    hasher = hashlib.sha256()
+
+    def update(file_path):
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                hasher.update(chunk)
+
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                hasher.update(os.path.relpath(file_path, path).encode("utf-8"))
+                update(file_path)
+    else:
+        update(path)
+    return hasher.hexdigest()
+
+
+def _path_mtime(path: str) -> int:
+    if os.path.isdir(path):
+        return max(
+            [os.stat(path).st_mtime_ns]
+            + [
+                os.stat(os.path.join(root, name)).st_mtime_ns
+                for root, _, files in os.walk(path)
+                for name in files
+            ]
+        )
+    return os.stat(path).st_mtime_ns
+
+
+def _remove_path(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class GraphCacheStore:
+    """Stores graph files by cache key, with checksums and size-bounded LRU eviction.
+
+    Args:
+        cache_dir: the directory of the store.
+        max_size: the max total size of graph files in bytes, None for unbounded.
+        verify_checksum: whether to verify the checksum of a graph file before its
+            first load by this store, besides its size and mtime. It reads the
+            whole file once per entry.
+    """
+
+    def __init__(
+        self, cache_dir: str, max_size: Optional[int] = None, verify_checksum=True
+    ):
+        self.cache_dir = str(cache_dir)
+        self.max_size = max_size
+        self.verify_checksum = verify_checksum
+        # (key, checksum) of the entries verified already
+        self._verified = set()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index_path = os.path.join(self.cache_dir, "index.json")
+        self._lock_path = os.path.join(self.cache_dir, ".lock")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self._index_path):
+            return {}
+        try:
+            with open(self._index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(
+                f"Graph cache index {self._index_path} is broken, reset it. {e}"
+            )
+            return {}
+        if index.get("version") != _INDEX_VERSION:
+            logger.warning(
+                f"Graph cache index version {index.get('version')} is not supported, reset it."
+            )
+            return {}
+        return index.get("entries", {})
+
+    def _write_index(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        tmp_path = f"{self._index_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": _INDEX_VERSION, "entries": entries}, f, indent=1)
+        os.replace(tmp_path, self._index_path)
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.graph")
+
+    def _pin_path(self, file_path: str) -> str:
+        return f"{file_path}.pin"
+
+    def _try_lock_unpinned(self, file_path: str):
+        """Returns the pin file of `file_path` locked exclusively, or None if it's
+        pinned. Called with the index lock held.
+        """
+        pin_file = open(self._pin_path(file_path), "a")
+        try:
+            fcntl.flock(pin_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            pin_file.close()
+            return None
+        return pin_file
+
+    def _remove_unpinned(self, file_path: str) -> bool:
+        pin_file = self._try_lock_unpinned(file_path)
+        if pin_file is None:
+            return False
+        try:
+            _remove_path(file_path)
+            _remove_path(self._pin_path(file_path))
+        finally:
+            pin_file.close()
+        return True
+
+    def _stat_matches(self, file_path: str, entry: Dict[str, Any]) -> bool:
+        if not os.path.exists(file_path):
+            return False
+        if _path_size(file_path) != entry["size"]:
+            return False
+        return entry.get("mtime") is None or _path_mtime(file_path) == entry["mtime"]
+
+    def _drop_corrupted(self, key: str, file_path: str) -> None:
+        logger.warning(f"Graph cache file {file_path} is corrupted, remove it.")
+        entries = self._read_index()
+        entry = entries.get(key, None)
+        if (
+            entry is not None
+            and os.path.join(self.cache_dir, entry["file"]) == file_path
+        ):
+            del entries[key]
+            self._write_index(entries)
+        self._remove_unpinned(file_path)
+
+    @contextlib.contextmanager
+    def pin(self, key: str):
+        """Yields the path of the graph file of `key`, or None if it's missing or
+        corrupted. The file is neither evicted nor replaced until the context exits.
+        """
+        pin_file = None
+        with self._locked():
+            entries = self._read_index()
+            entry = entries.get(key, None)
+            file_path = None
+            if entry is not None:
+                file_path = os.path.join(self.cache_dir, entry["file"])
+                if not self._stat_matches(file_path, entry):
+                    self._drop_corrupted(key, file_path)
+                    file_path = None
+                else:
+                    # Shared, so any number of processes can load it at once
+                    pin_file = open(self._pin_path(file_path), "a")
+                    fcntl.flock(pin_file, fcntl.LOCK_SH)
+                    entry["last_access"] = time.time()
+                    self._write_index(entries)
+        try:
+            verified_key = (key, entry["checksum"]) if file_path is not None else None
+            if (
+                file_path is not None
+                and self.verify_checksum
+                and verified_key not in self._verified
+            ):
+                if _path_checksum(file_path) == entry["checksum"]:
+                    self._verified.add(verified_key)
+                else:
+                    pin_file.close()
+                    pin_file = None
+                    with self._locked():
+                        self._drop_corrupted(key, file_path)
+                    file_path = None
+            yield file_path
+        finally:
+            if pin_file is not None:
+                pin_file.close()
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Returns the path of the graph file of `key`, or None if it's missing or
+        corrupted. Use `pin` to keep it from being evicted while it's loaded.
+        """
+        with self.pin(key) as file_path:
+            return file_path
+
+    def put(
+        self, key: str, save_fn: Callable[[str], None], meta: Optional[Dict] = None
+    ) -> str:
+        """Saves a graph file of `key` by calling `save_fn(path)`, returns the path in the store."""
+        file_path = self._file_path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        try:
+            save_fn(tmp_path)
+            size = _path_size(tmp_path)
+            checksum = _path_checksum(tmp_path)
+            with self._locked():
+                if os.path.exists(file_path) and not self._remove_unpinned(file_path):
+                    # Being loaded by another process, which saved the same graph
+                    logger.info(f"Graph cache file {file_path} is in use, keep it.")
+                    return file_path
+                os.replace(tmp_path, file_path)
+                entries = self._read_index()
+                now = time.time()
+                entries[key] = {
+                    "file": os.path.relpath(file_path, self.cache_dir),
+                    "size": size,
+                    "mtime": _path_mtime(file_path),
+                    "checksum": checksum,
+                    "created": now,
+                    "last_access": now,
+                    "meta": meta or {},
+                }
+                self._evict(entries, keep=key)
+                self._write_index(entries)
+        finally:
+            _remove_path(tmp_path)
+        return file_path
+
+    def remove(self, key: str) -> None:
+        with self._locked():
+            entries = self._read_index()
+            entry = entries.get(key, None)
+            if entry is not None and self._remove_unpinned(
+                os.path.join(self.cache_dir, entry["file"])
+            ):
+                del entries[key]
+                self._write_index(entries)
+
+    def total_size(self) -> int:
+        with self._locked():
+            return sum(entry["size"] for entry in self._read_index().values())
+
+    def _evict(self, entries: Dict[str, Dict[str, Any]], keep: str) -> None:
+        if self.max_size is None:
+            return
+        total_size = sum(entry["size"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_access"]):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            entry = entries[key]
+            if not self._remove_unpinned(os.path.join(self.cache_dir, entry["file"])):
+                continue
+            del entries[key]
+            total_size -= entry["size"]
+            logger.info(f"Evicted graph cache file {entry['file']}")
+
+
+_stores: Dict[str, GraphCacheStore] = {}
+
+
+def get_graph_cache_store(
+    cache_dir, max_size: Optional[int] = None, verify_checksum: bool = True
+) -> GraphCacheStore:
+    cache_dir = os.path.abspath(str(cache_dir))
+    store = _stores.get(cache_dir, None)
+    if store is None:
+        store = GraphCacheStore(cache_dir, max_size, verify_checksum)
+        _stores[cache_dir] = store
+    else:
+        if max_size is not None:
+            store.max_size = max_size
+        store.verify_checksum = verify_checksum
+    return store
@@ -0,0 +1,303 @@
+"""Graph file formats.
+
+A graph file of format "full" is the runtime state dict of a graph saved by
+`flow.save`, variables included. A graph file of format "mmap" or "weightless"
+is a directory keeping the compiled plan apart from the variables:
+
+    onediff_graph.json   format, version and the shape and dtype of every variable
+    plan                 the runtime state dict without variables, saved by `flow.save`
+    states.safetensors   the variables, memory mapped on loading
+
+On loading a "mmap" graph file, variables already owned by the live module are
+aliased instead of read from the file, the rest are read from the memory map
+and moved to their device one by one, so the host never holds a full copy of
+the weights.
+
+A "weightless" graph file doesn't save the variables that can be rebound to the
+live module on loading, i.e. its parameters and buffers and the NHWC transposed
+conv weights of constant folding (see param_utils.py), only their names. It is
+small enough to ship with every checkpoint of the same architecture.
+"""
+import json
+import os
+import shutil
+from typing import Any, Dict, Optional
+
+import oneflow as flow  # usort: skip
+
+from onediff.utils import logger
+from .param_utils import CONSTANT_FOLDING_VAR_PREFIX, convert_var_name
+
+__all__ = [
+    "GRAPH_FILE_FORMATS",
+    "copy_graph_file",
+    "is_split_graph_file",
+    "load_graph_file",
+    "rebind_graph_states",
+    "save_graph_file",
+]
+
+GRAPH_FILE_FORMATS = ("full", "mmap", "weightless")
+
+_META_FILE = "onediff_graph.json"
+_PLAN_FILE = "plan"
+_STATES_FILE = "states.safetensors"
+_FORMAT_VERSION = 1
+
+
+def is_split_graph_file(file_path) -> bool:
+    return os.path.isfile(os.path.join(file_path, _META_FILE))
+
+
+def get_graph_file_format(file_path) -> str:
+    """The format of the graph file `file_path`, one of GRAPH_FILE_FORMATS."""
+    if not is_split_graph_file(file_path):
+        return "full"
+    with open(os.path.join(file_path, _META_FILE), "r") as f:
+        return json.load(f)["format"]
+
+
+def _state_tensor(item):
+    # A state is saved as (tensor, device_str)
+    return item[0] if isinstance(item, (tuple, list)) else item
+
+
+def _with_state_tensor(item, tensor):
+    if isinstance(item, (tuple, list)):
+        return (tensor, *item[1:])
+    return tensor
+
+
+def _state_device(item) -> Optional[str]:
+    if isinstance(item, (tuple, list)) and len(item) > 1:
+        return item[1]
+    return None
+
+
+def _dtype_name(dtype) -> str:
+    return str(dtype).split(".")[-1]
+
+
+def _live_tensors(module) -> Dict[str, flow.Tensor]:
+    if module is None:
+        return {}
+    tensors = dict(module.named_buffers())
+    tensors.update(module.named_parameters())
+    return tensors
+
+
+def _candidate_names(state_name: str):
+    # Variables of the graph are named after the module attributes, prefixed
+    # by the name of the graph block.
+    yield state_name
+    if state_name.startswith("model."):
+        yield state_name[len("model.") :]
+
+
+def _matches(tensor, meta: Dict[str, Any], device: Optional[str]) -> bool:
+    return (
+        tensor is not None
+        and list(tensor.shape) == meta["shape"]
+        and _dtype_name(tensor.dtype) == meta["dtype"]
+        and (device is None or tensor.device == flow.device(device))
+    )
+
+
+def _find_live_tensor(
+    state_name: str, meta: Dict[str, Any], device: str, live_tensors
+) -> Optional[flow.Tensor]:
+    for name in _candidate_names(state_name):
+        tensor = live_tensors.get(name, None)
+        if _matches(tensor, meta, device):
+            return tensor
+    return None
+
+
+def _find_rebind_source(
+    state_name: str, meta: Dict[str, Any], live_tensors
+) -> Optional[Dict[str, Any]]:
+    """Returns how to rebuild a variable from the live module, None if it can't be."""
+    if state_name.startswith(CONSTANT_FOLDING_VAR_PREFIX):
+        source = convert_var_name(state_name)
+        tensor = live_tensors.get(source, None)
+        if len(meta["shape"]) != 4:
+            return None
+        nhwc_meta = dict(meta, shape=[meta["shape"][i] for i in (0, 3, 1, 2)])
+        if _matches(tensor, nhwc_meta, None):
+            return {"source": source, "transform": "nhwc"}
+        return None
+    for name in _candidate_names(state_name):
+        if _matches(live_tensors.get(name, None), meta, None):
+            return {"source": name}
+    return None
+
+
+def _rebind(state_name, meta, device: str, live_tensors) -> flow.Tensor:
+    tensor = live_tensors.get(meta["source"], None)
+    if tensor is None:
+        raise RuntimeError(
+            f"Can't rebind variable {state_name} of the graph, the module has no tensor named {meta['source']}"
+        )
+    if meta.get("transform", None) == "nhwc":
+        # Kept in sync with the conv weight by update_graph_with_constant_folding_info
+        tensor = tensor.permute(0, 2, 3, 1).contiguous()
+    if (
+        list(tensor.shape) != meta["shape"]
+        or _dtype_name(tensor.dtype) != meta["dtype"]
+    ):
+        raise RuntimeError(
+            f"Can't rebind variable {state_name} of the graph to {meta['source']}, expected shape {meta['shape']} and dtype {meta['dtype']}, got {list(tensor.shape)} and {_dtype_name(tensor.dtype)}"
+        )
+    return tensor.to(device)
+
+
+def save_graph_file(
+    state_dict: Dict[str, Any], file_path, file_format="full", live_module=None
+):
+    """Saves the runtime state dict of a graph as a graph file of `file_format`.
+
+    `live_module` is the module of the graph, required by the "weightless" format.
+    """
+    if file_format not in GRAPH_FILE_FORMATS:
+        raise ValueError(
+            f"Unsupported graph file format {file_format}, expected one of {GRAPH_FILE_FORMATS}"
+        )
+    if file_format == "full":
+        flow.save(state_dict, file_path)
+        return
+
+    from safetensors.torch import save_file
+
+    if file_format == "weightless":
+        if live_module is None:
+            raise ValueError("live_module is required to save a weightless graph file")
+        live_tensors = _live_tensors(live_module)
+
+    os.makedirs(file_path, exist_ok=True)
+    plan = {}
+    tensors = {}
+    tensors_meta = {}
+    # Graphs of different input shapes share variables
+    saved_keys = {}
+    for graph_name, graph_state_dict in state_dict.items():
+        states = {}
+        for state_name, item in graph_state_dict["states"].items():
+            tensor = _state_tensor(item)
+            key = saved_keys.get(id(tensor), None)
+            if key is None:
+                key = f"{graph_name}/{state_name}"
+                saved_keys[id(tensor)] = key
+                meta = {"shape": list(tensor.shape), "dtype": _dtype_name(tensor.dtype)}
+                if file_format == "weightless":
+                    meta.update(
+                        _find_rebind_source(state_name, meta, live_tensors) or {}
+                    )
+                if "source" not in meta:
+                    tensors[key] = flow.utils.tensor.to_torch(tensor).contiguous().cpu()
+                tensors_meta[key] = meta
+            states[state_name] = _with_state_tensor(item, key)
+        plan[graph_name] = {**graph_state_dict, "states": states}
+
+    save_file(tensors, os.path.join(file_path, _STATES_FILE))
+    flow.save(plan, os.path.join(file_path, _PLAN_FILE))
+    with open(os.path.join(file_path, _META_FILE), "w") as f:
+        json.dump(
+            {
+                "format": file_format,
+                "version": _FORMAT_VERSION,
+                "tensors": tensors_meta,
+            },
+            f,
+        )
+
+
+def load_graph_file(file_path, device=None, live_module=None) -> Dict[str, Any]:
+    """Loads the runtime state dict of a graph file of any format.
+
+    Variables of a split graph file are moved to `device` (the device they were
+    saved from by default) one by one. Those that `live_module` owns already, with
+    the same name, shape, dtype and device, are aliased instead of loaded. Those
+    not saved in a weightless graph file are rebound to `live_module`.
+    """
+    if not is_split_graph_file(file_path):
+        return flow.load(file_path)
+
+    from safetensors import safe_open
+
+    with open(os.path.join(file_path, _META_FILE), "r") as f:
+        meta = json.load(f)
+    if meta.get("version") != _FORMAT_VERSION:
+        raise RuntimeError(
+            f"Unsupported version {meta.get('version')} of graph file {file_path}"
+        )
+    tensors_meta = meta["tensors"]
+    plan = flow.load(os.path.join(file_path, _PLAN_FILE))
+    live_tensors = _live_tensors(live_module)
+
+    loaded = {}
+    num_aliased = 0
+    with safe_open(os.path.join(file_path, _STATES_FILE), framework="pt") as f:
+        for graph_state_dict in plan.values():
+            states = graph_state_dict["states"]
+            for state_name, item in states.items():
+                key = _state_tensor(item)
+                tensor = loaded.get(key, None)
+                if tensor is None:
+                    state_device = str(device or _state_device(item) or "cpu")
+                    meta = tensors_meta[key]
+                    tensor = _find_live_tensor(
+                        state_name, meta, state_device, live_tensors
+                    )
+                    if tensor is not None:
+                        num_aliased += 1
+                    elif "source" in meta:
+                        tensor = _rebind(state_name, meta, state_device, live_tensors)
+                        num_aliased += 1
+                    else:
+                        tensor = flow.utils.tensor.from_torch(
+                            f.get_tensor(key).to(state_device)
+                        )
+                    loaded[key] = tensor
+                states[state_name] = _with_state_tensor(item, tensor)
+    logger.info(
+        f"Loaded {len(loaded)} variables of graph file {file_path}, {num_aliased} aliased from the live module"
+    )
+    return plan
+
+
+def rebind_graph_states(
+    state_dict: Dict[str, Any], live_module, device
+) -> Dict[str, Any]:
+    """Returns a copy of a runtime state dict for `device`, whose variables are rebound
+    to the tensors of `live_module` where possible, and copied to `device` otherwise.
+
+    The rest of the state dict, e.g. the compiled plan, is shared with `state_dict`.
+    """
+    live_tensors = _live_tensors(live_module)
+    device = str(device)
+    rebound = {}
+    result = {}
+    for graph_name, graph_state_dict in state_dict.items():
+        states = {}
+        for state_name, item in graph_state_dict["states"].items():
+            tensor = _state_tensor(item)
+            new_tensor = rebound.get(id(tensor), None)
+            if new_tensor is None:
+                meta = {"shape": list(tensor.shape), "dtype": _dtype_name(tensor.dtype)}
+                source = _find_rebind_source(state_name, meta, live_tensors)
+                if source is not None:
+                    meta.update(source)
+                    new_tensor = _rebind(state_name, meta, device, live_tensors)
+                else:
+                    new_tensor = tensor.to(device)
+                rebound[id(tensor)] = new_tensor
+            states[state_name] = _with_state_tensor(item, new_tensor)
+        result[graph_name] = {**graph_state_dict, "states": states}
+    return result
+
+
+def copy_graph_file(src, dst) -> None:
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copyfile(src, dst)
@@ -1,5 +1,6 @@
 import importlib
 import os
+import shutil
 from typing import Dict
 
 import torch
@@ -11,10 +12,16 @@ from oneflow.framework.args_tree import ArgsTree
 
 from onediff.utils import logger
 from ..env_var import OneflowCompileOptions
+from .call_signature import generate_call_graph_pool_key
+from .graph_cache_store import get_graph_cache_store
 from .transform.builtin_transform import torch2oflow
 from .transform.manager import transform_mgr
 from .utils.cost_util import cost_time
-from .utils.hash_utils import generate_input_structure_key, generate_model_structure_key
+from .utils.hash_utils import (
+    generate_env_vars_key,
+    generate_graph_cache_key,
+    generate_model_structure_key,
+)
 
 
 def _prepare_file_path(file_path):
@@ -25,17 +32,25 @@ def _prepare_file_path(file_path):
     return file_path
 
 
-@cost_time(debug=transform_mgr.debug_mode, message="generate graph file name")
-def generate_graph_file_name(file_path, deployable_module, args, kwargs):
+def _graph_file_name(file_path, deployable_module, input_structure_key):
     file_path = _prepare_file_path(file_path)
-    args_tree = ArgsTree((args, kwargs), gen_name=False, tensor_type=torch.Tensor)
-    input_structure_key = generate_input_structure_key(args_tree)
     model_structure_key = generate_model_structure_key(deployable_module)
     # Combine cache keys
     cache_key = f"{input_structure_key}_{model_structure_key}"
+    # Modules of other ONEFLOW_* options build other graphs, the name of the graph
+    # files of modules without any is unchanged
+    env_vars_key = generate_env_vars_key(deployable_module)
+    if env_vars_key:
+        cache_key = f"{cache_key}_{env_vars_key}"
     return f"{file_path}_{cache_key}.graph"
 
 
+@cost_time(debug=transform_mgr.debug_mode, message="generate graph file name")
+def generate_graph_file_name(file_path, deployable_module, args, kwargs):
+    input_structure_key = generate_call_graph_pool_key(deployable_module, args, kwargs)
+    return _graph_file_name(file_path, deployable_module, input_structure_key)
+
+
 def graph_file_management(func):
     @wraps(func)
     def wrapper(self: "OneflowDeployableModule", *args, **kwargs):
@@ -45,24 +60,36 @@ def graph_file_management(func):
             else OneflowCompileOptions()
         )
         graph_file = compile_options.graph_file
-        is_first_load = self._load_graph_first_run and graph_file is not None
+        graph_cache_dir = compile_options.graph_cache_dir
+        is_first_load = self._load_graph_first_run and (
+            graph_file is not None or graph_cache_dir is not None
+        )
+        cache_store = None
+        cache_key = None
 
         if self._deployable_module_input_structure_key is None:
-            args_tree = ArgsTree(
-                (args, kwargs), gen_name=False, tensor_type=torch.Tensor
-            )
-            self._deployable_module_input_structure_key = generate_input_structure_key(
-                args_tree
+            self._deployable_module_input_structure_key = generate_call_graph_pool_key(
+                self, args, kwargs
             )
 
         if is_first_load:
             self._load_graph_first_run = False
             input_structure_key = self._deployable_module_input_structure_key
-            model_structure_key = generate_model_structure_key(deployable_module=self)
-            file_path = _prepare_file_path(graph_file)
-            graph_file = (
-                f"{file_path}_{input_structure_key}_{model_structure_key}.graph"
-            )
+            if graph_cache_dir is not None:
+                cache_store = get_graph_cache_store(
+                    graph_cache_dir,
+                    compile_options.graph_cache_max_size,
+                    compile_options.graph_cache_verify_checksum,
+                )
+                args_tree = ArgsTree(
+                    (args, kwargs), gen_name=False, tensor_type=torch.Tensor
+                )
+                cache_key = generate_graph_cache_key(
+                    self, args_tree, input_structure_key
+                )
+                graph_file = None
+            else:
+                graph_file = _graph_file_name(graph_file, self, input_structure_key)
 
         def process_state_dict_before_saving(state_dict: Dict):
             nonlocal self, args, kwargs, graph_file
@@ -75,21 +102,38 @@ def graph_file_management(func):
                 )
             return state_dict
 
+        def save_graph(file_path):
+            with self._deployable_module_stats.timer("graph_save_time"):
+                self.save_graph(
+                    file_path,
+                    process_state_dict=process_state_dict_before_saving
+                    if importlib.util.find_spec("register_comfy")
+                    else None,
+                )
+
         def handle_graph_loading():
-            nonlocal graph_file, compile_options, is_first_load
+            nonlocal graph_file
             if not is_first_load:
                 return
 
-            if not os.path.exists(graph_file):
+            if cache_store is not None:
+                # Pinned, so it isn't evicted by other processes while it's loaded
+                with cache_store.pin(cache_key) as graph_file:
+                    load_graph_file()
+            else:
+                load_graph_file()
+
+        def load_graph_file():
+            nonlocal graph_file, compile_options, is_first_load
+            if graph_file is None or not os.path.exists(graph_file):
                 logger.info(
-                    f"Graph file {graph_file} does not exist! Generating graph."
+                    f"Graph file {graph_file or cache_key} does not exist! Generating graph."
                 )
             else:
                 graph_device = compile_options.graph_file_device
-                state_dict = flow.load(graph_file)
-                self.load_graph(
-                    graph_file, torch2oflow(graph_device), state_dict=state_dict
-                )
+                with self._deployable_module_stats.timer("graph_load_time"):
+                    self.load_graph(graph_file, torch2oflow(graph_device))
+                self._deployable_module_stats.inc("graph_loads")
                 logger.info(f"Loaded graph file: {graph_file}")
                 is_first_load = False
 
@@ -98,22 +142,40 @@ def graph_file_management(func):
             if not is_first_load:
                 return
 
+            if cache_store is not None:
+                try:
+                    graph_file = cache_store.put(
+                        cache_key,
+                        save_graph,
+                        meta={"input_structure_key": input_structure_key},
+                    )
+                    logger.info(f"Saved graph file: {graph_file}")
+                except Exception as e:
+                    logger.error(f"Failed to save graph file of {cache_key}! {e}")
+                return
+
             parent_dir = os.path.dirname(graph_file)
             if parent_dir != "":
                 os.makedirs(parent_dir, exist_ok=True)
 
-            # Avoid graph file conflicts
+            # Another process may have saved the same graph
             if os.path.exists(graph_file):
-                raise FileExistsError(f"File {graph_file} exists!")
+                logger.warning(f"Graph file {graph_file} exists, skip saving it.")
+                return
+            # Write then rename, so that readers never see a partial file
+            tmp_file = f"{graph_file}.{os.getpid()}.tmp"
             try:
-
-                self.save_graph(
-                    graph_file, process_state_dict=process_state_dict_before_saving
-                )
+                save_graph(tmp_file)
+                os.replace(tmp_file, graph_file)
                 logger.info(f"Saved graph file: {graph_file}")
 
             except Exception as e:
                 logger.error(f"Failed to save graph file: {graph_file}! {e}")
+            finally:
+                if os.path.isdir(tmp_file):
+                    shutil.rmtree(tmp_file, ignore_errors=True)
+                elif os.path.exists(tmp_file):
+                    os.remove(tmp_file)
 
         if self._deployable_module_options.use_graph and is_first_load:
             handle_graph_loading()
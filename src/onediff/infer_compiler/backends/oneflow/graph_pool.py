@@ -0,0 +1,412 @@
+"""A pool of compiled graphs keyed by input structure and shape bucket."""
+import collections
+import dataclasses
+import hashlib
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+from onediff.utils import logger
+
+__all__ = [
+    "GraphPool",
+    "GraphPoolEntry",
+    "InputSignature",
+    "NearestResolution",
+    "PadToMultiple",
+    "ShapeBucketRule",
+    "generate_shape_bucket_key",
+]
+
+
+class ShapeBucketRule:
+    """Maps the spatial size of an image-like tensor to a bucket.
+
+    Tensors whose rank is lower than `min_rank` (timesteps, text embeddings, ...)
+    do not take part in bucketing, shape changes of them are left to the
+    dynamic shape support of the graph.
+    """
+
+    def __init__(self, min_rank: int = 4):
+        self.min_rank = min_rank
+
+    def bucket_hw(self, height: int, width: int) -> Tuple[int, int]:
+        raise NotImplementedError()
+
+    def __call__(self, shape: Sequence[int]) -> Optional[Tuple[int, ...]]:
+        if len(shape) < self.min_rank:
+            return None
+        height, width = self.bucket_hw(int(shape[-2]), int(shape[-1]))
+        return (*shape[:-2], height, width)
+
+
+class PadToMultiple(ShapeBucketRule):
+    """Rounds height and width up to a multiple of `multiple`.
+
+    Example:
+        >>> rule = PadToMultiple(16)
+        >>> rule((2, 4, 96, 120))
+        (2, 4, 96, 128)
+    """
+
+    def __init__(self, multiple: int = 8, min_rank: int = 4):
+        super().__init__(min_rank)
+        if multiple <= 0:
+            raise ValueError(f"multiple must be positive, got {multiple}")
+        self.multiple = multiple
+
+    def bucket_hw(self, height, width):
+        m = self.multiple
+        return -(-height // m) * m, -(-width // m) * m
+
+    def __repr__(self):
+        return f"PadToMultiple({self.multiple})"
+
+
+class NearestResolution(ShapeBucketRule):
+    """Maps height and width to the nearest supported resolution.
+
+    Resolutions are given in the units of the bucketed tensor, e.g. latent
+    resolutions for a UNet: `NearestResolution([(64, 64), (96, 96), (128, 128)])`.
+    """
+
+    def __init__(self, resolutions: Iterable[Tuple[int, int]], min_rank: int = 4):
+        super().__init__(min_rank)
+        self.resolutions = sorted(set(tuple(r) for r in resolutions))
+        if len(self.resolutions) == 0:
+            raise ValueError("resolutions can't be empty")
+        self._cache: Dict[Tuple[int, int], Tuple[int, int]] = {}
+
+    def bucket_hw(self, height, width):
+        key = (height, width)
+        bucket = self._cache.get(key, None)
+        if bucket is None:
+            bucket = min(
+                self.resolutions,
+                key=lambda r: (abs(r[0] - height) + abs(r[1] - width), r),
+            )
+            self._cache[key] = bucket
+        return bucket
+
+    def __repr__(self):
+        return f"NearestResolution({self.resolutions})"
+
+
+def generate_shape_bucket_key(
+    shapes: Iterable[Sequence[int]], rule: Optional[ShapeBucketRule]
+) -> str:
+    """Returns the bucket suffix of the input shapes, '' if bucketing is disabled."""
+    if rule is None:
+        return ""
+    buckets = []
+    for shape in shapes:
+        bucket = rule(shape)
+        if bucket is not None:
+            buckets.append("x".join(str(x) for x in bucket))
+    return "_".join(buckets)
+
+
+def _dtype_name(dtype) -> str:
+    # torch.float16 and oneflow.float16 get the same name
+    return str(dtype).split(".")[-1]
+
+
+_SIGNATURE_FIELD_GETTERS = {
+    "dtype": lambda tensor: _dtype_name(tensor.dtype),
+    "rank": lambda tensor: tensor.ndim,
+    "device": lambda tensor: str(tensor.device),
+    "shape": lambda tensor: tuple(tensor.shape),
+}
+
+
+class InputSignature:
+    """Properties of input tensors that tell graphs in the graph pool apart.
+
+    A signature is a tuple of the input structure key and, per tensor, a tuple of
+    the selected fields and the shape bucket. It is computed in a single pass, and
+    formatted into a graph pool key once per distinct signature, the keys of the
+    `max_size` most recently used signatures are kept.
+
+    Args:
+        fields: any of "dtype", "rank", "device" and "shape".
+        shape_bucketing: a ShapeBucketRule, or None.
+        max_size: max number of formatted keys kept.
+
+    Example:
+        >>> options = OneflowCompileOptions()
+        >>> options.input_signature = ("dtype", "rank")
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str] = (),
+        shape_bucketing: Optional[ShapeBucketRule] = None,
+        max_size: int = 1024,
+    ):
+        for field in fields:
+            if field not in _SIGNATURE_FIELD_GETTERS:
+                raise ValueError(
+                    f"Unsupported input signature field {field}, expected any of {tuple(_SIGNATURE_FIELD_GETTERS)}"
+                )
+        self.fields = tuple(fields)
+        self.shape_bucketing = shape_bucketing
+        self._getters = tuple(_SIGNATURE_FIELD_GETTERS[field] for field in self.fields)
+        self.max_size = max_size
+        self._keys: "collections.OrderedDict[tuple, str]" = collections.OrderedDict()
+        self._signatures: Dict[str, tuple] = {}
+
+    def signature(self, input_structure_key: str, tensors: Iterable[Any]) -> tuple:
+        if not self._getters and self.shape_bucketing is None:
+            return (input_structure_key,)
+        getters = self._getters
+        rule = self.shape_bucketing
+        return (input_structure_key,) + tuple(
+            tuple(getter(tensor) for getter in getters)
+            + ((rule(tensor.shape),) if rule is not None else ())
+            for tensor in tensors
+        )
+
+    def key(self, signature: tuple) -> str:
+        """Returns the graph pool key of a signature."""
+        key = self._keys.get(signature, None)
+        if key is not None:
+            self._keys.move_to_end(signature)
+            return key
+        key = self._format_key(signature)
+        self._keys[signature] = key
+        self._signatures[key] = signature
+        while len(self._keys) > self.max_size:
+            _, evicted_key = self._keys.popitem(last=False)
+            self._signatures.pop(evicted_key, None)
+        return key
+
+    def _format_key(self, signature: tuple) -> str:
+        input_structure_key, tensor_signatures = signature[0], signature[1:]
+        if self.shape_bucketing is not None:
+            # The same bucket key as generate_shape_bucket_key
+            buckets = [s[-1] for s in tensor_signatures if s[-1] is not None]
+            if buckets:
+                bucket_key = "_".join("x".join(str(x) for x in b) for b in buckets)
+                input_structure_key = f"{input_structure_key}_{bucket_key}"
+            tensor_signatures = tuple(s[:-1] for s in tensor_signatures)
+        if not self.fields:
+            return input_structure_key
+        fields_key = hashlib.sha256(repr(tensor_signatures).encode("utf-8"))
+        return f"{input_structure_key}_{fields_key.hexdigest()[:8]}"
+
+    def explain_miss(
+        self,
+        signature: tuple,
+        known_keys: Iterable[str],
+        tensor_paths: Optional[Sequence[str]] = None,
+    ) -> str:
+        """Describes the difference between a signature and the closest known one."""
+        candidates = [
+            self._signatures[key]
+            for key in known_keys
+            if key in self._signatures
+            and self._signatures[key][0] == signature[0]
+            and len(self._signatures[key]) == len(signature)
+        ]
+        if len(candidates) == 0:
+            return f"new input structure {signature[0]}"
+
+        names = self.fields + (("bucket",) if self.shape_bucketing is not None else ())
+
+        def diff(known):
+            result = []
+            for i, (old, new) in enumerate(zip(known[1:], signature[1:])):
+                if old == new:
+                    continue
+                path = tensor_paths[i] if tensor_paths is not None else f"tensor {i}"
+                changes = ", ".join(
+                    f"{name} {a} -> {b}"
+                    for name, a, b in zip(names, old, new)
+                    if a != b
+                )
+                result.append(f"{path}: {changes}")
+            return result
+
+        return "; ".join(min((diff(known) for known in candidates), key=len))
+
+
+@dataclasses.dataclass
+class GraphPoolEntry:
+    graph: Any
+    hits: int = 0
+    misses: int = 0
+    build_time: float = 0.0
+    pinned: bool = False
+    last_used: float = 0.0
+    # Why the graph had to be built, see InputSignature.explain_miss
+    miss_reason: Optional[str] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "build_time": self.build_time,
+            "pinned": self.pinned,
+            "last_used": self.last_used,
+            "miss_reason": self.miss_reason,
+        }
+
+
+class GraphPool:
+    """LRU pool of graphs with per-entry statistics and pinning.
+
+    Lookup and insertion are O(1). When the pool is full, the least recently used
+    entry that is not pinned is evicted. Entries are pinned explicitly with
+    `pin`, or automatically once they reach `pin_after_hits` hits.
+
+    The misses of keys whose graphs are not built yet are recorded for the
+    `max_pending` most recently missed keys only.
+
+    The pool is thread safe: graphs compiled in a background thread are put into
+    it while the serving thread looks graphs up.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 9,
+        pin_after_hits: Optional[int] = None,
+        max_pending: int = 1024,
+    ):
+        self.capacity = capacity
+        self.pin_after_hits = pin_after_hits
+        self.max_pending = max_pending
+        self._entries: "collections.OrderedDict[str, GraphPoolEntry]" = (
+            collections.OrderedDict()
+        )
+        # misses recorded before the graph of a key is built
+        self._pending_misses: "collections.OrderedDict[str, int]" = (
+            collections.OrderedDict()
+        )
+        self._pending_reasons: Dict[str, str] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def items(self):
+        """Returns (key, graph) of every entry, from the least recently used one."""
+        with self._lock:
+            return [(key, entry.graph) for key, entry in self._entries.items()]
+
+    def lookup(self, key: str):
+        """Returns the graph of `key` and records a hit, or records a miss and returns None."""
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self._pending_misses[key] = self._pending_misses.get(key, 0) + 1
+                self._pending_misses.move_to_end(key)
+                self._evict_pending()
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            entry.last_used = time.time()
+            if (
+                self.pin_after_hits is not None
+                and not entry.pinned
+                and entry.hits >= self.pin_after_hits
+            ):
+                entry.pinned = True
+                logger.debug(f"Pinned graph {key} after {entry.hits} hits")
+            return entry.graph
+
+    def get(self, key: str, default=None):
+        """Returns the graph of `key` without touching statistics or LRU order."""
+        entry = self._entries.get(key, None)
+        return default if entry is None else entry.graph
+
+    def set_miss_reason(self, key: str, reason: str) -> None:
+        """Records why `key` missed, reported in the stats once its graph is put."""
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                # Put by another thread since the miss
+                entry.miss_reason = reason
+                return
+            if key not in self._pending_misses:
+                self._pending_misses[key] = 0
+                self._evict_pending()
+            self._pending_reasons[key] = reason
+
+    def put(self, key: str, graph, build_time: float = 0.0) -> None:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                entry = GraphPoolEntry(
+                    graph,
+                    misses=self._pending_misses.pop(key, 0),
+                    miss_reason=self._pending_reasons.pop(key, None),
+                )
+                self._entries[key] = entry
+            entry.graph = graph
+            entry.build_time += build_time
+            entry.last_used = time.time()
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def pop(self, key: str, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry.graph
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pending_misses.clear()
+            self._pending_reasons.clear()
+
+    def pin(self, key: str) -> None:
+        with self._lock:
+            if key not in self._entries:
+                raise KeyError(f"Graph {key} is not in the pool")
+            self._entries[key].pinned = True
+
+    def unpin(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._entries[key].pinned = False
+                self._evict()
+
+    def set_capacity(self, capacity: int) -> None:
+        with self._lock:
+            self.capacity = capacity
+            self._evict()
+
+    def _evict_pending(self) -> None:
+        while len(self._pending_misses) > self.max_pending:
+            key, _ = self._pending_misses.popitem(last=False)
+            self._pending_reasons.pop(key, None)
+
+    def _evict(self) -> None:
+        if len(self._entries) <= self.capacity:
+            return
+        for key in list(self._entries.keys()):
+            if len(self._entries) <= self.capacity:
+                break
+            if self._entries[key].pinned:
+                continue
+            logger.debug(f"Evicting graph {key} from the graph pool")
+            del self._entries[key]
+        if len(self._entries) > self.capacity:
+            logger.warning(
+                f"All {len(self._entries)} graphs in the pool are pinned, "
+                f"exceeding the capacity {self.capacity}."
+            )
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {key: entry.stats() for key, entry in self._entries.items()}
+            for key, misses in self._pending_misses.items():
+                result.setdefault(key, {"hits": 0, "misses": misses, "pinned": False})
+        return result
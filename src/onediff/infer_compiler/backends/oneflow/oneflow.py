@@ -1,15 +1,28 @@
+import dataclasses
+import os
+
 import torch
 
-from ..registry import register_backend
+from ..registry import BackendCapabilities, register_backend
 
 
-@register_backend("oneflow")
+@register_backend(
+    "oneflow",
+    capabilities=BackendCapabilities(
+        dynamic_shapes=True,
+        graph_save_load=True,
+        quantization=True,
+        device_types=("cuda",),
+        priority=10,
+    ),
+)
 def compile(torch_module: torch.nn.Module, *, options=None):
     """
     Transform a torch nn.Module to oneflow.nn.Module, then optimize it with oneflow.nn.Graph.
     Args:
        model (torch.nn.Module): Module to optimize
-       options (OneflowCompileOptions): Compilation options to pass to the compiler:
+       options (OneflowCompileOptions or path): Compilation options to pass to the compiler,
+                     or the path of a JSON profile saved by autotune, whose options are loaded:
         - 'dynamic': When this is True, we will generate one graph and reuse it to avoid recompilations when
                      input shape change.  This may not always work as some operations/optimizations break the contition of
                      reusing. When this is False, we will generate a graph for each new input shape, and will always specialize.
@@ -19,12 +32,30 @@ def compile(torch_module: torch.nn.Module, *, options=None):
         - 'size' which config the cache size when cache is enabled. Note that after onediff v0.12, cache is default disabled.
         - 'graph_file' (None) generates a compilation cache file. If the file exists, loading occurs; if not, the compilation result is saved after the first run.
         - 'graph_file_device' (None) sets the device for the graph file, default None.  If set, the compilation result will be converted to the specified device.
+        - 'graph_file_format' ("full") the format of saved graph files. "mmap" saves the variables apart from the compiled plan,
+                     so that loading memory maps them and aliases those already owned by the module.
+                     "weightless" saves only the names of the variables that can be rebound to the module on loading. Loading detects the format.
+        - 'graph_cache_dir' (None) a directory shared by processes caching compiled graphs. Graph files are keyed by the model,
+                     the inputs, the ONEFLOW_* flags, the library versions and the GPU, and checked by their size and mtime before loading.
+        - 'graph_cache_max_size' (None) the max total size of 'graph_cache_dir' in bytes, least recently used graph files are evicted.
+        - 'graph_cache_verify_checksum' (True) verifies the checksum of a graph file of 'graph_cache_dir' before its first load
+                     in a process, which reads the whole file once. A corrupted file is removed and its graph compiled again.
+        - 'shape_bucketing' (None) a ShapeBucketRule such as PadToMultiple(8) or NearestResolution([...]). When set, inputs of
+                     different shape buckets are served by different graphs of the graph pool.
+        - 'input_signature' (()) tensor properties that tell graphs in the graph pool apart besides the input structure,
+                     any of "dtype", "rank", "device" and "shape". Misses are reported by argument, see graph_pool_stats.
+        - 'pin_graph_after_hits' (None) pins a graph in the graph pool after it has been hit this many times, so it is never evicted.
+        - 'strict_param_sharing' (False) when True, building a graph or moving the module with to() raises RuntimeError
+                     if any parameter or buffer is not aliased between the torch and oneflow modules, see verify_param_sharing.
+        - 'static_io_buffers' (False) when True, the inputs of a call are copied into persistent buffers allocated per input shapes,
+                     and the outputs are copied into persistent buffers that are returned and overwritten by the next call of the same shapes.
+                     This saves the host time of converting tensors when replaying graphs captured by CUDA graphs, which it enables
+                     unless 'kernel_enable_cuda_graph' is False. See static_io_buffers.py.
+        - 'compile_in_background' (False) when True, an input structure without a graph is served by the original torch module
+                     while its graph is compiled on a background thread. The graph is used once it's ready, see
+                     OneflowDeployableModule.get_compile_future. Graphs compiled in background are not saved to 'graph_file'.
     """
-    from ..env_var import (
-        OneflowCompileOptions,
-        set_oneflow_default_env_vars,
-        set_oneflow_env_vars,
-    )
+    from ..env_var import OneflowCompileOptions, set_oneflow_default_env_vars
     from .deployable_module import get_mixed_deployable_module, OneflowDeployableModule
     from .param_utils import (
         forward_generate_constant_folding_info_hook,
@@ -37,8 +68,17 @@ def compile(torch_module: torch.nn.Module, *, options=None):
     set_oneflow_default_env_vars()
     set_default_registry()
 
+    # The optimization options are set while compiling the graphs of the module
+    # only, modules of different options can run in one process. Those read when
+    # graphs are constructed and run, like run_graph_by_vm, are set for the whole
+    # process, see ONEFLOW_PROCESS_ENV_VARS.
     options = options if options is not None else OneflowCompileOptions()
-    set_oneflow_env_vars(options)
+    if isinstance(options, (str, os.PathLike)):
+        from .autotune import load_autotune_profile
+
+        options = load_autotune_profile(options)
+    if options.static_io_buffers and options.kernel_enable_cuda_graph is None:
+        options = dataclasses.replace(options, kernel_enable_cuda_graph=True)
 
     def wrap_module(module):
         if isinstance(module, OneflowDeployableModule):
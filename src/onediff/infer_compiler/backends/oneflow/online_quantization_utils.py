@@ -1,4 +1,20 @@
 import functools
+import hashlib
+import os
+import uuid
+
+import torch
+import torch.nn as nn
+
+from onediff.utils import logger
+
+# Subdirectory of the cache_dir of the quantization config
+QUANTIZED_MODEL_CACHE_DIR = "quantized_models"
+
+# Elements of every weight sampled into the checkpoint fingerprint
+_FINGERPRINT_SAMPLES = 256
+
+_PRIMITIVES = (str, int, float, bool, type(None))
 
 
 def patch_input_adapter(in_args, in_kwargs):
@@ -47,20 +63,255 @@ def online_quantize_model(
     return quantized_model, status
 
 
+def _primitive_fields(obj):
+    fields = getattr(obj, "__dict__", {})
+    return {
+        name: value
+        for name, value in sorted(fields.items())
+        if isinstance(value, _PRIMITIVES)
+        or (
+            isinstance(value, (list, tuple))
+            and all(isinstance(v, _PRIMITIVES) for v in value)
+        )
+    }
+
+
+def _quantizable_modules(model):
+    return {
+        name: module
+        for name, module in model.named_modules()
+        if isinstance(module, (nn.Linear, nn.Conv2d))
+    }
+
+
+@torch.no_grad()
+def generate_quantized_model_cache_key(model, quant_config, args, kwargs) -> str:
+    """Key of the result of online quantization of `model`, the float module, on
+    inputs `args` and `kwargs` with `quant_config`.
+
+    It covers the names, shapes and dtypes of the weights, a sample of the values of
+    every weight, the settings of the config and the calculator, the input signature
+    and the library versions, so another checkpoint or config gets another key.
+    """
+    import onediff_quant
+
+    import onediff
+
+    hasher = hashlib.sha256()
+
+    def update(value):
+        hasher.update(str(value).encode("utf-8"))
+        hasher.update(b"\0")
+
+    samples, device = [], None
+    for name, tensor in model.state_dict().items():
+        update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}")
+        flat = tensor.detach().reshape(-1)
+        step = max(1, flat.numel() // _FINGERPRINT_SAMPLES)
+        sample = flat[::step][:_FINGERPRINT_SAMPLES].float()
+        device = device or sample.device
+        samples.append(sample.to(device))
+    if samples:
+        # A single host transfer for the samples of all weights
+        update(torch.cat(samples).cpu().tolist())
+
+    config = _primitive_fields(quant_config)
+    config.pop("cache_dir", None)
+    update(config)
+    calculator = getattr(quant_config, "quantization_calculator", None)
+    if calculator is not None:
+        update(type(calculator).__name__)
+        update(_primitive_fields(calculator))
+
+    for arg in list(args) + [kwargs[k] for k in sorted(kwargs)]:
+        if isinstance(arg, torch.Tensor):
+            update(f"{arg.dtype}:{tuple(arg.shape)}")
+        else:
+            update(type(arg).__name__)
+    update(f"onediff_quant={getattr(onediff_quant, '__version__', None)}")
+    update(f"onediff={onediff.__version__}")
+    return hasher.hexdigest()
+
+
+def _quantized_model_cache_path(model, quant_config, args, kwargs):
+    cache_dir = getattr(quant_config, "cache_dir", None)
+    if not cache_dir:
+        return None
+    try:
+        key = generate_quantized_model_cache_key(model, quant_config, args, kwargs)
+    except Exception as e:
+        logger.warning(f"Online quantization is not cached: {e}")
+        return None
+    return os.path.join(str(cache_dir), QUANTIZED_MODEL_CACHE_DIR, f"{key}.safetensors")
+
+
+@torch.no_grad()
+def find_weight_scales(modules, bits=8):
+    """Per-channel scales of the weights of `modules` by name, as lists on host,
+    found the way the layers are quantized.
+    """
+    from onediff_quant import Quantizer
+
+    from onediff.optimization.quant_optimizer import _find_weight_scales, _group_weights
+
+    weight_scales = {}
+    for batch in _group_weights(modules):
+        _, scales, _ = _find_weight_scales(Quantizer, batch, bits)
+        weight_scales.update(zip((name for name, _ in batch), scales))
+    return weight_scales
+
+
+def save_quantized_model_cache(path, model, quantizable_modules, weight_scales):
+    """Saves which layers of `model` online quantization replaced, of the float
+    `quantizable_modules` by name, with their `weight_scales`, in `path`.
+    """
+    from onediff.quantization.calibrate_info import save_calibrate_info
+
+    modules = dict(model.named_modules())
+    names = [
+        name
+        for name, module in quantizable_modules.items()
+        if modules.get(name) is not module
+    ]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written to a temporary path and renamed, several workers may share the cache
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        # [input_scale, input_zero_point, weight_scale], the inputs are quantized dynamically
+        save_calibrate_info(
+            {name: [0, 0, weight_scales[name]] for name in names}, tmp_path
+        )
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logger.info(f"Cached the online quantization of {len(names)} layers in {path}")
+
+
+def read_quantized_model_cache(path, model):
+    """Reads the calibration info cached in `path` and checks it against `model`.
+
+    Raises RuntimeError if any layer of the cache is not a linear or conv of the
+    model, or its weight scales don't match its output channels, before any layer
+    is touched.
+    """
+    from onediff.quantization.calibrate_info import load_calibrate_info
+
+    calibration_info = dict(load_calibrate_info(path))
+    modules = dict(model.named_modules())
+    for name, (_, _, weight_scale) in calibration_info.items():
+        sub_module = modules.get(name, None)
+        if not isinstance(sub_module, (nn.Linear, nn.Conv2d)):
+            raise RuntimeError(
+                f"Layer {name} of the online quantization cache is not a linear or conv of the model"
+            )
+        if len(weight_scale) != sub_module.weight.shape[0]:
+            raise RuntimeError(
+                f"Layer {name} of the online quantization cache has {len(weight_scale)} weight scales, expected {sub_module.weight.shape[0]}"
+            )
+    return calibration_info
+
+
+@torch.no_grad()
+def apply_quantized_model_cache(calibration_info, model, bits=8):
+    """Quantizes the layers of `model` by `calibration_info` read by
+    read_quantized_model_cache, without calibration. The weights are quantized
+    again from the cached scales, which is a single elementwise pass.
+    """
+    from onediff_quant import Quantizer
+    from onediff_quant.utils import get_quantize_module, symm_quantize_sub_module
+
+    from onediff.torch_utils.module_operations import get_sub_module, modify_sub_module
+
+    quantizer = Quantizer()
+    quantizer.configure(bits=bits, perchannel=True)
+    for name, (input_scale, input_zero_point, weight_scale) in calibration_info.items():
+        sub_module = get_sub_module(model, name)
+        shape = [-1] + [1] * (len(sub_module.weight.shape) - 1)
+        scale = torch.tensor(weight_scale, device=sub_module.weight.device)
+        symm_quantize_sub_module(
+            model, name, scale.reshape(*shape), quantizer.maxq, save_as_float=False
+        )
+        quantized_module = get_quantize_module(
+            sub_module,
+            name,
+            [input_scale, input_zero_point, weight_scale],
+            fake_quant=False,
+            static=False,
+            nbits=bits,
+        )
+        modify_sub_module(model, name, quantized_module)
+    for _, layer in model.named_modules():
+        layer._disable_param_update = True
+    return model
+
+
+def load_quantized_model_cache(path, model, bits=8):
+    """Quantizes the layers of `model` by the calibration info cached in `path`,
+    without calibration.
+    """
+    # Checked in full before touching the model, a broken entry leaves it unchanged
+    calibration_info = read_quantized_model_cache(path, model)
+    apply_quantized_model_cache(calibration_info, model, bits=bits)
+    logger.info(
+        f"Loaded the online quantization of {len(calibration_info)} layers from {path}"
+    )
+    return model
+
+
+def _load_quantized_model_cache(cache_path, torch_model, bits):
+    if cache_path is None or not os.path.exists(cache_path):
+        return False
+    try:
+        calibration_info = read_quantized_model_cache(cache_path, torch_model)
+    except Exception as e:
+        logger.warning(
+            f"Failed to load the online quantization cache {cache_path}, quantizing again: {e}"
+        )
+        return False
+    # Not retried once layers are quantized, the model would be partly quantized
+    apply_quantized_model_cache(calibration_info, torch_model, bits=bits)
+    logger.info(
+        f"Loaded the online quantization of {len(calibration_info)} layers from {cache_path}"
+    )
+    return True
+
+
 def quantize_and_deploy_wrapper(func):
     @functools.wraps(func)
     def wrapper(self: "DeployableModule", *args, **kwargs):
         torch_model = self._torch_module
         quant_config = self._deployable_module_quant_config
         if quant_config:
-            torch_model, _ = online_quantize_model(
-                torch_model,
-                args,
-                kwargs,
-                module_selector=lambda x: x,
-                quant_config=quant_config,
-                inplace=True,
+            bits = getattr(quant_config, "bits", 8)
+            # Keyed by the float model, before it's quantized in place
+            cache_path = _quantized_model_cache_path(
+                torch_model, quant_config, args, kwargs
             )
+            if not _load_quantized_model_cache(cache_path, torch_model, bits):
+                quantizable_modules = _quantizable_modules(torch_model)
+                weight_scales = None
+                if cache_path is not None:
+                    # The weights are quantized in place, their scales are found first
+                    weight_scales = find_weight_scales(quantizable_modules, bits)
+                torch_model, _ = online_quantize_model(
+                    torch_model,
+                    args,
+                    kwargs,
+                    module_selector=lambda x: x,
+                    quant_config=quant_config,
+                    inplace=True,
+                )
+                if cache_path is not None:
+                    # Caching never fails the forward
+                    try:
+                        save_quantized_model_cache(
+                            cache_path, torch_model, quantizable_modules, weight_scales
+                        )
+                    except Exception as e:
+                        logger.warning(
+                            f"Failed to cache the online quantization in {cache_path}: {e}"
+                        )
             self._deployable_module_quant_config = None
         output = func(self, *args, **kwargs)
         return output
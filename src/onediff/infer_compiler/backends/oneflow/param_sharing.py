@@ -0,0 +1,107 @@
+"""Audit of the memory sharing between the torch and oneflow modules.
+
+torch2oflow converts parameters and buffers with `flow.utils.tensor.from_torch`,
+which aliases the torch memory, so a deployable module should not need more
+device memory than its torch module. A tensor converted in another way, or
+moved by `to()` on one side only, is silently duplicated instead.
+"""
+import dataclasses
+from itertools import chain
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+from onediff.utils import logger
+from .param_utils import check_device
+
+__all__ = ["ParamSharingReport", "verify_param_sharing"]
+
+
+@dataclasses.dataclass
+class ParamSharingReport:
+    # names of the parameters and buffers aliased by both modules
+    shared: List[str] = dataclasses.field(default_factory=list)
+    # (name, reason) of those that are not
+    not_shared: List[Tuple[str, str]] = dataclasses.field(default_factory=list)
+    # bytes the oneflow module would take if nothing was shared
+    shared_bytes: int = 0
+    # bytes the oneflow module takes on top of the torch module
+    duplicated_bytes: int = 0
+
+    @property
+    def is_zero_copy(self) -> bool:
+        return len(self.not_shared) == 0
+
+    def __str__(self) -> str:
+        lines = [
+            f"{len(self.shared)} tensors shared ({self.shared_bytes / 1024**2:.1f} MB saved), "
+            f"{len(self.not_shared)} not shared ({self.duplicated_bytes / 1024**2:.1f} MB duplicated)"
+        ]
+        lines += [f"  {name}: {reason}" for name, reason in self.not_shared]
+        return "\n".join(lines)
+
+
+def _nbytes(tensor) -> int:
+    return tensor.numel() * tensor.element_size()
+
+
+def _named_tensors(module) -> Dict[str, object]:
+    return dict(chain(module.named_parameters(), module.named_buffers()))
+
+
+def _not_shared_reason(torch_tensor: torch.Tensor, oneflow_tensor) -> Optional[str]:
+    if oneflow_tensor is None:
+        return "missing in the oneflow module"
+    if not check_device(oneflow_tensor.device, torch_tensor.device):
+        return (
+            f"on {oneflow_tensor.device} in oneflow but {torch_tensor.device} in torch"
+        )
+    if oneflow_tensor.data_ptr() != torch_tensor.data_ptr():
+        return "copied, the memory is different"
+    if _nbytes(oneflow_tensor) != _nbytes(torch_tensor):
+        return f"different sizes, {list(oneflow_tensor.shape)} in oneflow and {list(torch_tensor.shape)} in torch"
+    return None
+
+
+def verify_param_sharing(deployable_module, strict=False) -> ParamSharingReport:
+    """Reports every parameter and buffer of the torch module of `deployable_module`
+    whose memory is not aliased by its oneflow module.
+
+    Converts the torch module if it isn't converted yet.
+
+    Args:
+        strict: raise RuntimeError instead of returning if any tensor is not shared.
+    """
+    from onediff.infer_compiler import DeployableModule
+
+    if not isinstance(deployable_module, DeployableModule):
+        raise TypeError(
+            f"deployable_module must be a DeployableModule, got {type(deployable_module)}"
+        )
+    dual_module = deployable_module._deployable_module_model
+    torch_tensors = _named_tensors(dual_module._torch_module)
+    oneflow_tensors = _named_tensors(dual_module.oneflow_module)
+
+    report = ParamSharingReport()
+    for name, torch_tensor in torch_tensors.items():
+        oneflow_tensor = oneflow_tensors.get(name, None)
+        reason = _not_shared_reason(torch_tensor, oneflow_tensor)
+        if reason is None:
+            report.shared.append(name)
+            report.shared_bytes += _nbytes(torch_tensor)
+        else:
+            report.not_shared.append((name, reason))
+            if oneflow_tensor is not None:
+                report.duplicated_bytes += _nbytes(oneflow_tensor)
+    for name, oneflow_tensor in oneflow_tensors.items():
+        if name not in torch_tensors:
+            report.not_shared.append((name, "missing in the torch module"))
+            report.duplicated_bytes += _nbytes(oneflow_tensor)
+
+    if not report.is_zero_copy:
+        if strict:
+            raise RuntimeError(
+                f"Parameters of {type(dual_module._torch_module).__name__} are not shared between torch and oneflow:\n{report}"
+            )
+        logger.warning(f"Parameters not shared between torch and oneflow: {report}")
+    return report
@@ -1,5 +1,8 @@
+import copy
+import itertools
 import re
 import types
+import weakref
 
 import torch
 import oneflow as flow  # usort: skip
@@ -37,6 +40,13 @@ def check_device(current_device, target_device) -> bool:
 STATE_UPDATED_ATTR = "_onediff_state_updated"
 CONSTANT_FOLDING_INFO_ATTR = "_onediff_constant_folding_info"
 GRAPH_RELATED_TENSOR_ATTR = "_onediff_graph_related_tensor"
+# (data_ptr, _version) of each folded conv weight when it was last copied to the graph
+CONSTANT_FOLDING_VERSIONS_ATTR = "_onediff_constant_folding_versions"
+# Names of the folded conv weights modified since they were last copied to the
+# graph, None if unknown. Writes through `param.data` don't change the version.
+DIRTY_WEIGHTS_ATTR = "_onediff_dirty_weights"
+# (weak reference to the compiled torch module, weight name) of a folded conv
+CONSTANT_FOLDING_OWNER_ATTR = "_onediff_constant_folding_owner"
 
 
 def init_state_update_attr(module: torch.nn.Module):
@@ -67,31 +77,32 @@ def set_constant_folded_conv_attr(
 
     torch_module: torch.nn.Module = deployable_module._torch_module
     for submodule in torch_module.modules():
-        if isinstance(submodule, torch.nn.Conv2d) and hasattr(
-            submodule, GRAPH_RELATED_TENSOR_ATTR
-        ):
-            delattr(submodule, GRAPH_RELATED_TENSOR_ATTR)
+        if isinstance(submodule, torch.nn.Conv2d):
+            for attr in (GRAPH_RELATED_TENSOR_ATTR, CONSTANT_FOLDING_OWNER_ATTR):
+                submodule.__dict__.pop(attr, None)
 
+    owner = weakref.ref(torch_module)
     for weight_name, weight_tensor in constant_folding_info.items():
-        submodule = deployable_module._torch_module.get_submodule(
-            removesuffix(weight_name, ".weight")
-        )
+        submodule = torch_module.get_submodule(removesuffix(weight_name, ".weight"))
         object.__setattr__(submodule, GRAPH_RELATED_TENSOR_ATTR, weight_tensor)
+        object.__setattr__(submodule, CONSTANT_FOLDING_OWNER_ATTR, (owner, weight_name))
+
+
+CONSTANT_FOLDING_VAR_PREFIX = "variable_transpose_"
+
+
+# convert str like 'variable_transpose_model.input_blocks.10.0.in_layers.2.weight_239'
+# to 'input_blocks.10.0.in_layers.2.weight'
+def convert_var_name(s: str, prefix=CONSTANT_FOLDING_VAR_PREFIX):
+    s = removeprefix(s, prefix)
+    s = re.sub(r"_[0-9]+$", "", s)
+    s = removeprefix(s, "model.")
+    return s
 
 
 def generate_constant_folding_info(
     deployable_module, torch_module: torch.nn.Module = None
 ) -> Dict[str, flow.Tensor]:
-    removeprefix = lambda ss, prefix: ss[len(prefix) :] if ss.startswith(prefix) else ss
-
-    # convert str like 'variable_transpose_model.input_blocks.10.0.in_layers.2.weight_239'
-    # to 'input_blocks.10.0.in_layers.2.weight'
-    def convert_var_name(s: str, prefix="variable_transpose_"):
-        s = removeprefix(s, prefix)
-        s = re.sub(r"_[0-9]+$", "", s)
-        s = removeprefix(s, "model.")
-        return s
-
     from onediff.infer_compiler import DeployableModule
 
     if not isinstance(deployable_module, DeployableModule):
@@ -108,32 +119,114 @@ def generate_constant_folding_info(
     result = {
         convert_var_name(k): v
         for k, v in zip(*graph._c_nn_graph.get_runtime_var_states())
-        if k.startswith("variable_transpose_") and v.ndim == 4
+        if k.startswith(CONSTANT_FOLDING_VAR_PREFIX) and v.ndim == 4
     }
 
     setattr(deployable_module, CONSTANT_FOLDING_INFO_ATTR, result)
 
     set_constant_folded_conv_attr(deployable_module, result)
 
-    def make_custom_copy_(module):
+    torch_model: torch.nn.Module = deployable_module._torch_module
+    # The graph is folded from the current weights
+    setattr(torch_model, CONSTANT_FOLDING_VERSIONS_ATTR, {})
+    setattr(torch_model, DIRTY_WEIGHTS_ATTR, set())
+    record_constant_folding_versions(torch_model, result.keys())
+
+    def make_custom_copy_(name):
         def custom_copy_(self, src, non_blocking=False):
-            torch.Tensor.copy_(self, src, non_blocking)
-            # Update graph related tensors
-            update_graph_related_tensor(module)
+            result = torch.Tensor.copy_(self, src, non_blocking)
+            # Copied to the graph before the next call, along with the other changed weights
+            mark_weights_dirty(torch_model, [name])
+            return result
 
         return custom_copy_
 
     from onediff.torch_utils.module_operations import get_sub_module
 
-    torch_model: torch.nn.Module = deployable_module._torch_module
     for k in result.keys():
         module = get_sub_module(torch_model, removesuffix(k, ".weight"))
-        module.weight.copy_ = types.MethodType(make_custom_copy_(module), module.weight)
+        module.weight.copy_ = types.MethodType(make_custom_copy_(k), module.weight)
+
+
+def mark_weights_dirty(torch_module: torch.nn.Module, names=None) -> None:
+    """Records the folded conv weights `names` of `torch_module` as modified, they are
+    copied to the graph before the next call. None marks all of them, for writes to
+    unknown weights.
+    """
+    if names is None:
+        setattr(torch_module, DIRTY_WEIGHTS_ATTR, None)
+    else:
+        dirty = getattr(torch_module, DIRTY_WEIGHTS_ATTR, set())
+        if dirty is not None:
+            dirty.update(names)
+            setattr(torch_module, DIRTY_WEIGHTS_ATTR, dirty)
+    if hasattr(torch_module, STATE_UPDATED_ATTR):
+        setattr(torch_module, STATE_UPDATED_ATTR, True)
+
+
+def _weight_version(tensor: torch.Tensor):
+    # Both change when the weight is modified in place or its data is replaced
+    try:
+        return (tensor.data_ptr(), tensor._version)
+    except RuntimeError:
+        # Inference tensors have no version counter, always copied
+        return None
+
+
+def batched_copy_(targets: List[torch.Tensor], sources: List[torch.Tensor]) -> None:
+    """Copies `sources` into `targets`, those on the same device and of the same
+    dtype by a single torch._foreach_copy_ where available.
+    """
+    if len(targets) == 0:
+        return
+    devices = {target.device for target in targets if target.is_cuda}
+    # Targets may be variables of graphs still running on the streams of oneflow,
+    # which torch doesn't order its copies after
+    for device in devices:
+        flow.cuda.synchronize(f"cuda:{device.index or 0}")
+    batched, others = [], []
+    for target, source in zip(targets, sources):
+        if source.device == target.device and source.dtype == target.dtype:
+            batched.append((target, source))
+        else:
+            others.append((target, source))
+    if batched and hasattr(torch, "_foreach_copy_"):
+        torch._foreach_copy_([t for t, _ in batched], [s for _, s in batched])
+    else:
+        others = batched + others
+    for target, source in others:
+        target.copy_(source, non_blocking=True)
+    # The graph runs on the streams of oneflow
+    for device in devices:
+        torch.cuda.current_stream(device).synchronize()
+
+
+def record_constant_folding_versions(torch_module: torch.nn.Module, names) -> None:
+    """Records the conv weights `names` as copied to the graph as they are now."""
+    versions = getattr(torch_module, CONSTANT_FOLDING_VERSIONS_ATTR, None)
+    if versions is None:
+        versions = {}
+        setattr(torch_module, CONSTANT_FOLDING_VERSIONS_ATTR, versions)
+    for k in names:
+        versions[k] = _weight_version(torch_module.get_parameter(k))
+    dirty = getattr(torch_module, DIRTY_WEIGHTS_ATTR, None)
+    if dirty is not None:
+        dirty.difference_update(names)
 
 
 def update_graph_with_constant_folding_info(
-    module: torch.nn.Module, info: Dict[str, flow.Tensor] = None
-) -> None:
+    module: torch.nn.Module,
+    info: Dict[str, flow.Tensor] = None,
+    only_changed: bool = False,
+) -> List[str]:
+    """Copies the conv weights of `module` into their constant folded, NHWC
+    counterparts in the graph, and returns the names of the copied weights.
+
+    Args:
+        only_changed: copy only the weights marked dirty, see mark_weights_dirty,
+            or modified in place or replaced since they were last copied. All of
+            them if the dirty weights are unknown, e.g. after load_state_dict.
+    """
     from onediff.infer_compiler import DeployableModule
 
     if isinstance(module, DeployableModule):
@@ -141,24 +234,59 @@ def update_graph_with_constant_folding_info(
             info = get_constant_folding_info(module)
         module = module._torch_module
     if info is None:
-        return
-
-    for k in info:
-        orig_tensor = module.get_parameter(k)
-        target_tensor = info.get(k, None)
-        if target_tensor is None:
-            raise RuntimeError(f"Can't find tensor named {k} in graph")
-        target_tensor.copy_(
-            flow.utils.tensor.from_torch(orig_tensor.permute(0, 2, 3, 1))
-        )
-
-
-def update_graph_related_tensor(module: torch.nn.Conv2d) -> None:
+        return []
+
+    versions = getattr(module, CONSTANT_FOLDING_VERSIONS_ATTR, None)
+    if versions is None:
+        versions = {}
+        setattr(module, CONSTANT_FOLDING_VERSIONS_ATTR, versions)
+    dirty = getattr(module, DIRTY_WEIGHTS_ATTR, None)
+    if dirty is None:
+        only_changed = False
+
+    names, targets, sources = [], [], []
+    with torch.no_grad():
+        for k in info:
+            orig_tensor = module.get_parameter(k)
+            target_tensor = info.get(k, None)
+            if target_tensor is None:
+                raise RuntimeError(f"Can't find tensor named {k} in graph")
+            version = _weight_version(orig_tensor)
+            if (
+                only_changed
+                and k not in dirty
+                and version is not None
+                and versions.get(k) == version
+            ):
+                continue
+            names.append(k)
+            targets.append(flow.utils.tensor.to_torch(target_tensor))
+            sources.append(orig_tensor.permute(0, 2, 3, 1))
+            versions[k] = version
+        batched_copy_(targets, sources)
+    setattr(module, DIRTY_WEIGHTS_ATTR, set())
+    return names
+
+
+def update_graph_related_tensor(module: torch.nn.Conv2d, defer: bool = False) -> None:
+    """Copies the weight of `module` to its constant folded counterpart in the graph.
+
+    With `defer=True`, the weight is marked dirty instead, and copied along with the
+    other dirty weights by a batched copy before the next forward of the compiled
+    module. Callers running the module by other methods than forward, e.g.
+    apply_model of ComfyUI, copy right away.
+    """
     if not isinstance(module, torch.nn.Conv2d):
         return
     target_tensor = getattr(module, GRAPH_RELATED_TENSOR_ATTR, None)
     if target_tensor is None:
         return
+    owner = module.__dict__.get(CONSTANT_FOLDING_OWNER_ATTR, None)
+    if defer and owner is not None:
+        torch_module, weight_name = owner[0](), owner[1]
+        if torch_module is not None:
+            mark_weights_dirty(torch_module, [weight_name])
+            return
     target_tensor.copy_(
         flow.utils.tensor.from_torch(module.weight.data.permute(0, 2, 3, 1))
     )
@@ -176,7 +304,81 @@ def state_update_hook(module, incompatible_keys):
     if not hasattr(module, STATE_UPDATED_ATTR):
         return
     logger.info(f"load_state_dict called, set {STATE_UPDATED_ATTR} to True")
-    setattr(module, STATE_UPDATED_ATTR, True)
+    # Weights written through `param.data` before are neither marked nor versioned,
+    # so all of them are copied
+    mark_weights_dirty(module, None)
+
+
+def clear_onediff_state(torch_module: torch.nn.Module) -> None:
+    """Removes what compile and constant folding attach to `torch_module`: the graph
+    tensors and versions of constant folding, the patched `copy_` of the folded
+    weights and the load_state_dict post hook of state updates.
+    """
+    for submodule in torch_module.modules():
+        for attr in (
+            GRAPH_RELATED_TENSOR_ATTR,
+            CONSTANT_FOLDING_OWNER_ATTR,
+            STATE_UPDATED_ATTR,
+            CONSTANT_FOLDING_VERSIONS_ATTR,
+            DIRTY_WEIGHTS_ATTR,
+        ):
+            submodule.__dict__.pop(attr, None)
+        hooks = submodule._load_state_dict_post_hooks
+        for hook_id, hook in list(hooks.items()):
+            if getattr(hook, "hook", hook) is state_update_hook:
+                del hooks[hook_id]
+        for param in submodule.parameters(recurse=False):
+            copy_ = param.__dict__.get("copy_", None)
+            if getattr(copy_, "__func__", None) is not None and (
+                copy_.__func__.__name__ == "custom_copy_"
+            ):
+                del param.__dict__["copy_"]
+
+
+def replicate_torch_module(
+    torch_module: torch.nn.Module, device: Union[str, torch.device]
+) -> torch.nn.Module:
+    """Copies `torch_module` to `device` without the state onediff attaches to it.
+
+    The copy is created on the meta device and allocated on `device` directly, the
+    weights are copied from their device once. The graph tensors of constant
+    folding, the patched `copy_` of the folded weights and the hooks of compile
+    are left out, compiling the copy adds its own.
+    """
+    # The tensors of the module are not deep-copied, but replaced by meta tensors
+    memo = {}
+    for tensor in itertools.chain(torch_module.parameters(), torch_module.buffers()):
+        meta_tensor = torch.empty_like(tensor, device="meta")
+        if isinstance(tensor, torch.nn.Parameter):
+            meta_tensor = torch.nn.Parameter(
+                meta_tensor, requires_grad=tensor.requires_grad
+            )
+        memo[id(tensor)] = meta_tensor
+    for submodule in torch_module.modules():
+        graph_tensor = submodule.__dict__.get(GRAPH_RELATED_TENSOR_ATTR, None)
+        if graph_tensor is not None:
+            memo[id(graph_tensor)] = None
+    replica = copy.deepcopy(torch_module, memo)
+
+    clear_onediff_state(replica)
+
+    replica.to_empty(device=device)
+    with torch.no_grad():
+        names = [
+            name
+            for name, _ in itertools.chain(
+                torch_module.named_parameters(), torch_module.named_buffers()
+            )
+        ]
+        targets = [_get_tensor(replica, name) for name in names]
+        sources = [_get_tensor(torch_module, name) for name in names]
+        batched_copy_(targets, sources)
+    return replica
+
+
+def _get_tensor(module: torch.nn.Module, name: str) -> torch.Tensor:
+    module_name, _, tensor_name = name.rpartition(".")
+    return getattr(module.get_submodule(module_name), tensor_name)
 
 
 def forward_generate_constant_folding_info_hook(module, args, output):
@@ -201,11 +403,22 @@ def forward_pre_check_and_update_state_hook(module, args):
     if constant_folding_info is None:
         return
 
-    logger.info(f"state_dict updated, modify the related weight in graph")
-    update_graph_with_constant_folding_info(module, constant_folding_info)
+    names = update_graph_with_constant_folding_info(
+        module, constant_folding_info, only_changed=True
+    )
+    logger.info(
+        f"state_dict updated, {len(names)} of {len(constant_folding_info)} constant folded weights modified in graph"
+    )
     setattr(module._torch_module, STATE_UPDATED_ATTR, False)
 
 
+def removeprefix(s: str, prefix: str) -> str:
+    if s.startswith(prefix):
+        return s[len(prefix) :]
+    else:
+        return s
+
+
 def removesuffix(s: str, suffix: str) -> str:
     if s.endswith(suffix):
         return s[: len(s) - len(suffix)]
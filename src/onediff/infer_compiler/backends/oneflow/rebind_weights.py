@@ -0,0 +1,173 @@
+"""Switching the weights of a compiled module to another checkpoint in place.
+
+A checkpoint of the same architecture doesn't need a new graph: the variables
+of the graphs are either aliases of the torch parameters and buffers (see
+param_sharing.py), or derived from them, like the NHWC transposed conv weights
+of constant folding (see param_utils.py). Rebinding copies the new checkpoint
+into both on device, in batched copies, so a checkpoint switch costs a single
+upload of the weights:
+
+    >>> unet = compile(pipe.unet)
+    >>> pipe(prompt)
+    >>> unet.rebind_weights(load_file("another_finetune.safetensors"))
+"""
+import dataclasses
+from typing import Dict, List, Optional, Set
+
+import torch
+import oneflow as flow  # usort: skip
+
+from onediff.utils import logger
+from .param_utils import (
+    batched_copy_,
+    CONSTANT_FOLDING_VAR_PREFIX,
+    convert_var_name,
+    get_constant_folding_info,
+    record_constant_folding_versions,
+    removeprefix,
+)
+
+__all__ = ["RebindWeightsReport", "rebind_weights"]
+
+
+@dataclasses.dataclass
+class RebindWeightsReport:
+    # names of the parameters and buffers copied from the state dict
+    updated: List[str] = dataclasses.field(default_factory=list)
+    # names of those already aliasing the tensors of the state dict
+    unchanged: List[str] = dataclasses.field(default_factory=list)
+    # graph variables not aliasing the module that were copied too
+    graph_variables: int = 0
+    copied_bytes: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.updated)} tensors updated ({self.copied_bytes / 1024**2:.1f} MB), "
+            f"{len(self.unchanged)} unchanged, {self.graph_variables} graph variables updated"
+        )
+
+
+def _nbytes(tensor) -> int:
+    return tensor.numel() * tensor.element_size()
+
+
+def _same_memory(a: torch.Tensor, b: torch.Tensor) -> bool:
+    return (
+        a.device == b.device
+        and a.data_ptr() == b.data_ptr()
+        and a.dtype == b.dtype
+        and a.stride() == b.stride()
+    )
+
+
+def _graph_variable_source(
+    var_name: str,
+    var: flow.Tensor,
+    module_state: Dict[str, torch.Tensor],
+    names: Set[str],
+) -> Optional[torch.Tensor]:
+    """The tensor of the module graph variable `var` is derived from, if it's one of
+    `names`. It's on the device of the module, updated already.
+    """
+    constant_folded = var_name.startswith(CONSTANT_FOLDING_VAR_PREFIX)
+    if constant_folded:
+        name = convert_var_name(var_name)
+    elif var_name in module_state:
+        name = var_name
+    else:
+        name = removeprefix(var_name, "model.")
+    if name not in names:
+        return None
+    source = module_state[name].detach()
+    if constant_folded:
+        if source.ndim != 4:
+            return None
+        source = source.permute(0, 2, 3, 1)
+    if tuple(source.shape) != tuple(var.shape):
+        return None
+    return source
+
+
+def _built_graphs(deployable_module):
+    graphs = [
+        graph for _, graph in deployable_module._deployable_module_graph_cache.items()
+    ]
+    graph = deployable_module._deployable_module_dpl_graph
+    if graph is not None and all(graph is not g for g in graphs):
+        graphs.append(graph)
+    return [g for g in graphs if getattr(g, "_c_nn_graph", None) is not None]
+
+
+def rebind_weights(
+    deployable_module, state_dict: Dict[str, torch.Tensor], strict: bool = True
+) -> RebindWeightsReport:
+    """Copies `state_dict`, a checkpoint of the same architecture, into the module
+    and the variables of its graphs in place, without building or loading graphs.
+
+    Args:
+        strict: raise RuntimeError if the keys of `state_dict` don't match the module.
+            Shapes must match either way.
+    """
+    from onediff.infer_compiler import DeployableModule
+
+    if not isinstance(deployable_module, DeployableModule):
+        raise TypeError(
+            f"deployable_module must be a DeployableModule, got {type(deployable_module)}"
+        )
+    torch_module = deployable_module._torch_module
+    module_state = torch_module.state_dict(keep_vars=True)
+    if strict:
+        missing = [k for k in module_state if k not in state_dict]
+        unexpected = [k for k in state_dict if k not in module_state]
+        if missing or unexpected:
+            raise RuntimeError(
+                f"Error(s) in rebinding weights of {type(torch_module).__name__}: "
+                f"missing keys {missing}, unexpected keys {unexpected}"
+            )
+
+    report = RebindWeightsReport()
+    targets, sources = [], []
+    for name, target in module_state.items():
+        source = state_dict.get(name, None)
+        if source is None:
+            continue
+        if source.shape != target.shape:
+            raise RuntimeError(
+                f"Can't rebind {name}, expected shape {list(target.shape)}, got {list(source.shape)}"
+            )
+        if _same_memory(source, target):
+            report.unchanged.append(name)
+            continue
+        targets.append(target)
+        sources.append(source)
+        report.updated.append(name)
+        report.copied_bytes += _nbytes(target)
+
+    with torch.no_grad():
+        batched_copy_(targets, sources)
+
+        # Variables aliasing the module are updated already, constant folded
+        # ones and those copied from it are not. They are copied from the module
+        # on device, not from the state dict, which may be on host.
+        updated = set(report.updated)
+        seen = {tensor.data_ptr() for tensor in module_state.values()}
+        targets, sources = [], []
+        for graph in _built_graphs(deployable_module):
+            for var_name, var in zip(*graph._c_nn_graph.get_runtime_var_states()):
+                if var.data_ptr() in seen:
+                    continue
+                source = _graph_variable_source(var_name, var, module_state, updated)
+                if source is None:
+                    continue
+                seen.add(var.data_ptr())
+                targets.append(flow.utils.tensor.to_torch(var))
+                sources.append(source)
+                report.copied_bytes += _nbytes(var)
+        batched_copy_(targets, sources)
+        report.graph_variables = len(targets)
+
+    info = get_constant_folding_info(deployable_module)
+    if info is not None:
+        record_constant_folding_versions(torch_module, info.keys())
+    logger.info(f"Rebound weights of {type(torch_module).__name__}: {report}")
+    return report
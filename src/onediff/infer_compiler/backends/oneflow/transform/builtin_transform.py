@@ -171,19 +171,32 @@ def _(mod: type):
     return proxy_class(mod)
 
 
+# proxy class -> the class of its converted instances, created once per class
+_of_obj_cls_cache = {}
+_of_mod_cls_cache = {}
+
+
+def _get_of_obj_cls(new_obj_cls):
+    of_obj_cls = _of_obj_cls_cache.get(new_obj_cls, None)
+    if of_obj_cls is not None:
+        return of_obj_cls
+
+    def init(self, obj):
+        for k, _ in obj.__dict__.items():
+            attr = getattr(obj, k)
+            self.__dict__[k] = torch2oflow(attr)
+
+    of_obj_cls = type(str(new_obj_cls), (new_obj_cls,), {"__init__": init})
+    _of_obj_cls_cache[new_obj_cls] = of_obj_cls
+    return of_obj_cls
+
+
 def default_converter(obj, verbose=False, *, proxy_cls=None, bypass_check=False):
     if not bypass_check and not is_need_mock(type(obj)):
         return obj
     try:
         new_obj_cls = proxy_class(type(obj)) if proxy_cls is None else proxy_cls
-
-        def init(self):
-            for k, _ in obj.__dict__.items():
-                attr = getattr(obj, k)
-                self.__dict__[k] = torch2oflow(attr)
-
-        of_obj_cls = type(str(new_obj_cls), (new_obj_cls,), {"__init__": init})
-        of_obj = of_obj_cls()
+        of_obj = _get_of_obj_cls(new_obj_cls)(obj)
 
         if verbose:
             logger.info(f"convert {type(obj)} to {type(of_obj)}")
@@ -193,14 +206,28 @@ def default_converter(obj, verbose=False, *, proxy_cls=None, bypass_check=False)
         return obj
 
 
-@torch2oflow.register
-def _(mod: torch.nn.Module, verbose=False):
-    proxy_md = ProxySubmodule(mod)
-    new_md_cls = proxy_class(type(mod))
+class _ProxySubmoduleRef:
+    """The proxy of a converted module, shared by its copies."""
 
-    def init(self):
-        nonlocal proxy_md
+    __slots__ = ("proxy_md",)
 
+    def __init__(self, proxy_md):
+        self.proxy_md = proxy_md
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _get_of_mod_cls(new_md_cls):
+    of_mod_cls = _of_mod_cls_cache.get(new_md_cls, None)
+    if of_mod_cls is not None:
+        return of_mod_cls
+
+    def init(self, proxy_md):
+        self.__dict__["_oflow_proxy_md_ref"] = _ProxySubmoduleRef(proxy_md)
         flow.nn.Module.__init__(self)
 
         self._parameters = OrderedDict()
@@ -223,8 +250,6 @@ def _(mod: torch.nn.Module, verbose=False):
                     raise NotImplementedError(f"Unsupported type: {type(attr)}")
 
     def proxy_getattr(self, attr):
-        nonlocal proxy_md
-
         try:
             return super().__getattribute__(attr)
         except Exception as e:
@@ -235,12 +260,20 @@ def _(mod: torch.nn.Module, verbose=False):
             elif attr in self._buffers:
                 return self._buffers[attr]
             else:
-                return getattr(proxy_md, attr)
+                return getattr(self.__dict__["_oflow_proxy_md_ref"].proxy_md, attr)
 
     of_mod_cls = type(
         str(new_md_cls), (new_md_cls,), {"__init__": init, "__getattr__": proxy_getattr}
     )
-    of_mod = of_mod_cls()
+    _of_mod_cls_cache[new_md_cls] = of_mod_cls
+    return of_mod_cls
+
+
+@torch2oflow.register
+def _(mod: torch.nn.Module, verbose=False):
+    proxy_md = ProxySubmodule(mod)
+    new_md_cls = proxy_class(type(mod))
+    of_mod = _get_of_mod_cls(new_md_cls)(proxy_md)
 
     if of_mod.training:
         of_mod.training = False
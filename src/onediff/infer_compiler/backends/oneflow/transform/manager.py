@@ -1,4 +1,6 @@
 import importlib
+import importlib.metadata
+import json
 import logging
 import os
 import types
@@ -24,6 +26,8 @@ class TransformManager:
         self.debug_mode = debug_mode
         self._torch_to_oflow_cls_map = {}
         self._oflow_to_torch_cls_map = {}
+        # torch class -> proxy class, skips formatting the mock name of the class
+        self._cls_proxy_cache = {}
         self._setup_logger()
         self.mocker = LazyMocker(prefix="", suffix="", tmp_dir=None)
         self.loaded_modules = set()
@@ -51,6 +55,7 @@ class TransformManager:
 
         """
         self._torch_to_oflow_cls_map.update(class_proxy_dict)
+        self._cls_proxy_cache.clear()
 
         debug_message = f"Updated class proxies: {len(class_proxy_dict)=}"
         debug_message += f"\n{class_proxy_dict}\n"
@@ -68,12 +73,18 @@ class TransformManager:
 
     def transform_cls(self, cls):
         """Transform a class to a mock class ."""
+        mock_cls = self._cls_proxy_cache.get(cls, None)
+        if mock_cls is not None:
+            return mock_cls
+
         full_cls_name = cls.__module__ + "." + cls.__qualname__
         mock_full_cls_name = self.get_transformed_entity_name(full_cls_name)
 
         # transform cache
         if mock_full_cls_name in self._torch_to_oflow_cls_map:
-            return self._torch_to_oflow_cls_map[mock_full_cls_name]
+            mock_cls = self._torch_to_oflow_cls_map[mock_full_cls_name]
+            self._cls_proxy_cache[cls] = mock_cls
+            return mock_cls
 
         # transform
         if cls.__module__.startswith("torch."):
@@ -85,6 +96,7 @@ class TransformManager:
 
         self._torch_to_oflow_cls_map[mock_full_cls_name] = mock_cls
         self._oflow_to_torch_cls_map[mock_full_cls_name] = cls
+        self._cls_proxy_cache[cls] = mock_cls
         return mock_cls
 
     def reverse_transform_cls(self, cls):
@@ -108,6 +120,56 @@ class TransformManager:
     def transform_package(self, package_name):
         return self._transform_entity(package_name)
 
+    def save_class_proxy_table(self, file_path: Union[Path, str]):
+        """Saves the names of the classes transformed so far.
+
+        Proxy classes are created by mocking their packages, so only their names
+        can be saved. Load the table with `load_class_proxy_table` at startup to
+        mock them before the first model is converted.
+        """
+        table = sorted(
+            f"{cls.__module__}.{cls.__qualname__}"
+            for cls in self._oflow_to_torch_cls_map.values()
+        )
+        with open(file_path, "w") as f:
+            json.dump(table, f, indent=2)
+
+    def load_class_proxy_table(self, file_path: Union[Path, str]) -> int:
+        """Transforms the classes of a table saved by `save_class_proxy_table`.
+
+        Returns:
+            The number of classes transformed, classes that can't be imported
+            any more are skipped.
+        """
+        with open(file_path, "r") as f:
+            table = json.load(f)
+        num_loaded = 0
+        for full_cls_name in table:
+            # The qualname may contain dots, find the longest importable module
+            parts = full_cls_name.split(".")
+            cls = None
+            for i in range(len(parts) - 1, 0, -1):
+                try:
+                    cls = importlib.import_module(".".join(parts[:i]))
+                except ImportError:
+                    continue
+                try:
+                    for name in parts[i:]:
+                        cls = getattr(cls, name)
+                except AttributeError:
+                    cls = None
+                break
+            if not isinstance(cls, type):
+                self.logger.warning(f"Skip class {full_cls_name}, it can't be imported")
+                continue
+            try:
+                self.transform_cls(cls)
+                num_loaded += 1
+            except Exception as e:
+                self.logger.warning(f"Failed to transform class {full_cls_name}: {e}")
+        self.logger.info(f"Loaded {num_loaded} class proxies from {file_path}")
+        return num_loaded
+
 
 debug_mode = os.getenv("ONEDIFF_DEBUG", "0") == "1"
 transform_mgr = TransformManager(debug_mode=debug_mode, tmp_dir=None)
@@ -117,15 +179,22 @@ if not transform_mgr.debug_mode:
     warnings.simplefilter("ignore", category=FutureWarning)
 
 
-if importlib.util.find_spec("pydantic") is not None:
-    import pydantic
+def _get_package_version(package_name):
+    # Read the metadata instead of importing the package, pydantic takes long to import
+    try:
+        version = importlib.metadata.version(package_name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+    return tuple(int(x) if x.isdigit() else 0 for x in version.split(".")[:3])
 
-    if pydantic.VERSION < "2.5.2":
-        logger.warning(
-            f"Pydantic version {pydantic.VERSION} is too low, please upgrade to 2.5.2 or higher."
-        )
-        from oneflow.mock_torch.mock_utils import MockEnableDisableMixin
 
-        MockEnableDisableMixin.hazard_list.append(
-            "huggingface_hub.inference._text_generation"
-        )
+_pydantic_version = _get_package_version("pydantic")
+if _pydantic_version is not None and _pydantic_version < (2, 5, 2):
+    logger.warning(
+        f"Pydantic version {'.'.join(map(str, _pydantic_version))} is too low, please upgrade to 2.5.2 or higher."
+    )
+    from oneflow.mock_torch.mock_utils import MockEnableDisableMixin
+
+    MockEnableDisableMixin.hazard_list.append(
+        "huggingface_hub.inference._text_generation"
+    )
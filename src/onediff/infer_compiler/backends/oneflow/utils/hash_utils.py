@@ -1,4 +1,5 @@
 import hashlib
+import os
 
 from oneflow.framework.args_tree import ArgsTree
 
@@ -18,3 +19,82 @@ def generate_model_structure_key(deployable_module):
     model = deployable_module._deployable_module_model.oneflow_module
     model_hash = hashlib.sha256(f"{model}".encode("utf-8")).hexdigest()
     return model_hash[:8]
+
+
+def generate_env_vars_key(deployable_module) -> str:
+    """Key of the ONEFLOW_* options of `deployable_module`, empty without any."""
+    env_vars = deployable_module._deployable_module_env_vars
+    if not env_vars:
+        return ""
+    env_vars_str = ",".join(f"{name}={env_vars[name]}" for name in sorted(env_vars))
+    return hashlib.sha256(env_vars_str.encode("utf-8")).hexdigest()[:8]
+
+
+def _dtype_name(dtype) -> str:
+    # torch.float16 and oneflow.float16 get the same name
+    return str(dtype).split(".")[-1]
+
+
+def generate_input_signature(args_tree: ArgsTree, with_shape=True) -> str:
+    signature = []
+    for node in args_tree.iter_nodes():
+        if node is None:
+            continue
+        if hasattr(node, "shape") and hasattr(node, "dtype"):
+            shape = "x".join(map(str, node.shape)) if with_shape else len(node.shape)
+            signature.append(
+                f"{extract_node_name(node)}[{_dtype_name(node.dtype)},{shape}]"
+            )
+        else:
+            signature.append(extract_node_name(node))
+    return "_".join(signature)
+
+
+def _device_signature() -> str:
+    import torch
+
+    if not torch.cuda.is_available():
+        return "cpu"
+    major, minor = torch.cuda.get_device_capability()
+    return f"{torch.cuda.get_device_name()}:sm_{major}{minor}"
+
+
+def generate_graph_cache_key(
+    deployable_module, args_tree: ArgsTree, graph_pool_key: str
+) -> str:
+    """Full-strength key of the graph file of `deployable_module` serving `args_tree`,
+    `graph_pool_key` is the key of the graph in the graph pool.
+
+    It covers the model structure and weight shapes, the input signature, the
+    ONEFLOW_* optimization flags, the library versions and the GPU arch.
+    """
+    import oneflow
+
+    import onediff
+
+    dynamic = deployable_module._deployable_module_enable_dynamic
+    hasher = hashlib.sha256()
+
+    def update(value):
+        hasher.update(str(value).encode("utf-8"))
+        hasher.update(b"\0")
+
+    update(deployable_module._deployable_module_model.oneflow_module)
+    for name, tensor in deployable_module._torch_module.state_dict().items():
+        update(f"{name}:{_dtype_name(tensor.dtype)}:{tuple(tensor.shape)}")
+    # Dynamic graphs serve every shape of the same ranks, so only bucketed
+    # shapes (in graph_pool_key) are part of the key of them.
+    update(generate_input_signature(args_tree, with_shape=not dynamic))
+    update(graph_pool_key)
+    env_vars = {
+        name: value for name, value in os.environ.items() if name.startswith("ONEFLOW_")
+    }
+    # Set in the scope of the graphs of the module only
+    env_vars.update(deployable_module._deployable_module_env_vars)
+    for name in sorted(env_vars):
+        update(f"{name}={env_vars[name]}")
+    update(f"oneflow={oneflow.__version__}")
+    update(f"onediff={onediff.__version__}")
+    update(_device_signature())
+    update(f"dynamic={dynamic}")
+    return hasher.hexdigest()
@@ -1,30 +1,115 @@
+import dataclasses
 import functools
 import importlib
 import os
 import types
 from typing import Any, cast, Dict, List, Optional, Sequence, Tuple
 
+import torch
+
+from onediff.utils import logger
+from onediff.utils.import_utils import is_nexfort_available, is_oneflow_available
 
 _BACKENDS: Dict[str, Any] = dict()
+_CAPABILITIES: Dict[str, "BackendCapabilities"] = dict()
+
+# Backends shipped with onediff, registered when their package is imported
+_BUILTIN_BACKENDS = {
+    "oneflow": is_oneflow_available,
+    "nexfort": is_nexfort_available,
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class BackendCapabilities:
+    """What a backend supports, used by backend="auto" to choose backends."""
+
+    # serves changing input shapes without recompiling from scratch
+    dynamic_shapes: bool = False
+    # compiled results can be saved and loaded, e.g. by graph files
+    graph_save_load: bool = False
+    quantization: bool = False
+    device_types: Tuple[str, ...] = ("cuda",)
+    # class names of the supported modules and of their base classes, empty for any
+    module_types: Tuple[str, ...] = ()
+    excluded_module_types: Tuple[str, ...] = ()
+    # backends of lower priority are tried first
+    priority: int = 100
+
+    def provides(self, features: Sequence[str]) -> bool:
+        return all(getattr(self, feature) for feature in features)
+
+    def supports(self, torch_module) -> Tuple[bool, str]:
+        """Returns whether `torch_module` is supported, and why not if it isn't."""
+        if not isinstance(torch_module, torch.nn.Module):
+            return True, ""
+        class_names = {cls.__name__ for cls in type(torch_module).__mro__}
+        excluded = class_names.intersection(self.excluded_module_types)
+        if excluded:
+            return False, f"{', '.join(sorted(excluded))} is excluded"
+        if self.module_types and not class_names.intersection(self.module_types):
+            return False, f"{type(torch_module).__name__} is not supported"
+        device = next(
+            (t.device for t in torch_module.parameters()),
+            next((t.device for t in torch_module.buffers()), None),
+        )
+        if device is not None and device.type not in self.device_types:
+            return False, f"device {device.type} is not supported"
+        return True, ""
 
 
 def register_backend(
     name: Optional[str] = None,
     tags: Sequence[str] = (),
+    capabilities: Optional[BackendCapabilities] = None,
 ):
     def wrapper(compiler_fn: Optional[Any] = None):
         if compiler_fn is None:
-            return functools.partial(register_backend, name=name, tags=tags)
+            return functools.partial(
+                register_backend, name=name, tags=tags, capabilities=capabilities
+            )
         assert callable(compiler_fn)
         fname = name or compiler_fn.__name__
         assert fname not in _BACKENDS, f"duplicate name: {fname}"
         _BACKENDS[fname] = compiler_fn
         compiler_fn._tags = tuple(tags)
+        if capabilities is not None:
+            _CAPABILITIES[fname] = capabilities
         return compiler_fn
 
     return wrapper
 
 
+def get_backend_capabilities(name: str) -> Optional[BackendCapabilities]:
+    lookup_backend(name)
+    return _CAPABILITIES.get(name, None)
+
+
+def update_backend_capabilities(name: str, **changes) -> BackendCapabilities:
+    """Overrides capabilities of a backend, e.g.
+    >>> update_backend_capabilities("oneflow", excluded_module_types=("ControlNetModel",))
+    """
+    capabilities = get_backend_capabilities(name) or BackendCapabilities()
+    _CAPABILITIES[name] = dataclasses.replace(capabilities, **changes)
+    return _CAPABILITIES[name]
+
+
+def list_available_backends() -> List[str]:
+    """Names of the backends with capabilities that can be used, by priority.
+
+    Builtin backends are imported if their dependencies are installed.
+    """
+    for name, is_available in _BUILTIN_BACKENDS.items():
+        if name not in _BACKENDS and is_available():
+            try:
+                _lazy_import(name)
+            except Exception as e:
+                logger.warning(
+                    f"Backend {name} is installed but can't be imported: {e}"
+                )
+    return sorted(_CAPABILITIES, key=lambda name: _CAPABILITIES[name].priority)
+
+
 def lookup_backend(compiler_fn):
     """Expand backend strings to functions"""
     if isinstance(compiler_fn, str):
@@ -0,0 +1,139 @@
+"""Persistent input and output tensors of compiled graphs.
+
+Replaying a graph captured with CUDA graphs is cheap on the device, so for small
+inputs and few steps the host time of converting the inputs and outputs of every
+call dominates. With static IO buffers, a module copies the inputs of each call
+into tensors allocated once per input shapes, whose backend tensors are created
+once too, and copies the outputs into persistent tensors it returns. Graphs
+replayed by CUDA graphs write their outputs into persistent memory already, their
+outputs are returned as they are, without copies:
+
+    >>> options = OneflowCompileOptions(static_io_buffers=True)
+    >>> unet = compile(pipe.unet, options=options)
+    >>> noise_pred = unet(latents, t, embeds)  # overwritten by the next call
+    >>> noise_pred = noise_pred.clone()  # to keep it
+
+The outputs of a call are overwritten by the next call with the same input
+shapes. Inputs aliasing the buffers, such as the outputs of the previous call,
+are cloned before being copied, so no buffer is overwritten before it's read.
+Buffers are not thread safe, a module with them must be called by one thread.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import torch
+
+__all__ = ["StaticIOBuffers"]
+
+
+def _tensor_meta(tensor: torch.Tensor) -> Tuple[Any, ...]:
+    return (tuple(tensor.shape), tensor.dtype, tensor.device)
+
+
+def _memory_range(tensor: torch.Tensor) -> Tuple[Any, int, int]:
+    if tensor.numel() == 0:
+        return (tensor.device, 0, 0)
+    extent = 1 + sum(
+        (size - 1) * stride for size, stride in zip(tensor.shape, tensor.stride())
+    )
+    start = tensor.data_ptr()
+    return (tensor.device, start, start + extent * tensor.element_size())
+
+
+def _overlaps(a, b) -> bool:
+    return a[0] == b[0] and a[1] < b[2] and b[1] < a[2]
+
+
+class _StaticIOEntry:
+    __slots__ = ("inputs", "input_ranges", "mapped_inputs", "outputs")
+
+    def __init__(self, tensors: Sequence[torch.Tensor], input_fn):
+        self.inputs = [
+            torch.empty_like(tensor, memory_format=torch.contiguous_format)
+            for tensor in tensors
+        ]
+        self.input_ranges = [_memory_range(buffer) for buffer in self.inputs]
+        self.mapped_inputs = [input_fn(buffer) for buffer in self.inputs]
+        self.outputs: Optional[List[torch.Tensor]] = None
+
+
+class StaticIOBuffers:
+    """The buffers of a module, one entry per graph key and input shapes, at most
+    `max_size` of them, least recently used ones are freed first.
+
+    Args:
+        input_fn: converts an input buffer to the tensor passed to the graph, once.
+        persistent_outputs: the outputs of the graphs are persistent already, e.g.
+            with CUDA graphs, and are returned without being copied.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 9,
+        input_fn: Optional[Callable[[torch.Tensor], Any]] = None,
+        persistent_outputs: bool = False,
+    ):
+        self.max_size = max_size
+        self.input_fn = input_fn if input_fn is not None else (lambda tensor: tensor)
+        self.persistent_outputs = persistent_outputs
+        self._entries: "OrderedDict[Tuple[Any, ...], _StaticIOEntry]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _get_entry(self, key, tensors: List[torch.Tensor]) -> _StaticIOEntry:
+        entry_key = (key, tuple(_tensor_meta(tensor) for tensor in tensors))
+        entry = self._entries.get(entry_key, None)
+        if entry is None:
+            entry = _StaticIOEntry(tensors, self.input_fn)
+            self._entries[entry_key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(entry_key)
+        return entry
+
+    def copy_inputs(
+        self, key, tensors: Sequence[torch.Tensor]
+    ) -> Tuple[_StaticIOEntry, List[Any]]:
+        """Copies `tensors` into the input buffers of `key` and returns the entry
+        and the converted input buffers, in the order of `tensors`.
+        """
+        tensors = list(tensors)
+        entry = self._get_entry(key, tensors)
+        sources = []
+        for tensor in tensors:
+            tensor_range = _memory_range(tensor)
+            # Another buffer may be overwritten before this one is read
+            if any(_overlaps(tensor_range, other) for other in entry.input_ranges):
+                tensor = tensor.clone()
+            sources.append(tensor)
+        for source, buffer in zip(sources, entry.inputs):
+            buffer.copy_(source)
+        return entry, entry.mapped_inputs
+
+    def copy_outputs(
+        self, entry: _StaticIOEntry, tensors: Sequence[torch.Tensor]
+    ) -> List[torch.Tensor]:
+        """Copies the output `tensors` of the call of `entry` into its persistent
+        output buffers, and returns the buffers. Returns `tensors` as they are if
+        they are persistent already.
+        """
+        tensors = list(tensors)
+        if self.persistent_outputs:
+            return tensors
+        outputs = entry.outputs
+        if outputs is None or [_tensor_meta(t) for t in outputs] != [
+            _tensor_meta(t) for t in tensors
+        ]:
+            entry.outputs = [
+                tensor.clone(memory_format=torch.contiguous_format)
+                for tensor in tensors
+            ]
+            return list(entry.outputs)
+        for buffer, tensor in zip(outputs, tensors):
+            buffer.copy_(tensor)
+        return list(outputs)
@@ -0,0 +1,305 @@
+"""Counters, timers and memory deltas of deployable modules.
+
+Stats are disabled by default and cost a single attribute check per call then.
+Enable them per module with `DeployableModule.enable_stats()`, or for all modules
+with the environment variable ONEDIFF_ENABLE_STATS=1, and read them with
+`DeployableModule.get_stats()`:
+
+    >>> unet.enable_stats()
+    >>> pipe(prompt)
+    >>> unet.get_stats()["timers"]["execution_time"]
+    {'count': 30, 'total': 1.52, 'max': 0.081, 'mean': 0.0506}
+
+The nexfort backend times the device work of a call as "execution_time" with CUDA
+events. The oneflow backend runs its kernels on the streams of oneflow, so it
+records the host time to launch a call as "launch_time" instead.
+
+Every recorded value is also passed to the exporters registered with
+`register_stats_exporter`, e.g. `PrometheusExporter` or `OpenTelemetryExporter`.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from onediff.utils import logger, parse_boolean_from_env
+
+__all__ = [
+    "ModuleStats",
+    "OpenTelemetryExporter",
+    "PrometheusExporter",
+    "register_stats_exporter",
+    "unregister_stats_exporter",
+]
+
+# exporter(module_name, metric, kind, value), kind is "count", "time" or "memory"
+StatsExporter = Callable[[str, str, str, float], None]
+
+_exporters: List[StatsExporter] = []
+
+# CUDA events are resolved lazily, at most this many are kept pending
+_MAX_PENDING_EVENTS = 64
+
+
+def device_memory_used_mb() -> float:
+    """The used device memory in MB, 0 without CUDA.
+
+    The device is queried instead of the torch allocator to include the memory of
+    oneflow.
+    """
+    import torch
+
+    if not torch.cuda.is_available():
+        return 0.0
+    torch.cuda.synchronize()
+    free, total = torch.cuda.mem_get_info()
+    return (total - free) / 1024**2
+
+
+def register_stats_exporter(exporter: StatsExporter) -> None:
+    _exporters.append(exporter)
+
+
+def unregister_stats_exporter(exporter: StatsExporter) -> None:
+    _exporters.remove(exporter)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, stats: "ModuleStats", name: str):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stats.record_time(self.name, time.perf_counter() - self.start_time)
+        return False
+
+
+class _CUDATimer:
+    def __init__(self, stats: "ModuleStats", name: str):
+        import torch
+
+        self.stats = stats
+        self.name = name
+        self.start_event = torch.cuda.Event(enable_timing=True)
+        self.end_event = torch.cuda.Event(enable_timing=True)
+
+    def __enter__(self):
+        self.start_event.record()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end_event.record()
+        # Don't synchronize here, the elapsed time is read later
+        self.stats._add_pending_event(self.name, self.start_event, self.end_event)
+        return False
+
+
+class ModuleStats:
+    """Stats of a deployable module.
+
+    Args:
+        name: the name reported to exporters, the class name of the torch module.
+        enabled: whether to record stats, defaults to ONEDIFF_ENABLE_STATS.
+    """
+
+    def __init__(self, name: str, enabled: Optional[bool] = None):
+        self.name = name
+        self.enabled = (
+            parse_boolean_from_env("ONEDIFF_ENABLE_STATS", False)
+            if enabled is None
+            else enabled
+        )
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._timers: Dict[str, Dict[str, float]] = {}
+        self._memory: Dict[str, float] = {}
+        self._pending_events = []
+
+    def _export(self, metric: str, kind: str, value: float) -> None:
+        for exporter in _exporters:
+            try:
+                exporter(self.name, metric, kind, value)
+            except Exception as e:
+                logger.warning(f"Stats exporter {exporter} failed: {e}")
+
+    def inc(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        self._export(name, "count", value)
+
+    def record_time(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            timer = self._timers.get(name, None)
+            if timer is None:
+                timer = {"count": 0, "total": 0.0, "max": 0.0}
+                self._timers[name] = timer
+            timer["count"] += 1
+            timer["total"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+        self._export(name, "time", seconds)
+
+    def record_memory(self, name: str, delta_mb: float) -> None:
+        """Accumulates a device memory delta in MB."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._memory[name] = self._memory.get(name, 0.0) + delta_mb
+        self._export(name, "memory", delta_mb)
+
+    def timer(self, name: str, cuda: bool = False):
+        """A context manager recording the time of its body.
+
+        With `cuda=True`, the time of the CUDA work queued on the current torch
+        stream is measured by CUDA events instead of the host time.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        if cuda:
+            import torch
+
+            if torch.cuda.is_available():
+                return _CUDATimer(self, name)
+        return _Timer(self, name)
+
+    def _add_pending_event(self, name, start_event, end_event) -> None:
+        with self._lock:
+            self._pending_events.append((name, start_event, end_event))
+            num_pending = len(self._pending_events)
+        if num_pending > _MAX_PENDING_EVENTS:
+            self._resolve_pending_events(block=False)
+
+    def _resolve_pending_events(self, block: bool) -> None:
+        with self._lock:
+            pending, self._pending_events = self._pending_events, []
+        remaining = []
+        for i, (name, start_event, end_event) in enumerate(pending):
+            if not block and not end_event.query():
+                # Events complete in order
+                remaining = pending[i:]
+                break
+            if block:
+                end_event.synchronize()
+            self.record_time(name, start_event.elapsed_time(end_event) / 1000)
+        if remaining:
+            with self._lock:
+                self._pending_events = remaining + self._pending_events
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._resolve_pending_events(block=True)
+        with self._lock:
+            timers = {
+                name: dict(timer, mean=timer["total"] / timer["count"])
+                for name, timer in self._timers.items()
+            }
+            return {
+                "enabled": self.enabled,
+                "counters": dict(self._counters),
+                "timers": timers,
+                "memory": dict(self._memory),
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self._memory.clear()
+            self._pending_events = []
+
+
+class PrometheusExporter:
+    """Exports stats to prometheus_client metrics labeled by module.
+
+    Example:
+        >>> register_stats_exporter(PrometheusExporter())
+        >>> prometheus_client.start_http_server(8000)
+    """
+
+    def __init__(self, registry=None, prefix="onediff"):
+        import prometheus_client
+
+        self._prometheus_client = prometheus_client
+        self.registry = registry or prometheus_client.REGISTRY
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_metric(self, metric: str, kind: str):
+        key = (metric, kind)
+        with self._lock:
+            if key not in self._metrics:
+                name = f"{self.prefix}_{metric}"
+                if kind == "count":
+                    cls = self._prometheus_client.Counter
+                elif kind == "time":
+                    cls, name = self._prometheus_client.Histogram, f"{name}_seconds"
+                else:
+                    cls, name = self._prometheus_client.Gauge, f"{name}_mb"
+                self._metrics[key] = cls(
+                    name, f"OneDiff {metric}", ["module"], registry=self.registry
+                )
+            return self._metrics[key]
+
+    def __call__(self, module_name: str, metric: str, kind: str, value: float):
+        labeled = self._get_metric(metric, kind).labels(module=module_name)
+        if kind == "count":
+            labeled.inc(value)
+        elif kind == "time":
+            labeled.observe(value)
+        else:
+            labeled.inc(value)
+
+
+class OpenTelemetryExporter:
+    """Exports stats to OpenTelemetry instruments with a `module` attribute."""
+
+    def __init__(self, meter=None):
+        if meter is None:
+            from opentelemetry import metrics
+
+            meter = metrics.get_meter("onediff")
+        self.meter = meter
+        self._instruments = {}
+        self._lock = threading.Lock()
+
+    def _get_instrument(self, metric: str, kind: str):
+        key = (metric, kind)
+        with self._lock:
+            if key not in self._instruments:
+                if kind == "count":
+                    instrument = self.meter.create_counter(f"onediff.{metric}")
+                elif kind == "time":
+                    instrument = self.meter.create_histogram(
+                        f"onediff.{metric}", unit="s"
+                    )
+                else:
+                    instrument = self.meter.create_up_down_counter(
+                        f"onediff.{metric}", unit="MB"
+                    )
+                self._instruments[key] = instrument
+            return self._instruments[key]
+
+    def __call__(self, module_name: str, metric: str, kind: str, value: float):
+        instrument = self._get_instrument(metric, kind)
+        attributes = {"module": module_name}
+        if kind == "time":
+            instrument.record(value, attributes)
+        else:
+            instrument.add(value, attributes)
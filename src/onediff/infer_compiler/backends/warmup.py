@@ -0,0 +1,132 @@
+"""Ahead-of-time warmup of compiled modules driven by a shape manifest."""
+import dataclasses
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import torch
+
+from onediff.utils import logger
+from .stats import device_memory_used_mb
+
+__all__ = ["WarmupShape", "WarmupResult", "parse_warmup_manifest", "run_warmup"]
+
+
+@dataclasses.dataclass
+class WarmupShape:
+    height: int
+    width: int
+    batch_size: int = 1
+    dtype: Optional[torch.dtype] = None
+    kwargs: Dict[str, Any] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def from_value(cls, value) -> "WarmupShape":
+        """Creates a WarmupShape from a WarmupShape, a dict or a
+        (height, width, batch_size, dtype, kwargs) tuple, trailing items are optional.
+        """
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            value = dict(value)
+            if "batch" in value:
+                value["batch_size"] = value.pop("batch")
+            shape = cls(**value)
+        elif isinstance(value, (tuple, list)):
+            shape = cls(*value)
+        else:
+            raise TypeError(f"Unsupported warmup shape: {value!r}")
+        if isinstance(shape.dtype, str):
+            shape.dtype = getattr(torch, shape.dtype.replace("torch.", ""))
+        return shape
+
+
+@dataclasses.dataclass
+class WarmupResult:
+    shape: Any
+    compile_time: float
+    # Change of the used device memory in MB
+    memory_used: float
+    error: Optional[str] = None
+
+
+def parse_warmup_manifest(
+    manifest: Union[str, os.PathLike, Sequence[Any]]
+) -> List[WarmupShape]:
+    """Parses a warmup manifest, which is a list of shapes or a JSON file of one."""
+    if isinstance(manifest, (str, os.PathLike)):
+        with open(manifest, "r") as f:
+            manifest = json.load(f)
+    return [WarmupShape.from_value(value) for value in manifest]
+
+
+def run_warmup(
+    run_fn: Callable[[Any], Any], shapes: Sequence[Any], *, raise_on_error=True
+) -> List[WarmupResult]:
+    """Calls `run_fn(shape)` for every shape, and reports the time and the device
+    memory each call takes.
+    """
+    results = []
+    for shape in shapes:
+        before_used = device_memory_used_mb()
+        start_time = time.perf_counter()
+        error = None
+        try:
+            run_fn(shape)
+        except Exception as e:
+            if raise_on_error:
+                raise
+            error = f"{type(e).__name__}: {e}"
+            logger.error(f"Warmup of {shape} failed! {error}")
+        memory_used = device_memory_used_mb() - before_used
+        compile_time = time.perf_counter() - start_time
+        result = WarmupResult(shape, compile_time, memory_used, error)
+        logger.info(
+            f"Warmup {shape}: {compile_time:.2f}s, device memory {memory_used:+.1f} MB"
+        )
+        results.append(result)
+    return results
+
+
+def _is_args_kwargs_pair(value) -> bool:
+    return (
+        isinstance(value, tuple)
+        and len(value) == 2
+        and isinstance(value[0], (tuple, list))
+        and isinstance(value[1], dict)
+    )
+
+
+def parse_module_warmup_manifest(
+    manifest: Union[str, os.PathLike, Sequence[Any]]
+) -> List[Any]:
+    """Like parse_warmup_manifest, but keeps explicit `(args, kwargs)` pairs as they are."""
+    if isinstance(manifest, (str, os.PathLike)):
+        return parse_warmup_manifest(manifest)
+    return [
+        value if _is_args_kwargs_pair(value) else WarmupShape.from_value(value)
+        for value in manifest
+    ]
+
+
+def make_module_inputs(
+    entry, input_fn: Optional[Callable[[WarmupShape], Any]]
+) -> Tuple[tuple, dict]:
+    """Returns (args, kwargs) of a manifest entry for a module.
+
+    An entry is either an explicit `(args, kwargs)` pair or a WarmupShape, in which
+    case `input_fn(shape)` has to build the inputs.
+    """
+    if _is_args_kwargs_pair(entry):
+        return tuple(entry[0]), entry[1]
+    if input_fn is None:
+        raise ValueError(
+            f"input_fn is required to build the inputs of warmup shape {entry!r}"
+        )
+    inputs = input_fn(entry)
+    if isinstance(inputs, dict):
+        return (), inputs
+    if _is_args_kwargs_pair(inputs):
+        return tuple(inputs[0]), inputs[1]
+    return tuple(inputs), {}
@@ -15,6 +15,9 @@ from onediff.utils import logger
 
 __all__ = ["quantize_model", "varify_can_use_quantization"]
 
+# Max number of weight elements stacked to find their scales in one pass
+MAX_STACKED_WEIGHT_NUMEL = 1 << 26
+
 
 def varify_can_use_quantization():
     if not is_quantization_enabled():
@@ -23,6 +26,45 @@ def varify_can_use_quantization():
     return True
 
 
+def _group_weights(modules):
+    """Yields batches of (name, module) whose weights have the same device and number
+    of elements per output channel, so they can be stacked along output channels.
+    """
+    groups = {}
+    for name, module in modules.items():
+        weight = module.weight
+        key = (weight.device, weight.numel() // weight.shape[0])
+        groups.setdefault(key, []).append((name, module))
+
+    for items in groups.values():
+        batch, numel = [], 0
+        for name, module in items:
+            if batch and numel + module.weight.numel() > MAX_STACKED_WEIGHT_NUMEL:
+                yield batch
+                batch, numel = [], 0
+            batch.append((name, module))
+            numel += module.weight.numel()
+        if batch:
+            yield batch
+
+
+def _find_weight_scales(quantizer_cls, batch, bits):
+    """Finds the per-channel scales of the weights of `batch` in one pass.
+
+    Returns the scales on device, as lists on host, and maxq.
+    """
+    weights = [module.weight.detach().flatten(1) for _, module in batch]
+    quantizer = quantizer_cls()
+    quantizer.configure(bits=bits, perchannel=True)
+    # Scales are found per row, stacking rows doesn't change them
+    quantizer.find_params(torch.cat(weights).float(), weight=True)
+    sections = [weight.shape[0] for weight in weights]
+    scale = quantizer.scale.reshape(-1)
+    # A single host round-trip for the whole batch
+    weight_scales = [s.tolist() for s in scale.cpu().split(sections)]
+    return scale.split(sections), weight_scales, quantizer.maxq
+
+
 @cost_cnt(debug=transform_mgr.debug_mode)
 def quantize_model(
     model,  # diffusion_model
@@ -62,38 +104,45 @@ def quantize_model(
     def apply_quantization_to_modules(quantizable_modules):
         nonlocal model, quantize_conv_cnt, quantize_linear_cnt
 
-        for sub_module_name, sub_mod in quantizable_modules.items():
-            if no_quantizable(sub_module_name):
-                continue
-
-            if isinstance(sub_mod, nn.Conv2d):
-                quantize_conv_cnt += 1
-            elif isinstance(sub_mod, nn.Linear):
-                quantize_linear_cnt += 1
-
-            quantizer = Quantizer()
-            quantizer.configure(bits=bits, perchannel=True)
-            quantizer.find_params(sub_mod.weight.float(), weight=True)
-            shape = [-1] + [1] * (len(sub_mod.weight.shape) - 1)
-            scale = quantizer.scale.reshape(*shape)
-            symm_quantize_sub_module(
-                model, sub_module_name, scale, quantizer.maxq, save_as_float=False
-            )
-
-            input_scale = 0
-            input_zero_point = 0
-            weight_scale = scale.reshape(-1).tolist()
-            sub_calibrate_info = [input_scale, input_zero_point, weight_scale]
-
-            sub_mod = get_quantize_module(
-                sub_mod,
-                sub_module_name,
-                sub_calibrate_info,
-                fake_quant=False,
-                static=False,
-                nbits=bits,
-            )
-
+        quantizable_modules = {
+            sub_module_name: sub_mod
+            for sub_module_name, sub_mod in quantizable_modules.items()
+            if not no_quantizable(sub_module_name)
+        }
+        quantized_modules = {}
+        for batch in _group_weights(quantizable_modules):
+            scales, weight_scales, maxq = _find_weight_scales(Quantizer, batch, bits)
+            for (sub_module_name, sub_mod), scale, weight_scale in zip(
+                batch, scales, weight_scales
+            ):
+                if isinstance(sub_mod, nn.Conv2d):
+                    quantize_conv_cnt += 1
+                elif isinstance(sub_mod, nn.Linear):
+                    quantize_linear_cnt += 1
+
+                shape = [-1] + [1] * (len(sub_mod.weight.shape) - 1)
+                symm_quantize_sub_module(
+                    model,
+                    sub_module_name,
+                    scale.reshape(*shape),
+                    maxq,
+                    save_as_float=False,
+                )
+
+                input_scale = 0
+                input_zero_point = 0
+                sub_calibrate_info = [input_scale, input_zero_point, weight_scale]
+
+                quantized_modules[sub_module_name] = get_quantize_module(
+                    sub_mod,
+                    sub_module_name,
+                    sub_calibrate_info,
+                    fake_quant=False,
+                    static=False,
+                    nbits=bits,
+                )
+
+        for sub_module_name, sub_mod in quantized_modules.items():
             modify_sub_module(model, sub_module_name, sub_mod)
 
     if quantize_conv:
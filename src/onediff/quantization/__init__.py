@@ -1,2 +1,6 @@
-from .quantize_pipeline import QuantPipeline
+from onediff.utils.import_utils import is_onediff_quant_available
+
 from .quantize_utils import load_calibration_and_quantize_pipeline, setup_onediff_quant
+
+if is_onediff_quant_available():
+    from .quantize_pipeline import QuantPipeline
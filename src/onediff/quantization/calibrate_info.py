@@ -0,0 +1,178 @@
+"""Calibration info of quantized models.
+
+The calibration info maps the name of every quantized submodule to
+`[input_scale, input_zero_point, weight_scale]`, `weight_scale` being the list of
+its per-channel scales. It's saved in one of two formats, told apart by the
+file extension:
+
+- text (calibrate_info.txt), one submodule per line:
+  `<name> <input_scale> <input_zero_point> <comma separated weight scales>`
+- safetensors (calibrate_info.safetensors), the weight scales of a submodule
+  are the float32 tensor "<name>.weight_scale" and its input scale and zero
+  point the float64 tensor "<name>.input_quant". The file is memory mapped and
+  the records are read on lookup only.
+
+Convert a file from one format to the other with:
+
+    python -m onediff.quantization.calibrate_info calibrate_info.txt calibrate_info.safetensors
+"""
+import argparse
+import os
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Union
+
+import torch
+
+__all__ = [
+    "CALIBRATE_INFO_FILES",
+    "CalibrateInfo",
+    "convert_calibrate_info",
+    "find_calibrate_info",
+    "load_calibrate_info",
+    "save_calibrate_info",
+]
+
+# File names of the calibration info next to a quantized model, by preference
+CALIBRATE_INFO_FILES = ("calibrate_info.safetensors", "calibrate_info.txt")
+
+_FORMAT = "onediff_calibrate_info"
+_VERSION = "1"
+_WEIGHT_SCALE_SUFFIX = ".weight_scale"
+_INPUT_QUANT_SUFFIX = ".input_quant"
+
+
+def _is_safetensors(path) -> bool:
+    return str(path).endswith(".safetensors")
+
+
+class CalibrateInfo(Mapping):
+    """Calibration info in a safetensors file, read lazily by submodule name."""
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        from safetensors import safe_open
+
+        self.path = str(path)
+        self._file = safe_open(self.path, framework="pt")
+        metadata = self._file.metadata() or {}
+        if metadata.get("format", None) != _FORMAT:
+            raise RuntimeError(f"{self.path} is not a calibrate info file")
+        if metadata.get("version", None) != _VERSION:
+            raise RuntimeError(
+                f"Unsupported version {metadata.get('version')} of calibrate info {self.path}"
+            )
+        self._names = [
+            key[: -len(_WEIGHT_SCALE_SUFFIX)]
+            for key in self._file.keys()
+            if key.endswith(_WEIGHT_SCALE_SUFFIX)
+        ]
+        self._name_set = set(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __contains__(self, name) -> bool:
+        return name in self._name_set
+
+    def get_weight_scale(self, name: str) -> torch.Tensor:
+        if name not in self._name_set:
+            raise KeyError(name)
+        return self._file.get_tensor(name + _WEIGHT_SCALE_SUFFIX)
+
+    def __getitem__(self, name: str) -> List:
+        weight_scale = self.get_weight_scale(name)
+        input_scale, input_zero_point = self._file.get_tensor(
+            name + _INPUT_QUANT_SUFFIX
+        ).tolist()
+        return [input_scale, int(input_zero_point), weight_scale.tolist()]
+
+
+def _load_text(path) -> Dict[str, List]:
+    calibrate_info = {}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            items = line.split(" ")
+            calibrate_info[items[0]] = [
+                float(items[1]),
+                int(items[2]),
+                [float(x) for x in items[3].split(",")],
+            ]
+    return calibrate_info
+
+
+def _weight_scale_list(weight_scale) -> List[float]:
+    if isinstance(weight_scale, torch.Tensor):
+        return weight_scale.reshape(-1).tolist()
+    return list(weight_scale)
+
+
+def _save_text(calibrate_info, path) -> None:
+    with open(path, "w") as f:
+        for name, (
+            input_scale,
+            input_zero_point,
+            weight_scale,
+        ) in calibrate_info.items():
+            weight_scale = ",".join(str(x) for x in _weight_scale_list(weight_scale))
+            f.write(f"{name} {input_scale} {input_zero_point} {weight_scale}\n")
+
+
+def _save_safetensors(calibrate_info, path) -> None:
+    from safetensors.torch import save_file
+
+    tensors = {}
+    for name, (input_scale, input_zero_point, weight_scale) in calibrate_info.items():
+        if isinstance(weight_scale, torch.Tensor):
+            weight_scale = weight_scale.detach().reshape(-1).float().cpu()
+        else:
+            weight_scale = torch.tensor(weight_scale, dtype=torch.float32)
+        tensors[name + _WEIGHT_SCALE_SUFFIX] = weight_scale.contiguous()
+        tensors[name + _INPUT_QUANT_SUFFIX] = torch.tensor(
+            [float(input_scale), float(input_zero_point)], dtype=torch.float64
+        )
+    save_file(tensors, str(path), metadata={"format": _FORMAT, "version": _VERSION})
+
+
+def load_calibrate_info(path: Union[str, os.PathLike]) -> Mapping:
+    """Loads the calibration info of a text or safetensors file, the latter lazily."""
+    if _is_safetensors(path):
+        return CalibrateInfo(path)
+    return _load_text(path)
+
+
+def save_calibrate_info(calibrate_info: Mapping, path: Union[str, os.PathLike]) -> None:
+    """Saves `calibrate_info` in the format of the extension of `path`. Weight scales
+    may be lists or tensors.
+    """
+    if _is_safetensors(path):
+        _save_safetensors(calibrate_info, path)
+    else:
+        _save_text(calibrate_info, path)
+
+
+def convert_calibrate_info(src, dst) -> None:
+    save_calibrate_info(load_calibrate_info(src), dst)
+
+
+def find_calibrate_info(model_dir: Union[str, os.PathLike]) -> Union[str, None]:
+    """Returns the path of the calibration info in `model_dir`, None if there is none."""
+    for file_name in CALIBRATE_INFO_FILES:
+        path = os.path.join(str(model_dir), file_name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert calibrate info between the text and safetensors formats"
+    )
+    parser.add_argument("src", type=str)
+    parser.add_argument("dst", type=str)
+    args = parser.parse_args()
+    convert_calibrate_info(args.src, args.dst)
@@ -0,0 +1,270 @@
+"""Mixed-precision quantization plans.
+
+A plan assigns a precision to every quantizable submodule of a model, "int8",
+"fp8", or "fp16" to keep it in the precision of the model, and applies it with the
+oneflow backend (onediff_quant) or the nexfort backend (nexfort.ao):
+
+    >>> plan = QuantizationPlan.from_cost_model(unet, lambda unet: unet(latents, t, embeds))
+    >>> plan.save("unet_quant_plan.json")
+    >>> unet = QuantizationPlan.load("unet_quant_plan.json").apply(unet, backend="nexfort")
+
+The cost model quantizes the layers that reuse their weights enough for the
+quantized kernels to pay off. Their compute density, the multiply-accumulates per
+weight element in a run of the model, is compared with thresholds, like
+`conv_compute_density_threshold` and `linear_compute_density_threshold` of the
+online quantization of onediff_quant. The first and last convs, attention
+projections and any layer matching `keep_fp16` can be kept in fp16.
+"""
+import dataclasses
+import fnmatch
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import torch
+import torch.nn as nn
+
+from onediff.utils import logger
+
+__all__ = [
+    "ATTENTION_PROJECTION_PATTERN",
+    "LayerCost",
+    "NEXFORT_QUANT_TYPES",
+    "PRECISIONS",
+    "QuantizationPlan",
+    "estimate_layer_costs",
+]
+
+PRECISIONS = ("int8", "fp8", "fp16")
+
+# quant_type of nexfort.ao.quantize of each precision
+NEXFORT_QUANT_TYPES = {"int8": "int8_dynamic", "fp8": "fp8_e4m3_e4m3_dynamic"}
+
+# Projections of the attention of diffusers and ComfyUI
+ATTENTION_PROJECTION_PATTERN = (
+    r"(^|\.)(to_q|to_k|to_v|to_out\.0|add_q_proj|add_k_proj|add_v_proj|to_add_out)$"
+)
+
+_PLAN_VERSION = 1
+
+
+@dataclasses.dataclass
+class LayerCost:
+    name: str
+    kind: str  # "conv" or "linear"
+    # multiply-accumulates of the first call of the layer
+    macs: int
+    weight_numel: int
+
+    @property
+    def compute_density(self) -> float:
+        return self.macs / self.weight_numel
+
+
+def _layer_kind(module: nn.Module) -> Optional[str]:
+    if isinstance(module, nn.Conv2d):
+        return "conv"
+    if isinstance(module, nn.Linear):
+        return "linear"
+    return None
+
+
+@torch.no_grad()
+def estimate_layer_costs(
+    model: nn.Module, run_fn: Callable[[nn.Module], Any]
+) -> List[LayerCost]:
+    """Returns the costs of the convs and linears of `model` in the order they are
+    called by `run_fn`, which runs the model on representative inputs. Layers not
+    called are left out.
+    """
+    costs = {}
+
+    def hook(name, kind):
+        def fn(module, args, output):
+            if name in costs:
+                return
+            weight_numel = module.weight.numel()
+            # Every output element takes a dot product of in_features, or of
+            # in_channels / groups * kernel size for convs
+            macs = output.numel() * (weight_numel // module.weight.shape[0])
+            costs[name] = LayerCost(name, kind, macs, weight_numel)
+
+        return fn
+
+    handles = []
+    for name, module in model.named_modules():
+        kind = _layer_kind(module)
+        if kind is not None:
+            handles.append(module.register_forward_hook(hook(name, kind)))
+    try:
+        run_fn(model)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return list(costs.values())
+
+
+@dataclasses.dataclass
+class QuantizationPlan:
+    # precision of each submodule by name, those left out are kept in fp16
+    precisions: Dict[str, str] = dataclasses.field(default_factory=dict)
+
+    def __post_init__(self):
+        for name, precision in self.precisions.items():
+            if precision not in PRECISIONS:
+                raise ValueError(
+                    f"Unknown precision {precision} of {name}, expected one of {PRECISIONS}"
+                )
+
+    def layers(self, precision: str) -> List[str]:
+        return [name for name, p in self.precisions.items() if p == precision]
+
+    def __str__(self) -> str:
+        counts = ", ".join(
+            f"{len(self.layers(precision))} {precision}" for precision in PRECISIONS
+        )
+        return f"QuantizationPlan({counts} layers)"
+
+    @classmethod
+    def from_cost_model(
+        cls,
+        model: nn.Module,
+        run_fn: Callable[[nn.Module], Any],
+        *,
+        precision: str = "int8",
+        conv_compute_density_threshold: float = 900,
+        linear_compute_density_threshold: float = 300,
+        keep_first_last_conv: bool = True,
+        keep_attention_projections: bool = False,
+        keep_fp16: Sequence[str] = (),
+        allowed_layers: Optional[Iterable[str]] = None,
+        costs: Optional[Sequence[LayerCost]] = None,
+    ) -> "QuantizationPlan":
+        """Plans to quantize the convs and linears of `model` to `precision` whose
+        compute density is at least the threshold of their kind.
+
+        Args:
+            run_fn: runs `model` on representative inputs to measure the costs.
+            keep_fp16: fnmatch patterns of names of layers kept in fp16.
+            allowed_layers: only these layers may be quantized, e.g. the layers
+                selected by `onediff.quantization.sensitivity.select_layers`.
+            costs: costs of the layers measured already, `run_fn` isn't called then.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"Unknown precision {precision}, expected one of {PRECISIONS}"
+            )
+        if costs is None:
+            costs = estimate_layer_costs(model, run_fn)
+        allowed_layers = None if allowed_layers is None else set(allowed_layers)
+        thresholds = {
+            "conv": conv_compute_density_threshold,
+            "linear": linear_compute_density_threshold,
+        }
+        convs = [cost.name for cost in costs if cost.kind == "conv"]
+        kept = set()
+        if keep_first_last_conv and convs:
+            kept.update((convs[0], convs[-1]))
+
+        precisions, quantized_macs = {}, 0
+        for cost in costs:
+            if (
+                cost.name in kept
+                or (allowed_layers is not None and cost.name not in allowed_layers)
+                or (
+                    keep_attention_projections
+                    and re.search(ATTENTION_PROJECTION_PATTERN, cost.name)
+                )
+                or any(fnmatch.fnmatchcase(cost.name, p) for p in keep_fp16)
+                or cost.compute_density < thresholds[cost.kind]
+            ):
+                precisions[cost.name] = "fp16"
+            else:
+                precisions[cost.name] = precision
+                quantized_macs += cost.macs
+
+        plan = cls(precisions)
+        total_macs = sum(cost.macs for cost in costs)
+        logger.info(
+            f"{plan}, {quantized_macs / max(total_macs, 1):.1%} of the MACs quantized"
+        )
+        return plan
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"version": _PLAN_VERSION, "precisions": dict(self.precisions)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QuantizationPlan":
+        if data.get("version", None) != _PLAN_VERSION:
+            raise RuntimeError(
+                f"Unsupported version {data.get('version')} of quantization plan"
+            )
+        return cls(dict(data["precisions"]))
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def load(cls, path: str) -> "QuantizationPlan":
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    def apply(
+        self,
+        model: nn.Module,
+        backend: str = "oneflow",
+        *,
+        quant_types: Optional[Dict[str, str]] = None,
+    ) -> nn.Module:
+        """Quantizes the submodules of `model` by the plan and returns the model.
+
+        Apply the plan to a compiled model before running it, its graphs are built
+        from the quantized submodules then.
+
+        Args:
+            backend: "oneflow" quantizes to int8 with onediff_quant, which doesn't
+                support fp8. "nexfort" quantizes with nexfort.ao.
+            quant_types: quant_type of nexfort of each precision, overriding
+                NEXFORT_QUANT_TYPES.
+        """
+        names = {name for name, _ in model.named_modules()}
+        missing = [name for name in self.precisions if name not in names]
+        if missing:
+            logger.warning(
+                f"{len(missing)} layers of the plan are not in {type(model).__name__}, e.g. {missing[0]}, the plan may be of another model"
+            )
+        if backend == "oneflow":
+            return self._apply_oneflow(model)
+        if backend == "nexfort":
+            return self._apply_nexfort(
+                model, {**NEXFORT_QUANT_TYPES, **(quant_types or {})}
+            )
+        raise ValueError(f"Unknown backend {backend}, expected 'oneflow' or 'nexfort'")
+
+    def _apply_oneflow(self, model: nn.Module) -> nn.Module:
+        if self.layers("fp8"):
+            raise ValueError("fp8 quantization is not supported by the oneflow backend")
+        from onediff.optimization.quant_optimizer import quantize_model
+
+        # Only the layers in calibrate_info are quantized
+        return quantize_model(
+            model, bits=8, calibrate_info=dict.fromkeys(self.layers("int8"), [])
+        )
+
+    def _apply_nexfort(
+        self, model: nn.Module, quant_types: Dict[str, str]
+    ) -> nn.Module:
+        from nexfort.ao import quantize
+
+        for precision in PRECISIONS:
+            layers = self.layers(precision)
+            if precision == "fp16" or not layers:
+                continue
+            model = quantize(
+                model,
+                quant_type=quant_types[precision],
+                filter_fn="is_allowed_fqn",
+                filter_fn_kwargs={"allowed_fqns": layers},
+            )
+        return model
@@ -4,6 +4,7 @@ from typing import Any, List, Optional, Union
 
 from onediff_quant import quantize_pipeline, save_quantized
 
+from .calibrate_info import find_calibrate_info
 from .quantize_utils import load_calibration_and_quantize_pipeline, setup_onediff_quant
 
 
@@ -36,9 +37,12 @@ class QuantPipeline:
         """
         setup_onediff_quant()
         pipe = cls.from_pretrained(quantized_model_name_or_path, *args, **kwargs)
-        load_calibration_and_quantize_pipeline(
-            os.path.join(str(quantized_model_name_or_path), "calibrate_info.txt"), pipe
-        )
+        calibration_path = find_calibrate_info(quantized_model_name_or_path)
+        if calibration_path is None:
+            calibration_path = os.path.join(
+                str(quantized_model_name_or_path), "calibrate_info.txt"
+            )
+        load_calibration_and_quantize_pipeline(calibration_path, pipe)
         return pipe
 
     @classmethod
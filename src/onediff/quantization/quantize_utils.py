@@ -12,11 +12,17 @@ def setup_onediff_quant():
 
 
 def load_calibration_and_quantize_pipeline(calibration_path, pipe):
-    from onediff_quant.quantization import CalibrationStorage
     from onediff_quant.utils import replace_sub_module_with_quantizable_module
 
-    store = CalibrationStorage()
-    calibrate_info = store.load_from_file(file_path=calibration_path)
+    if str(calibration_path).endswith(".safetensors"):
+        from .calibrate_info import load_calibrate_info
+
+        calibrate_info = load_calibrate_info(calibration_path)
+    else:
+        from onediff_quant.quantization import CalibrationStorage
+
+        store = CalibrationStorage()
+        calibrate_info = store.load_from_file(file_path=calibration_path)
 
     for sub_module_name, sub_calibrate_info in calibrate_info.items():
         replace_sub_module_with_quantizable_module(
@@ -0,0 +1,491 @@
+"""Sensitivity of the layers of a model to quantization.
+
+Each quantizable layer, or group of layers, is quantized on its own and the error
+it causes is measured against the float model, along with the time quantizing it
+saves. The layers worth quantizing for a quality budget are then selected from
+the results:
+
+    >>> records = sensitivity_sweep(unet, lambda unet: unet(latents, t, embeds).sample)
+    >>> layers = select_layers(records, max_error=0.05)
+    >>> quantize_model(unet, calibrate_info=dict.fromkeys(layers, []))
+
+Two modes are supported:
+
+- "output": the model is run with the layers quantized and its outputs are
+  compared, which is exact but runs the whole model once per layer.
+- "layer": the inputs and outputs of the layers are cached in a run of the float
+  model, `max_cached_layers` layers at a time, and each quantized layer is
+  compared on them alone, which is much faster but ignores how errors propagate.
+
+The latency saving of every layer is measured on an input it was called with.
+Layers are quantized to int8 by onediff_quant, the quantization of the oneflow
+backend, unless another `quantize_fn` is given. A sweep can be sharded across
+processes with `shard_index` and `num_shards`, or across devices with
+`sharded_sensitivity_sweep`; the reports of the shards are merged by
+`load_sensitivity_report`. Reports are JSON files of
+`{name: {"mae", "ssim", "latency_saving", ...}}`. `quantize_pipe` of onediffx reads
+them as `quant_submodules_config_path` and quantizes with nexfort, sweep with
+`quantize_fn=nexfort_quantize_fn(quant_type)` of the same `quant_type` for it.
+"""
+import copy
+import dataclasses
+import functools
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torch.nn as nn
+from torch.utils._pytree import tree_flatten
+
+from onediff.torch_utils.module_operations import get_sub_module, modify_sub_module
+from onediff.utils import logger
+
+__all__ = [
+    "LayerSensitivity",
+    "load_sensitivity_report",
+    "nexfort_quantize_fn",
+    "pareto_front",
+    "save_sensitivity_report",
+    "select_layers",
+    "sensitivity_sweep",
+    "sharded_sensitivity_sweep",
+]
+
+_METRICS = ("mae", "ssim")
+
+
+@dataclasses.dataclass
+class LayerSensitivity:
+    layers: Tuple[str, ...]
+    # mean absolute error and SSIM of the outputs with the layers quantized
+    mae: float
+    ssim: float
+    # seconds per call of the float layers, and saved by quantizing them
+    float_latency: float = 0.0
+    latency_saving: float = 0.0
+
+    @property
+    def name(self) -> str:
+        return ",".join(self.layers)
+
+    def cost(self, metric: str = "mae") -> float:
+        if metric == "mae":
+            return self.mae
+        if metric == "ssim":
+            return 1.0 - self.ssim
+        raise ValueError(f"Unknown metric {metric}, expected one of {_METRICS}")
+
+
+def _tensors(output) -> List[torch.Tensor]:
+    leaves, _ = tree_flatten(output)
+    return [leaf for leaf in leaves if isinstance(leaf, torch.Tensor)]
+
+
+def _ssim(x: torch.Tensor, y: torch.Tensor) -> float:
+    """SSIM of two tensors computed over all their elements."""
+    x, y = x.double().flatten(), y.double().flatten()
+    data_range = max((x.max() - x.min()).item(), 1e-6)
+    c1, c2 = (0.01 * data_range) ** 2, (0.03 * data_range) ** 2
+    mu_x, mu_y = x.mean(), y.mean()
+    var_x, var_y = x.var(unbiased=False), y.var(unbiased=False)
+    cov = ((x - mu_x) * (y - mu_y)).mean()
+    ssim = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / (
+        (mu_x**2 + mu_y**2 + c1) * (var_x + var_y + c2)
+    )
+    return ssim.item()
+
+
+def _errors(reference, output) -> Tuple[float, float]:
+    """Mean absolute error and SSIM of `output` to `reference`, averaged over
+    their tensors.
+    """
+    references, outputs = _tensors(reference), _tensors(output)
+    if len(references) != len(outputs) or not references:
+        raise RuntimeError(
+            f"Expected {len(references)} output tensors, got {len(outputs)}"
+        )
+    maes, ssims = [], []
+    for ref, out in zip(references, outputs):
+        out = out.to(ref.device)
+        maes.append((ref.double() - out.double()).abs().mean().item())
+        ssims.append(_ssim(ref, out))
+    return sum(maes) / len(maes), sum(ssims) / len(ssims)
+
+
+def _synchronize(device: torch.device) -> None:
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def _time_layer(module: nn.Module, x: torch.Tensor, warmup: int, iters: int) -> float:
+    for _ in range(warmup):
+        module(x)
+    _synchronize(x.device)
+    start = time.perf_counter()
+    for _ in range(iters):
+        module(x)
+    _synchronize(x.device)
+    return (time.perf_counter() - start) / iters
+
+
+def _quantize_layer(name: str, module: nn.Module, bits: int = 8) -> nn.Module:
+    """Returns a copy of `module` quantized by onediff_quant, leaving it untouched."""
+    from onediff_quant import Quantizer
+    from onediff_quant.utils import get_quantize_module, symm_quantize
+
+    quantizer = Quantizer()
+    quantizer.configure(bits=bits, perchannel=True)
+    quantizer.find_params(module.weight.detach().float(), weight=True)
+    shape = [-1] + [1] * (len(module.weight.shape) - 1)
+    scale = quantizer.scale.reshape(*shape)
+
+    layer = copy.deepcopy(module)
+    layer.weight.requires_grad = False
+    layer.weight.data = symm_quantize(
+        layer.weight.data, scale.to(layer.weight.device), quantizer.maxq
+    )
+    # [input_scale, input_zero_point, weight_scale], the inputs are quantized dynamically
+    return get_quantize_module(
+        layer, name, [0, 0, scale.reshape(-1).tolist()], False, False, bits
+    )
+
+
+def nexfort_quantize_fn(
+    quant_type: str, **kwargs
+) -> Callable[[str, nn.Module], nn.Module]:
+    """A `quantize_fn` of `sensitivity_sweep` quantizing layers with nexfort.ao, as
+    `quantize_pipe` of onediffx does with the same `quant_type` and `kwargs`.
+    """
+
+    def quantize_fn(name: str, module: nn.Module) -> nn.Module:
+        from nexfort.ao import quantize
+
+        # Submodules are quantized, not the module itself
+        container = quantize(
+            nn.Sequential(copy.deepcopy(module)), quant_type=quant_type, **kwargs
+        )
+        return container[0]
+
+    return quantize_fn
+
+
+class _ActivationCache:
+    """Inputs, and outputs if `with_outputs`, of the first call of every layer of
+    `layers` by name.
+    """
+
+    def __init__(self, layers: Dict[str, nn.Module], device, with_outputs: bool):
+        self.inputs: Dict[str, torch.Tensor] = {}
+        self.outputs: Dict[str, torch.Tensor] = {}
+        self._device = device
+        self._with_outputs = with_outputs
+        self._handles = [
+            layer.register_forward_hook(self._hook(name))
+            for name, layer in layers.items()
+        ]
+
+    def _hook(self, name):
+        def hook(module, args, output):
+            if name not in self.inputs:
+                self.inputs[name] = args[0].detach().to(self._device)
+                if self._with_outputs:
+                    self.outputs[name] = output.detach().to(self._device)
+
+        return hook
+
+    def check(self, names: Sequence[str]) -> None:
+        missing = [name for name in names if name not in self.inputs]
+        if missing:
+            raise RuntimeError(f"Layers {missing} are not called by run_fn")
+
+    def remove(self) -> None:
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+
+def _find_layers(model: nn.Module, module_cls) -> List[str]:
+    from onediff_quant.utils import find_quantizable_modules
+
+    return list(find_quantizable_modules(model, module_cls=list(module_cls)).keys())
+
+
+def _chunks(groups: Sequence[Tuple[str, ...]], max_layers: int):
+    """Splits `groups` into consecutive chunks of at most `max_layers` layers, or of
+    a single group if it's larger.
+    """
+    chunk, size = [], 0
+    for group in groups:
+        if chunk and size + len(group) > max_layers:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(group)
+        size += len(group)
+    if chunk:
+        yield chunk
+
+
+@torch.no_grad()
+def sensitivity_sweep(
+    model: nn.Module,
+    run_fn: Callable[[nn.Module], Any],
+    *,
+    layers: Optional[Sequence[str]] = None,
+    groups: Optional[Sequence[Sequence[str]]] = None,
+    mode: str = "output",
+    bits: int = 8,
+    quantize_fn: Optional[Callable[[str, nn.Module], nn.Module]] = None,
+    module_cls=(nn.Conv2d, nn.Linear),
+    measure_latency: bool = True,
+    warmup: int = 2,
+    iters: int = 10,
+    activation_device="cpu",
+    max_cached_layers: int = 64,
+    shard_index: int = 0,
+    num_shards: int = 1,
+    output_path: Optional[str] = None,
+) -> List[LayerSensitivity]:
+    """Measures the error and latency saving of quantizing each layer of `model`.
+
+    Args:
+        run_fn: runs `model` and returns its outputs, tensors or nested containers
+            of tensors. It may run the model several times, like a pipeline does,
+            the activations of the first call of every layer are used.
+        layers: names of the layers to sweep, all quantizable layers of
+            `module_cls` by default.
+        groups: groups of layers quantized together, every layer on its own by
+            default. In "layer" mode the error of a group is that of its worst layer.
+        mode: "output" or "layer", see the module docstring.
+        bits: bits of the default quantization by onediff_quant.
+        quantize_fn: returns a quantized copy of a layer from its name and the
+            layer, e.g. `nexfort_quantize_fn(quant_type)`.
+        activation_device: where the cached activations are kept, they are moved
+            to the device of each layer when used.
+        max_cached_layers: in "layer" mode, the activations of at most this many
+            layers are cached at once, the model is run once per such chunk.
+        shard_index, num_shards: sweep every `num_shards`-th group only, starting
+            from `shard_index`, to split a sweep across processes.
+        output_path: save the report of the sweep there.
+    """
+    if mode not in ("output", "layer"):
+        raise ValueError(f"Unknown mode {mode}, expected 'output' or 'layer'")
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"Invalid shard {shard_index} of {num_shards}")
+    if quantize_fn is None:
+        quantize_fn = functools.partial(_quantize_layer, bits=bits)
+    if groups is None:
+        if layers is None:
+            layers = _find_layers(model, module_cls)
+        groups = [(name,) for name in layers]
+    groups = [tuple(group) for group in groups][shard_index::num_shards]
+
+    if mode == "output":
+        reference = run_fn(model)
+        chunks = [groups]
+    else:
+        chunks = _chunks(groups, max_cached_layers)
+
+    records = []
+    start_time = time.time()
+    for chunk in chunks:
+        cache = None
+        if mode == "layer":
+            names = [name for group in chunk for name in group]
+            cache = _ActivationCache(
+                {name: get_sub_module(model, name) for name in names},
+                activation_device,
+                with_outputs=True,
+            )
+            try:
+                run_fn(model)
+            finally:
+                cache.remove()
+            cache.check(names)
+
+        for group in chunk:
+            float_layers = {name: get_sub_module(model, name) for name in group}
+            quant_layers = {
+                name: quantize_fn(name, layer) for name, layer in float_layers.items()
+            }
+
+            if mode == "output":
+                for name, layer in quant_layers.items():
+                    modify_sub_module(model, name, layer)
+                # The inputs of the layers for the latency, of the same shapes as the
+                # float ones
+                if measure_latency:
+                    cache = _ActivationCache(
+                        quant_layers, activation_device, with_outputs=False
+                    )
+                try:
+                    mae, ssim = _errors(reference, run_fn(model))
+                finally:
+                    if measure_latency:
+                        cache.remove()
+                    for name, layer in float_layers.items():
+                        modify_sub_module(model, name, layer)
+                if measure_latency:
+                    cache.check(group)
+            else:
+                errors = []
+                for name, layer in quant_layers.items():
+                    device = float_layers[name].weight.device
+                    x = cache.inputs[name].to(device)
+                    errors.append(_errors(cache.outputs[name], layer(x)))
+                mae = max(e[0] for e in errors)
+                ssim = min(e[1] for e in errors)
+
+            float_latency = latency_saving = 0.0
+            if measure_latency:
+                for name, layer in float_layers.items():
+                    x = cache.inputs[name].to(layer.weight.device)
+                    latency = _time_layer(layer, x, warmup, iters)
+                    float_latency += latency
+                    latency_saving += latency - _time_layer(
+                        quant_layers[name], x, warmup, iters
+                    )
+
+            record = LayerSensitivity(group, mae, ssim, float_latency, latency_saving)
+            records.append(record)
+            remaining_time = (
+                (time.time() - start_time) / len(records) * (len(groups) - len(records))
+            )
+            logger.info(
+                f"Sensitivity {len(records)}/{len(groups)} {record.name}: mae {mae:.6f}, "
+                f"ssim {ssim:.6f}, latency saving {latency_saving * 1000:.4f}ms, "
+                f"estimated remaining time {remaining_time / 60:.2f} minutes"
+            )
+
+    if output_path is not None:
+        save_sensitivity_report(records, output_path)
+    return records
+
+
+def _sweep_worker(rank, model_fn, run_fn, devices, output_paths, kwargs):
+    device = torch.device(devices[rank])
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
+    model = model_fn(device)
+    sensitivity_sweep(
+        model,
+        run_fn,
+        shard_index=rank,
+        num_shards=len(devices),
+        output_path=output_paths[rank],
+        **kwargs,
+    )
+
+
+def sharded_sensitivity_sweep(
+    model_fn: Callable[[torch.device], nn.Module],
+    run_fn: Callable[[nn.Module], Any],
+    devices: Sequence[str],
+    output_dir: str,
+    **kwargs,
+) -> List[LayerSensitivity]:
+    """Runs `sensitivity_sweep` in one process per device, each sweeping a shard of
+    the groups of layers, and returns the merged records.
+
+    `model_fn` builds the model on a device, it and `run_fn` must be picklable, e.g.
+    functions of a module. The report of each shard is saved in `output_dir`.
+    """
+    import torch.multiprocessing as mp
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = [
+        os.path.join(output_dir, f"sensitivity_{rank}_of_{len(devices)}.json")
+        for rank in range(len(devices))
+    ]
+    mp.spawn(
+        _sweep_worker,
+        args=(model_fn, run_fn, list(devices), output_paths, kwargs),
+        nprocs=len(devices),
+    )
+    return load_sensitivity_report(*output_paths)
+
+
+def save_sensitivity_report(
+    records: Sequence[LayerSensitivity],
+    path: str,
+    layers: Optional[Sequence[str]] = None,
+) -> None:
+    """Saves `records` by layer name, those of `layers` only if given. The records
+    of a group are saved under each of its layers.
+    """
+    layers = None if layers is None else set(layers)
+    report = {}
+    for record in records:
+        for name in record.layers:
+            if layers is not None and name not in layers:
+                continue
+            report[name] = dataclasses.asdict(record)
+            report[name]["layers"] = list(record.layers)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4)
+
+
+def load_sensitivity_report(*paths: str) -> List[LayerSensitivity]:
+    """Loads and merges the reports of `paths`, e.g. the shards of a sweep."""
+    records = {}
+    for path in paths:
+        with open(path, "r") as f:
+            report = json.load(f)
+        for name, details in report.items():
+            group = tuple(details.get("layers", [name]))
+            records[group] = LayerSensitivity(
+                layers=group,
+                mae=details["mae"],
+                ssim=details["ssim"],
+                float_latency=details.get("float_latency", 0.0),
+                latency_saving=details.get("latency_saving", 0.0),
+            )
+    return list(records.values())
+
+
+def pareto_front(
+    records: Sequence[LayerSensitivity], metric: str = "mae"
+) -> List[LayerSensitivity]:
+    """Returns the records no other record beats on both error and latency saving,
+    by increasing error.
+    """
+    front, best_saving = [], float("-inf")
+    for record in sorted(records, key=lambda r: (r.cost(metric), -r.latency_saving)):
+        if record.latency_saving > best_saving:
+            front.append(record)
+            best_saving = record.latency_saving
+    return front
+
+
+def select_layers(
+    records: Sequence[LayerSensitivity], max_error: float, metric: str = "mae"
+) -> List[str]:
+    """Selects the layers to quantize for the most latency saving within `max_error`.
+
+    The errors of the groups are assumed to add up, `metric` being "mae" or "ssim"
+    (whose error is 1 - ssim). The groups are taken greedily by latency saving per
+    error, so the selection is on the Pareto front of the combinations of groups up
+    to the granularity of a group. Without latency measurements, the most groups
+    that fit in the budget are selected.
+    """
+    has_latency = any(r.latency_saving > 0 for r in records)
+
+    def efficiency(record):
+        saving = record.latency_saving if has_latency else 1.0
+        cost = max(record.cost(metric), 0.0)
+        return float("inf") if cost == 0 else saving / cost
+
+    candidates = [r for r in records if not has_latency or r.latency_saving > 0]
+    candidates.sort(key=lambda r: (-efficiency(r), r.cost(metric)))
+    selected, total_error = [], 0.0
+    for record in candidates:
+        error = max(record.cost(metric), 0.0)
+        if total_error + error > max_error:
+            continue
+        total_error += error
+        selected.extend(record.layers)
+    logger.info(
+        f"Selected {len(selected)} layers to quantize, estimated {metric} error {total_error:.6f}"
+    )
+    return selected
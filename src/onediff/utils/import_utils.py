@@ -1,47 +1,39 @@
 import importlib
 import os
 import platform
-import traceback
+from functools import lru_cache
+from importlib.util import find_spec
 from inspect import ismodule
 from types import ModuleType
 
 system = platform.system()
 
 
+@lru_cache(maxsize=None)
 def check_module_availability(module_name):
-    spec = importlib.util.find_spec(module_name)
-
-    if spec:
-        try:
-            importlib.import_module(module_name)
-        except ImportError as e:
-            print(traceback.format_exc())
-            return False
-    else:
+    """Whether `module_name` can be found, without importing it.
+
+    Importing oneflow, nexfort or onediff_quant takes seconds, so they are only
+    imported by the backends that use them.
+    """
+    try:
+        return find_spec(module_name) is not None
+    except (ImportError, ValueError):
         return False
 
-    return True
-
-
-_oneflow_available = check_module_availability("oneflow")
-_onediff_quant_available = check_module_availability("onediff_quant")
-_nexfort_available = check_module_availability("nexfort")
-
-if system != "Linux":
-    print(f"Warning: OneFlow is only supported on Linux. Current system: {system}")
-    _oneflow_available = False
-
 
 def is_oneflow_available():
-    return _oneflow_available
+    if system != "Linux":
+        return False
+    return check_module_availability("oneflow")
 
 
 def is_onediff_quant_available():
-    return _onediff_quant_available
+    return check_module_availability("onediff_quant")
 
 
 def is_nexfort_available():
-    return _nexfort_available
+    return check_module_availability("nexfort")
 
 
 class DynamicModuleLoader(ModuleType):
@@ -0,0 +1,67 @@
+import copy
+import os
+import tempfile
+import unittest
+
+import torch
+import oneflow as flow  # usort: skip
+
+from onediff.infer_compiler.backends.oneflow.transform import torch2oflow, transform_mgr
+
+
+class PyTorchBlock(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(4, 4)
+        self.scale = 2.0
+
+    def forward(self, x):
+        return self.linear(x) * self.scale
+
+
+class PyTorchModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.blocks = torch.nn.ModuleList([PyTorchBlock(), PyTorchBlock()])
+
+    def forward(self, x):
+        for block in self.blocks:
+            x = block(x)
+        return x
+
+
+class TestClassProxyCache(unittest.TestCase):
+    def test_converted_modules_share_class(self):
+        model = PyTorchModel()
+        of_model = torch2oflow(model)
+        of_model_again = torch2oflow(PyTorchModel())
+        self.assertIs(type(of_model), type(of_model_again))
+        self.assertIs(type(of_model.blocks[0]), type(of_model.blocks[1]))
+        # Attributes of different instances are kept apart
+        model.blocks[1].scale = 3.0
+        self.assertEqual(torch2oflow(model).blocks[1].scale, 3.0)
+        self.assertEqual(of_model_again.blocks[1].scale, 2.0)
+
+        x = torch.randn(2, 4)
+        y_pt = model(x)
+        y_of = torch2oflow(model)(flow.utils.tensor.from_torch(x))
+        self.assertTrue(
+            torch.allclose(y_pt, flow.utils.tensor.to_torch(y_of), atol=1e-4)
+        )
+
+    def test_deepcopy_converted_module(self):
+        of_model = torch2oflow(PyTorchModel())
+        copied = copy.deepcopy(of_model)
+        self.assertIs(type(copied), type(of_model))
+        self.assertEqual(copied.blocks[0].scale, 2.0)
+
+    def test_class_proxy_table(self):
+        torch2oflow(PyTorchModel())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "class_proxies.json")
+            transform_mgr.save_class_proxy_table(file_path)
+            self.assertGreater(transform_mgr.load_class_proxy_table(file_path), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
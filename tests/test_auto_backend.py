@@ -0,0 +1,166 @@
+import gc
+import unittest
+
+import torch
+
+from onediff.infer_compiler import AutoCompileOptions, compile, get_backend_report
+from onediff.infer_compiler.backends.registry import (
+    BackendCapabilities,
+    get_backend_capabilities,
+    register_backend,
+)
+from onediff.utils.import_utils import is_oneflow_available
+
+
+class SimpleModule(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(4, 4)
+
+    def forward(self, x):
+        return self.linear(x)
+
+
+class UnsupportedModule(SimpleModule):
+    pass
+
+
+_failing_runs = []
+
+
+@register_backend(
+    "test_failing",
+    capabilities=BackendCapabilities(device_types=("cpu",), priority=1),
+)
+def _failing_backend(torch_module, *, options=None):
+    def run(*args, **kwargs):
+        _failing_runs.append(None)
+        raise NotImplementedError("unsupported op")
+
+    return run
+
+
+@register_backend(
+    "test_working",
+    capabilities=BackendCapabilities(
+        graph_save_load=True,
+        device_types=("cpu",),
+        excluded_module_types=("UnsupportedModule",),
+        priority=2,
+    ),
+)
+def _working_backend(torch_module, *, options=None):
+    def run(*args, **kwargs):
+        return torch_module(*args, **kwargs) * (options or 1)
+
+    return run
+
+
+@register_backend(
+    "test_failing_after_compile",
+    capabilities=BackendCapabilities(device_types=("cpu",), priority=1),
+)
+def _failing_after_compile_backend(torch_module, *, options=None):
+    # Patches the module, then fails on the first call
+    compile(torch_module, backend="oneflow")
+
+    def run(*args, **kwargs):
+        raise NotImplementedError("unsupported op")
+
+    return run
+
+
+class TestAutoBackend(unittest.TestCase):
+    def setUp(self) -> None:
+        self.x = torch.randn(2, 4)
+
+    def test_capabilities(self):
+        capabilities = get_backend_capabilities("test_working")
+        self.assertTrue(capabilities.provides(("graph_save_load",)))
+        self.assertFalse(capabilities.provides(("graph_save_load", "quantization")))
+        self.assertTrue(capabilities.supports(SimpleModule())[0])
+        self.assertFalse(capabilities.supports(UnsupportedModule())[0])
+
+    @torch.inference_mode()
+    def test_fall_back_to_next_backend(self):
+        model = SimpleModule()
+        options = AutoCompileOptions(
+            backends=["test_failing", "test_working"],
+            backend_options={"test_working": 2},
+        )
+        compiled_model = compile(model, backend="auto", options=options)
+        self.assertIsInstance(compiled_model, SimpleModule)
+        self.assertTrue(torch.allclose(compiled_model(self.x), model(self.x) * 2))
+
+        selection = compiled_model.get_backend_selection()
+        self.assertEqual(selection.backend, "test_working")
+        self.assertIn("unsupported op", selection.errors["test_failing"])
+        self.assertIn(selection, get_backend_report())
+
+    @torch.inference_mode()
+    def test_fall_back_to_eager(self):
+        model = UnsupportedModule()
+        options = AutoCompileOptions(
+            backends=["test_failing", "test_working"], measure_speedup=True
+        )
+        compiled_model = compile(model, backend="auto", options=options)
+        self.assertTrue(torch.allclose(compiled_model(self.x), model(self.x)))
+        selection = compiled_model.get_backend_selection()
+        self.assertEqual(selection.backend, "eager")
+        self.assertTrue(selection.errors["test_working"].startswith("skipped"))
+        compiled_model(self.x)
+        self.assertIsNone(selection.speedup)
+
+        options.fallback_to_eager = False
+        compiled_model = compile(model, backend="auto", options=options)
+        _failing_runs.clear()
+        with self.assertRaises(RuntimeError):
+            compiled_model(self.x)
+        # The failure is cached, the backends aren't tried again
+        with self.assertRaises(RuntimeError):
+            compiled_model(self.x)
+        self.assertEqual(len(_failing_runs), 1)
+
+    def test_report_drops_deleted_modules(self):
+        options = AutoCompileOptions(backends=["test_working"])
+        compiled_model = compile(SimpleModule(), backend="auto", options=options)
+        num_selections = len(get_backend_report())
+        del compiled_model
+        gc.collect()
+        self.assertEqual(len(get_backend_report()), num_selections - 1)
+
+    @unittest.skipUnless(is_oneflow_available(), "oneflow is not available")
+    @torch.inference_mode()
+    def test_failed_backend_leaves_module_unpatched(self):
+        from onediff.infer_compiler.backends.oneflow.param_utils import (
+            STATE_UPDATED_ATTR,
+        )
+
+        model = SimpleModule()
+        options = AutoCompileOptions(
+            backends=["test_failing_after_compile", "test_working"]
+        )
+        compiled_model = compile(model, backend="auto", options=options)
+        self.assertTrue(torch.allclose(compiled_model(self.x), model(self.x)))
+        self.assertEqual(compiled_model.get_backend_selection().backend, "test_working")
+        self.assertFalse(hasattr(model, STATE_UPDATED_ATTR))
+        self.assertEqual(len(model._load_state_dict_post_hooks), 0)
+
+    @torch.inference_mode()
+    def test_required_capabilities(self):
+        options = AutoCompileOptions(
+            backends=["test_failing", "test_working"],
+            required_capabilities=("graph_save_load",),
+            measure_speedup=True,
+        )
+        compiled_model = compile(SimpleModule(), backend="auto", options=options)
+        compiled_model(self.x)
+        selection = compiled_model.get_backend_selection()
+        self.assertEqual(selection.backend, "test_working")
+        self.assertTrue(selection.errors["test_failing"].startswith("skipped"))
+        compiled_model(self.x)
+        self.assertIsNotNone(selection.speedup)
+
+
+if __name__ == "__main__":
+    unittest.main()
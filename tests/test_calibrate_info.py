@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+import torch
+
+from onediff.quantization.calibrate_info import (
+    CalibrateInfo,
+    convert_calibrate_info,
+    find_calibrate_info,
+    load_calibrate_info,
+    save_calibrate_info,
+)
+
+# float32 representable, the weight scales are float32 in safetensors
+CALIBRATE_INFO = {
+    "down_blocks.0.attentions.0.proj_in": [0.5, 0, [0.25, 0.125, 1.5]],
+    "mid_block.resnets.0.conv1": [0.0, 0, [2.0, 0.75]],
+}
+
+
+class TestCalibrateInfo(unittest.TestCase):
+    def test_text_and_safetensors_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            text_path = os.path.join(tmp_dir, "calibrate_info.txt")
+            save_calibrate_info(CALIBRATE_INFO, text_path)
+            self.assertEqual(find_calibrate_info(tmp_dir), text_path)
+            self.assertEqual(load_calibrate_info(text_path), CALIBRATE_INFO)
+
+            safetensors_path = os.path.join(tmp_dir, "calibrate_info.safetensors")
+            convert_calibrate_info(text_path, safetensors_path)
+            # preferred over the text file
+            self.assertEqual(find_calibrate_info(tmp_dir), safetensors_path)
+            calibrate_info = load_calibrate_info(safetensors_path)
+            self.assertIsInstance(calibrate_info, CalibrateInfo)
+            self.assertEqual(dict(calibrate_info), CALIBRATE_INFO)
+
+            os.remove(text_path)
+            convert_calibrate_info(safetensors_path, text_path)
+            self.assertEqual(load_calibrate_info(text_path), CALIBRATE_INFO)
+
+    def test_lookup_by_name(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "calibrate_info.safetensors")
+            save_calibrate_info({"conv": [0, 0, torch.tensor([[0.5], [0.25]])]}, path)
+            calibrate_info = load_calibrate_info(path)
+            self.assertIn("conv", calibrate_info)
+            self.assertNotIn("linear", calibrate_info)
+            self.assertEqual(calibrate_info["conv"], [0.0, 0, [0.5, 0.25]])
+            self.assertEqual(
+                calibrate_info.get_weight_scale("conv").dtype, torch.float32
+            )
+            with self.assertRaises(KeyError):
+                calibrate_info["linear"]
+
+    def test_find_calibrate_info_without_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.assertIsNone(find_calibrate_info(tmp_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
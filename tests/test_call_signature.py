@@ -0,0 +1,91 @@
+import collections
+import dataclasses
+import unittest
+
+import torch
+
+from onediff.infer_compiler.backends.oneflow.call_signature import (
+    CallSignatureCache,
+    flatten,
+    unflatten,
+)
+from onediff.infer_compiler.backends.oneflow.utils.hash_utils import (
+    generate_input_structure_key,
+)
+from oneflow.framework.args_tree import ArgsTree
+
+
+@dataclasses.dataclass
+class Output:
+    sample: torch.Tensor
+    extra: object = None
+
+
+Pair = collections.namedtuple("Pair", ["first", "second"])
+
+
+def make_inputs(batch_size=2):
+    args = (torch.randn(batch_size, 4, 8, 8), 981, [torch.randn(2, 77, 16), None])
+    kwargs = {
+        "added_cond_kwargs": {"text_embeds": torch.randn(batch_size, 16)},
+        "output": Output(torch.randn(1)),
+        "pair": Pair(torch.randn(1), "x"),
+    }
+    return args, kwargs
+
+
+class TestCallSignature(unittest.TestCase):
+    def test_flatten_and_unflatten(self):
+        value = make_inputs()
+        leaves = []
+        spec = flatten(value, leaves)
+        self.assertEqual(len(leaves), 9)
+        rebuilt = unflatten(spec, leaves)
+        self.assertEqual(type(rebuilt[1]["output"]), Output)
+        self.assertEqual(type(rebuilt[1]["pair"]), Pair)
+        self.assertIs(rebuilt[0][0], value[0][0])
+        self.assertIs(rebuilt[1]["added_cond_kwargs"]["text_embeds"], leaves[4])
+
+    def test_plan_is_reused(self):
+        cache = CallSignatureCache(torch.Tensor)
+        leaves, plan = cache.flatten(make_inputs(2))
+        self.assertEqual(len(plan.tensor_indices), 5)
+        # shapes don't change the spec
+        _, other_plan = cache.flatten(make_inputs(4))
+        self.assertIs(other_plan, plan)
+        args, kwargs = make_inputs()
+        kwargs["new_arg"] = 1
+        _, new_plan = cache.flatten((args, kwargs))
+        self.assertIsNot(new_plan, plan)
+        _, other_plan = cache.flatten(make_inputs(2))
+        self.assertIs(other_plan, plan)
+
+    def test_structure_key_matches_args_tree(self):
+        value = make_inputs()
+        _, plan = CallSignatureCache(torch.Tensor).flatten(value)
+        args_tree = ArgsTree(value, False, tensor_type=torch.Tensor)
+        self.assertEqual(plan.structure_key, generate_input_structure_key(args_tree))
+
+    def test_map_tensors(self):
+        leaves, plan = CallSignatureCache(torch.Tensor).flatten(make_inputs())
+        args, kwargs = plan.unflatten(plan.map_tensors(leaves, lambda t: t.shape))
+        self.assertEqual(args[0], torch.Size([2, 4, 8, 8]))
+        self.assertEqual(args[1], 981)
+        self.assertEqual(kwargs["pair"].second, "x")
+
+    def test_tensor_paths(self):
+        _, plan = CallSignatureCache(torch.Tensor).flatten(make_inputs())
+        self.assertEqual(
+            plan.tensor_paths,
+            [
+                "args[0]",
+                "args[2][0]",
+                "added_cond_kwargs['text_embeds']",
+                "output.sample",
+                "pair[0]",
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
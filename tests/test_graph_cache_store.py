@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+
+from onediff.infer_compiler.backends.oneflow.graph_cache_store import (
+    get_graph_cache_store,
+    GraphCacheStore,
+)
+
+
+def _writer(content: bytes):
+    def save(path):
+        with open(path, "wb") as f:
+            f.write(content)
+
+    return save
+
+
+class TestGraphCacheStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp_dir.name
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_put_and_lookup(self):
+        store = GraphCacheStore(self.cache_dir)
+        self.assertIsNone(store.lookup("ab01"))
+        path = store.put("ab01", _writer(b"graph"))
+        self.assertEqual(store.lookup("ab01"), path)
+        # the index is shared by stores of the same directory
+        self.assertEqual(GraphCacheStore(self.cache_dir).lookup("ab01"), path)
+        # no temporary files left, the pin file stays with the graph file
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(path))), ["ab01.graph", "ab01.graph.pin"]
+        )
+
+    def test_corrupted_file_is_removed(self):
+        store = GraphCacheStore(self.cache_dir)
+        path = store.put("cd02", _writer(b"graph"))
+        with open(path, "wb") as f:
+            f.write(b"broken")
+        self.assertIsNone(store.lookup("cd02"))
+        self.assertFalse(os.path.exists(path))
+
+    def test_lru_eviction(self):
+        store = GraphCacheStore(self.cache_dir, max_size=10)
+        store.put("aa", _writer(b"1234"))
+        store.put("bb", _writer(b"1234"))
+        store.lookup("aa")
+        store.put("cc", _writer(b"1234"))
+        self.assertIsNotNone(store.lookup("aa"))
+        self.assertIsNone(store.lookup("bb"))
+        self.assertIsNotNone(store.lookup("cc"))
+        self.assertEqual(store.total_size(), 8)
+
+    def test_pinned_file_is_not_evicted(self):
+        store = GraphCacheStore(self.cache_dir, max_size=10)
+        store.put("aa", _writer(b"1234"))
+        store.put("bb", _writer(b"1234"))
+        with store.pin("aa") as path:
+            store.put("cc", _writer(b"1234"))
+            self.assertTrue(os.path.exists(path))
+            # another process saving the same graph keeps the pinned file
+            self.assertEqual(store.put("aa", _writer(b"5678")), path)
+        self.assertIsNotNone(store.lookup("aa"))
+        self.assertIsNone(store.lookup("bb"))
+
+    def test_checksum_is_verified_on_demand(self):
+        store = GraphCacheStore(self.cache_dir, verify_checksum=True)
+        path = store.put("ff", _writer(b"graph"))
+        stat = os.stat(path)
+        with open(path, "wb") as f:
+            f.write(b"grapx")
+        # same size and mtime, only the checksum tells
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIsNone(store.lookup("ff"))
+        self.assertFalse(os.path.exists(path))
+
+    def test_checksum_is_verified_once(self):
+        store = get_graph_cache_store(self.cache_dir)
+        self.assertTrue(store.verify_checksum)
+        path = store.put("gg", _writer(b"graph"))
+        self.assertEqual(store.lookup("gg"), path)
+        stat = os.stat(path)
+        with open(path, "wb") as f:
+            f.write(b"grapx")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        # verified by the first lookup of this process already
+        self.assertEqual(store.lookup("gg"), path)
+        # but not by another process
+        self.assertIsNone(GraphCacheStore(self.cache_dir).lookup("gg"))
+
+        store = get_graph_cache_store(self.cache_dir, verify_checksum=False)
+        self.assertFalse(store.verify_checksum)
+
+    def test_failed_save_leaves_no_entry(self):
+        store = GraphCacheStore(self.cache_dir)
+
+        def save(path):
+            _writer(b"partial")(path)
+            raise RuntimeError("save failed")
+
+        with self.assertRaises(RuntimeError):
+            store.put("ee", save)
+        self.assertIsNone(store.lookup("ee"))
+        self.assertEqual(os.listdir(os.path.join(self.cache_dir, "ee")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+
+from collections import namedtuple
+
+from onediff.infer_compiler.backends.oneflow.graph_pool import (
+    generate_shape_bucket_key,
+    GraphPool,
+    InputSignature,
+    NearestResolution,
+    PadToMultiple,
+)
+
+FakeTensor = namedtuple("FakeTensor", ["shape", "dtype", "device"])
+FakeTensor.ndim = property(lambda self: len(self.shape))
+
+
+class TestShapeBucketing(unittest.TestCase):
+    def test_pad_to_multiple(self):
+        rule = PadToMultiple(16)
+        self.assertEqual(rule((2, 4, 96, 120)), (2, 4, 96, 128))
+        self.assertEqual(rule((2, 4, 97, 128)), (2, 4, 112, 128))
+        # low rank tensors don't take part in bucketing
+        self.assertIsNone(rule((2, 77, 768)))
+
+    def test_nearest_resolution(self):
+        rule = NearestResolution([(64, 64), (96, 96), (128, 128)])
+        self.assertEqual(rule((1, 4, 60, 70)), (1, 4, 64, 64))
+        self.assertEqual(rule((1, 4, 120, 128)), (1, 4, 128, 128))
+
+    def test_bucket_key(self):
+        shapes = [(2, 4, 64, 64), (2,), (2, 77, 768)]
+        self.assertEqual(generate_shape_bucket_key(shapes, None), "")
+        self.assertEqual(
+            generate_shape_bucket_key(shapes, PadToMultiple(64)), "2x4x64x64"
+        )
+
+
+class TestGraphPool(unittest.TestCase):
+    def test_lru_eviction(self):
+        pool = GraphPool(capacity=2)
+        pool.put("a", "graph_a")
+        pool.put("b", "graph_b")
+        self.assertEqual(pool.lookup("a"), "graph_a")
+        pool.put("c", "graph_c")
+        self.assertNotIn("b", pool)
+        self.assertIn("a", pool)
+        self.assertIn("c", pool)
+
+    def test_pinned_entry_is_not_evicted(self):
+        pool = GraphPool(capacity=2)
+        pool.put("a", "graph_a")
+        pool.pin("a")
+        pool.put("b", "graph_b")
+        pool.put("c", "graph_c")
+        self.assertIn("a", pool)
+        self.assertNotIn("b", pool)
+
+    def test_auto_pin_and_stats(self):
+        pool = GraphPool(capacity=1, pin_after_hits=2)
+        self.assertIsNone(pool.lookup("a"))
+        pool.put("a", "graph_a", build_time=1.5)
+        pool.lookup("a")
+        pool.lookup("a")
+        stats = pool.stats()["a"]
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["build_time"], 1.5)
+        self.assertTrue(stats["pinned"])
+
+
+class TestInputSignature(unittest.TestCase):
+    def test_default_signature_is_structure_key(self):
+        signature = InputSignature()
+        tensors = [FakeTensor((2, 4, 64, 64), "torch.float16", "cuda:0")]
+        self.assertEqual(signature.key(signature.signature("abc", tensors)), "abc")
+
+    def test_bucket_key_matches_graph_pool_key(self):
+        signature = InputSignature(shape_bucketing=PadToMultiple(64))
+        tensors = [
+            FakeTensor((2, 4, 60, 64), "torch.float16", "cuda:0"),
+            FakeTensor((2, 77, 768), "torch.float16", "cuda:0"),
+        ]
+        key = signature.key(signature.signature("abc", tensors))
+        self.assertEqual(key, "abc_2x4x64x64")
+
+    def test_fields_and_miss_reason(self):
+        signature = InputSignature(("dtype", "rank"))
+        fp16 = [
+            FakeTensor((2, 4, 64, 64), "torch.float16", "cuda:0"),
+            FakeTensor((2,), "torch.int64", "cuda:0"),
+        ]
+        fp32 = [fp16[0]._replace(dtype="oneflow.float32"), fp16[1]]
+        fp16_key = signature.key(signature.signature("abc", fp16))
+        fp32_signature = signature.signature("abc", fp32)
+        self.assertNotEqual(signature.key(fp32_signature), fp16_key)
+        self.assertTrue(fp16_key.startswith("abc_"))
+        # the dtype of torch and oneflow tensors have the same name
+        oneflow_fp16 = [fp16[0]._replace(dtype="oneflow.float16"), fp16[1]]
+        self.assertEqual(
+            signature.key(signature.signature("abc", oneflow_fp16)), fp16_key
+        )
+        reason = signature.explain_miss(
+            fp32_signature, [fp16_key], ["sample", "timestep"]
+        )
+        self.assertEqual(reason, "sample: dtype float16 -> float32")
+        self.assertEqual(
+            signature.explain_miss(signature.signature("xyz", fp16), [fp16_key]),
+            "new input structure xyz",
+        )
+
+    def test_miss_reason_in_stats(self):
+        pool = GraphPool()
+        pool.lookup("a")
+        pool.set_miss_reason("a", "new input structure a")
+        pool.put("a", "graph_a")
+        self.assertEqual(pool.stats()["a"]["miss_reason"], "new input structure a")
+
+    def test_pending_misses_are_bounded(self):
+        pool = GraphPool(max_pending=2)
+        for key in ["a", "b", "c"]:
+            pool.lookup(key)
+            pool.set_miss_reason(key, f"new input structure {key}")
+        self.assertEqual(sorted(pool.stats()), ["b", "c"])
+        pool.put("a", "graph_a")
+        self.assertIsNone(pool.stats()["a"]["miss_reason"])
+
+
+class TestInputSignatureCache(unittest.TestCase):
+    def test_keys_are_bounded(self):
+        signature = InputSignature(("rank",), max_size=2)
+        keys = [
+            signature.key(signature.signature(name, [FakeTensor((2,), "", "")]))
+            for name in ["a", "b", "c"]
+        ]
+        self.assertEqual(len(signature._keys), 2)
+        self.assertEqual(len(signature._signatures), 2)
+        # formatted again once evicted
+        self.assertEqual(
+            signature.key(signature.signature("a", [FakeTensor((2,), "", "")])),
+            keys[0],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import subprocess
+import sys
+import unittest
+
+# Self time of the onediff modules imported by `import onediff.infer_compiler`,
+# torch and other dependencies excluded
+ONEDIFF_IMPORT_TIME_BUDGET_US = 300_000
+
+# Imported by the backends on the first compile() only
+LAZY_MODULES = ("oneflow", "nexfort", "onediff_quant", "pydantic")
+
+
+def _import_times(statement):
+    """Returns {module: (self time, cumulative time)} in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, module = line[len("import time:") :].split("|")
+        times[module.strip()] = (int(self_time), int(cumulative))
+    return times
+
+
+class TestImportTime(unittest.TestCase):
+    def test_backends_are_imported_lazily(self):
+        times = _import_times(
+            "import onediff.infer_compiler; "
+            "from onediff.utils.import_utils import is_oneflow_available, is_nexfort_available, is_onediff_quant_available; "
+            "is_oneflow_available(); is_nexfort_available(); is_onediff_quant_available()"
+        )
+        for module in times:
+            self.assertNotIn(
+                module.split(".")[0], LAZY_MODULES, f"{module} is imported eagerly"
+            )
+
+    def test_onediff_import_time(self):
+        times = _import_times("import onediff.infer_compiler")
+        onediff_time = sum(
+            self_time
+            for module, (self_time, _) in times.items()
+            if module.split(".")[0] == "onediff"
+        )
+        self.assertLess(
+            onediff_time,
+            ONEDIFF_IMPORT_TIME_BUDGET_US,
+            f"onediff modules took {onediff_time / 1000:.1f}ms to import",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from onediff.infer_compiler.backends.nexfort import cache
+
+from torch._inductor import config as inductor_config
+
+ENV_VARS = (
+    "NEXFORT_GRAPH_CACHE",
+    "TORCHINDUCTOR_FX_GRAPH_CACHE",
+    "TORCHINDUCTOR_CACHE_DIR",
+    "TRITON_CACHE_DIR",
+)
+INDUCTOR_CONFIGS = ("fx_graph_cache", "autotune_local_cache")
+
+
+class TestNexfortCache(unittest.TestCase):
+    def setUp(self):
+        # enable_compile_cache sets these for the whole process
+        self.env = {name: os.environ.get(name) for name in ENV_VARS}
+        self.configs = {
+            name: getattr(inductor_config, name)
+            for name in INDUCTOR_CONFIGS
+            if hasattr(inductor_config, name)
+        }
+        cache._cache_dir = None
+
+    def tearDown(self):
+        for name, value in self.env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        for name, value in self.configs.items():
+            setattr(inductor_config, name, value)
+        cache._cache_dir = None
+
+    def test_enable_compile_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as other_dir:
+            self.assertEqual(cache.enable_compile_cache(cache_dir), cache_dir)
+            self.assertEqual(
+                os.environ["TORCHINDUCTOR_CACHE_DIR"],
+                os.path.join(cache_dir, "inductor"),
+            )
+            self.assertEqual(os.environ["NEXFORT_GRAPH_CACHE"], "1")
+            # The directories are set for the whole process
+            self.assertEqual(cache.enable_compile_cache(other_dir), cache_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
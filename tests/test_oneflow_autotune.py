@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import unittest
+
+from onediff.infer_compiler import OneflowCompileOptions
+from onediff.infer_compiler.backends.oneflow.autotune import (
+    _greedy_search,
+    _options_key,
+    load_autotune_profile,
+)
+
+
+class TestOneflowAutotune(unittest.TestCase):
+    def test_greedy_search(self):
+        search_space = {
+            "kernel_enable_fused_linear": (True, False),
+            "matmul_allow_half_precision_accumulation": (True, False),
+            "mlir_prefer_nhwc": (True, False),
+        }
+
+        def evaluate(options):
+            if options.mlir_prefer_nhwc is False:
+                raise RuntimeError("unsupported layout")
+            latency, error = 10.0, 0.0
+            if options.kernel_enable_fused_linear:
+                latency -= 2
+            if options.matmul_allow_half_precision_accumulation:
+                # Faster but too inaccurate
+                latency, error = latency - 3, 1.0
+            return latency, error
+
+        options, latency, error, baseline_latency, trials = _greedy_search(
+            search_space, evaluate, OneflowCompileOptions(), 0.1, 0.01
+        )
+        self.assertTrue(options.kernel_enable_fused_linear)
+        self.assertIsNone(options.matmul_allow_half_precision_accumulation)
+        self.assertIsNone(options.mlir_prefer_nhwc)
+        self.assertEqual((latency, error, baseline_latency), (8.0, 0.0, 10.0))
+        self.assertEqual(len(trials), 7)
+        self.assertIn("unsupported layout", trials[-1]["failure"])
+
+    def test_load_autotune_profile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profile_path = os.path.join(tmpdir, "profile.json")
+            with open(profile_path, "w") as f:
+                json.dump({"version": 1, "options": {"mlir_group_matmul": False}}, f)
+            options = load_autotune_profile(
+                profile_path, OneflowCompileOptions(dynamic=False)
+            )
+            self.assertFalse(options.mlir_group_matmul)
+            self.assertFalse(options.dynamic)
+
+    def test_options_key(self):
+        self.assertEqual(
+            _options_key(OneflowCompileOptions()), _options_key(OneflowCompileOptions())
+        )
+        self.assertNotEqual(
+            _options_key(OneflowCompileOptions()),
+            _options_key(OneflowCompileOptions(dynamic=False)),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
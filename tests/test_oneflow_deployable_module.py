@@ -0,0 +1,270 @@
+import os
+import tempfile
+import unittest
+
+import torch
+
+from onediff.infer_compiler import compile, OneflowCompileOptions
+from onediff.utils.import_utils import is_oneflow_available
+
+
+class SimpleModule(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(4, 8, 3, padding=1)
+        self.linear = torch.nn.Linear(8, 4)
+
+    def forward(self, x):
+        x = torch.nn.functional.silu(self.conv(x))
+        return self.linear(x.mean(dim=(2, 3)))
+
+
+@unittest.skipUnless(is_oneflow_available(), "oneflow is not available")
+class TestOneflowDeployableModule(unittest.TestCase):
+    def setUp(self) -> None:
+        self.model = SimpleModule().cuda().half()
+
+    @torch.inference_mode()
+    def test_compile_in_background(self):
+        options = OneflowCompileOptions()
+        options.compile_in_background = True
+        compiled_model = compile(self.model, backend="oneflow", options=options)
+
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+        expected = self.model(x)
+        # served eagerly while the graph compiles
+        self.assertTrue(torch.allclose(compiled_model(x), expected, atol=1e-2))
+
+        future = compiled_model.get_compile_future(x)
+        self.assertIsNotNone(future)
+        future.result(timeout=600)
+        self.assertTrue(torch.allclose(compiled_model(x), expected, atol=1e-2))
+        stats = compiled_model.graph_pool_stats()
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(next(iter(stats.values()))["hits"], 1)
+
+    @torch.inference_mode()
+    def test_warmup(self):
+        compiled_model = compile(self.model, backend="oneflow")
+
+        def input_fn(shape):
+            x = torch.randn(shape.batch_size, 4, shape.height, shape.width)
+            return (x.cuda().to(shape.dtype or torch.float16),), {}
+
+        results = compiled_model.warmup(
+            [(32, 32, 1, torch.float16), {"height": 64, "width": 64, "batch": 2}],
+            input_fn,
+        )
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertEqual(results[1].shape.batch_size, 2)
+
+    @torch.inference_mode()
+    def test_warmup_with_compile_in_background(self):
+        options = OneflowCompileOptions()
+        options.compile_in_background = True
+        compiled_model = compile(self.model, backend="oneflow", options=options)
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+
+        results = compiled_model.warmup([((x,), {})])
+        self.assertTrue(all(r.error is None for r in results))
+        # Compiled in the calling thread, without changing the shared options
+        self.assertIsNone(compiled_model.get_compile_future(x))
+        self.assertTrue(options.compile_in_background)
+        compiled_model(x)
+        self.assertEqual(
+            next(iter(compiled_model.graph_pool_stats().values()))["hits"], 1
+        )
+
+    def test_verify_param_sharing(self):
+        compiled_model = compile(self.model, backend="oneflow")
+        report = compiled_model.verify_param_sharing(strict=True)
+        self.assertTrue(report.is_zero_copy)
+        self.assertEqual(len(report.shared), 4)
+        self.assertEqual(
+            report.shared_bytes,
+            sum(p.numel() * p.element_size() for p in self.model.parameters()),
+        )
+
+        # A weight replaced on the torch side only is no longer shared
+        self.model.linear.weight.data = self.model.linear.weight.data.clone()
+        report = compiled_model.verify_param_sharing()
+        self.assertEqual([name for name, _ in report.not_shared], ["linear.weight"])
+        with self.assertRaises(RuntimeError):
+            compiled_model.verify_param_sharing(strict=True)
+
+    @torch.inference_mode()
+    def test_load_state_dict_updates_changed_weights(self):
+        from onediff.infer_compiler.backends.oneflow.param_utils import (
+            update_graph_with_constant_folding_info,
+        )
+
+        compiled_model = compile(self.model, backend="oneflow")
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+        compiled_model(x)
+        compiled_model(x)
+        self.assertEqual(
+            update_graph_with_constant_folding_info(compiled_model, only_changed=True),
+            [],
+        )
+
+        weight = torch.randn_like(self.model.conv.weight)
+        self.model.load_state_dict({"conv.weight": weight}, strict=False)
+        self.assertTrue(torch.allclose(compiled_model(x), self.model(x), atol=1e-2))
+        self.assertEqual(
+            update_graph_with_constant_folding_info(compiled_model, only_changed=True),
+            [],
+        )
+
+    @torch.inference_mode()
+    def test_data_writes_reach_the_graph(self):
+        from onediff.infer_compiler.backends.oneflow.param_utils import (
+            update_graph_related_tensor,
+            update_graph_with_constant_folding_info,
+        )
+
+        compiled_model = compile(self.model, backend="oneflow")
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+        compiled_model(x)
+        compiled_model(x)
+
+        # Written through .data, like fused LoRAs, which doesn't change the version
+        self.model.conv.weight.data.copy_(torch.randn_like(self.model.conv.weight))
+        update_graph_related_tensor(self.model.conv, defer=True)
+        self.assertTrue(torch.allclose(compiled_model(x), self.model(x), atol=1e-2))
+
+        # Unmarked, then another weight is loaded
+        self.model.conv.weight.data -= 0.1
+        self.model.load_state_dict(
+            {"linear.bias": torch.randn_like(self.model.linear.bias)}, strict=False
+        )
+        self.assertTrue(torch.allclose(compiled_model(x), self.model(x), atol=1e-2))
+        self.assertEqual(
+            update_graph_with_constant_folding_info(compiled_model, only_changed=True),
+            [],
+        )
+
+    @torch.inference_mode()
+    def test_rebind_weights(self):
+        compiled_model = compile(self.model, backend="oneflow")
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+        compiled_model(x)
+        compiled_model(x)
+
+        # another checkpoint of the same architecture
+        other_model = SimpleModule().cuda().half()
+        expected = other_model(x)
+        report = compiled_model.rebind_weights(other_model.state_dict())
+        self.assertEqual(len(report.updated), 4)
+        self.assertTrue(torch.allclose(compiled_model(x), expected, atol=1e-2))
+
+        with self.assertRaises(RuntimeError):
+            compiled_model.rebind_weights({"conv.weight": other_model.conv.weight})
+        report = compiled_model.rebind_weights(
+            {"conv.weight": self.model.conv.weight}, strict=False
+        )
+        self.assertEqual(report.unchanged, ["conv.weight"])
+
+        # a checkpoint loaded on host
+        other_model = SimpleModule().half()
+        expected = other_model.cuda()(x)
+        compiled_model.rebind_weights(
+            {k: v.cpu() for k, v in other_model.state_dict().items()}
+        )
+        self.assertTrue(torch.allclose(compiled_model(x), expected, atol=1e-2))
+
+    @torch.inference_mode()
+    def test_save_and_load_mmap_graph_file(self):
+        options = OneflowCompileOptions()
+        options.graph_file_format = "mmap"
+        compiled_model = compile(self.model, backend="oneflow", options=options)
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+        expected = compiled_model(x)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            graph_file = os.path.join(tmp_dir, "model.graph")
+            compiled_model.save_graph(graph_file)
+            self.assertTrue(
+                os.path.exists(os.path.join(graph_file, "states.safetensors"))
+            )
+
+            loaded_model = compile(self.model, backend="oneflow")
+            loaded_model.load_graph(graph_file, run_warmup=False)
+            self.assertTrue(torch.allclose(loaded_model(x), expected, atol=1e-2))
+
+    @torch.inference_mode()
+    def test_weightless_graph_file_rebinds_to_module(self):
+        options = OneflowCompileOptions()
+        options.graph_file_format = "weightless"
+        compiled_model = compile(self.model, backend="oneflow", options=options)
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+        compiled_model(x)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            graph_file = os.path.join(tmp_dir, "model.graph")
+            compiled_model.save_graph(graph_file)
+
+            # another checkpoint of the same architecture
+            other_model = SimpleModule().cuda().half()
+            expected = other_model(x)
+            loaded_model = compile(other_model, backend="oneflow")
+            loaded_model.load_graph(graph_file, run_warmup=False)
+            self.assertTrue(torch.allclose(loaded_model(x), expected, atol=1e-2))
+
+    @torch.inference_mode()
+    def test_save_loaded_graph_file_in_another_format(self):
+        options = OneflowCompileOptions()
+        options.graph_file_format = "weightless"
+        compiled_model = compile(self.model, backend="oneflow", options=options)
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+        expected = compiled_model(x)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            graph_file = os.path.join(tmp_dir, "model.graph")
+            compiled_model.save_graph(graph_file)
+            loaded_model = compile(self.model, backend="oneflow")
+            loaded_model.load_graph(graph_file, run_warmup=False)
+
+            full_graph_file = os.path.join(tmp_dir, "model_full.graph")
+            loaded_model.save_graph(full_graph_file, file_format="full")
+            self.assertTrue(os.path.isfile(full_graph_file))
+
+            other_model = compile(self.model, backend="oneflow")
+            other_model.load_graph(full_graph_file, run_warmup=False)
+            self.assertTrue(torch.allclose(other_model(x), expected, atol=1e-2))
+
+    @unittest.skipUnless(torch.cuda.device_count() > 1, "requires 2 GPUs")
+    @torch.inference_mode()
+    def test_replicate(self):
+        compiled_model = compile(self.model, backend="oneflow")
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+        expected = compiled_model(x)
+
+        (replica,) = compiled_model.replicate(["cuda:1"])
+        self.assertEqual(next(replica.parameters()).device, torch.device("cuda:1"))
+        output = replica(x.to("cuda:1"))
+        self.assertTrue(torch.allclose(output.cpu(), expected.cpu(), atol=1e-2))
+        # served by the replicated graph
+        self.assertEqual(next(iter(replica.graph_pool_stats().values()))["hits"], 1)
+
+    @torch.inference_mode()
+    def test_replicate_torch_module(self):
+        from onediff.infer_compiler.backends.oneflow.param_utils import (
+            GRAPH_RELATED_TENSOR_ATTR,
+            replicate_torch_module,
+        )
+
+        compiled_model = compile(self.model, backend="oneflow")
+        compiled_model(torch.randn(2, 4, 32, 32).cuda().half())
+        self.assertTrue(hasattr(self.model.conv, GRAPH_RELATED_TENSOR_ATTR))
+
+        replica = replicate_torch_module(self.model, "cpu")
+        self.assertFalse(hasattr(replica.conv, GRAPH_RELATED_TENSOR_ATTR))
+        self.assertNotIn("copy_", replica.conv.weight.__dict__)
+        self.assertEqual(len(replica._load_state_dict_post_hooks), 0)
+        for name, tensor in self.model.state_dict().items():
+            self.assertTrue(torch.equal(replica.state_dict()[name], tensor.cpu()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import types
+import unittest
+from unittest import mock
+
+from onediff.infer_compiler import OneflowCompileOptions
+from onediff.infer_compiler.backends import env_var
+from onediff.infer_compiler.backends.env_var import (
+    _ONEFLOW_ENV_VARS,
+    get_oneflow_env_vars,
+    oneflow_env_vars_scope,
+    ONEFLOW_PROCESS_ENV_VARS,
+    ONEFLOW_RUN_TIME_ENV_VARS,
+    set_oneflow_process_env_vars,
+)
+
+
+class TestOneflowEnvVars(unittest.TestCase):
+    def test_get_oneflow_env_vars(self):
+        options = OneflowCompileOptions()
+        self.assertEqual(get_oneflow_env_vars(options), {})
+        options.conv_allow_half_precision_accumulation = False
+        options.attention_allow_half_precision_score_accumulation_max_m = 0
+        self.assertEqual(
+            get_oneflow_env_vars(options),
+            {
+                "ONEFLOW_CONV_ALLOW_HALF_PRECISION_ACCUMULATION": "0",
+                "ONEFLOW_ATTENTION_ALLOW_HALF_PRECISION_SCORE_ACCUMULATION_MAX_M": "0",
+            },
+        )
+
+    def test_scope_restores_env_vars(self):
+        os.environ["ONEFLOW_MLIR_CSE"] = "1"
+        os.environ.pop("ONEFLOW_MLIR_GROUP_MATMUL", None)
+        env_vars = {"ONEFLOW_MLIR_CSE": "0", "ONEFLOW_MLIR_GROUP_MATMUL": "0"}
+        with oneflow_env_vars_scope(env_vars):
+            self.assertEqual(os.environ["ONEFLOW_MLIR_CSE"], "0")
+            self.assertEqual(os.environ["ONEFLOW_MLIR_GROUP_MATMUL"], "0")
+            # Nested scopes of the same thread
+            with oneflow_env_vars_scope({"ONEFLOW_MLIR_CSE": "1"}):
+                self.assertEqual(os.environ["ONEFLOW_MLIR_CSE"], "1")
+            self.assertEqual(os.environ["ONEFLOW_MLIR_CSE"], "0")
+        self.assertEqual(os.environ["ONEFLOW_MLIR_CSE"], "1")
+        self.assertNotIn("ONEFLOW_MLIR_GROUP_MATMUL", os.environ)
+
+    def test_run_time_env_vars_are_options(self):
+        self.assertLessEqual(ONEFLOW_RUN_TIME_ENV_VARS, set(_ONEFLOW_ENV_VARS.values()))
+        self.assertLessEqual(ONEFLOW_PROCESS_ENV_VARS, set(_ONEFLOW_ENV_VARS.values()))
+
+    def test_process_env_vars_warn_on_conflict(self):
+        name = "ONEFLOW_RUN_GRAPH_BY_VM"
+        saved = os.environ.get(name, None)
+        env_var._process_env_vars.clear()
+        try:
+            with mock.patch.object(env_var.logger, "warning") as warning:
+                set_oneflow_process_env_vars(
+                    {name: "0", "ONEFLOW_MLIR_CSE": "0"}, "UNet"
+                )
+                self.assertEqual(os.environ[name], "0")
+                # Only the process-wide ones are set
+                self.assertNotEqual(os.environ.get("ONEFLOW_MLIR_CSE"), "0")
+                set_oneflow_process_env_vars({name: "0"}, "VAE")
+                warning.assert_not_called()
+                set_oneflow_process_env_vars({name: "1"}, "VAE")
+                warning.assert_called_once()
+                self.assertEqual(os.environ[name], "1")
+        finally:
+            env_var._process_env_vars.clear()
+            if saved is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = saved
+
+    def test_env_vars_key(self):
+        from onediff.infer_compiler.backends.oneflow.utils.hash_utils import (
+            generate_env_vars_key,
+        )
+
+        def module(env_vars):
+            return types.SimpleNamespace(_deployable_module_env_vars=env_vars)
+
+        # Graph files of modules without options keep their names
+        self.assertEqual(generate_env_vars_key(module({})), "")
+        key = generate_env_vars_key(module({"ONEFLOW_MLIR_CSE": "0"}))
+        self.assertEqual(len(key), 8)
+        self.assertNotEqual(
+            key, generate_env_vars_key(module({"ONEFLOW_MLIR_CSE": "1"}))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+import copy
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import torch
+
+from onediff.utils.import_utils import is_onediff_quant_available, is_oneflow_available
+
+
+class SimpleModule(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(4, 8, 3, padding=1)
+        self.linear = torch.nn.Linear(8, 4)
+
+    def forward(self, x):
+        return self.linear(self.conv(x).mean(dim=(2, 3)))
+
+
+@unittest.skipUnless(
+    is_oneflow_available() and is_onediff_quant_available(),
+    "oneflow or onediff_quant is not available",
+)
+class TestQuantizedModelCacheKey(unittest.TestCase):
+    def setUp(self):
+        from onediff.infer_compiler.backends.oneflow.online_quantization_utils import (
+            generate_quantized_model_cache_key,
+        )
+
+        self.generate_key = generate_quantized_model_cache_key
+        self.model = SimpleModule()
+        self.args = (torch.randn(1, 4, 32, 32),)
+
+    def key(self, quant_config, args=None):
+        return self.generate_key(self.model, quant_config, args or self.args, {})
+
+    def test_key(self):
+        config = SimpleNamespace(conv_mae_threshold=0.1, cache_dir="a")
+        key = self.key(config)
+        self.assertEqual(key, self.key(config))
+        # The cache directory doesn't change the result
+        self.assertEqual(
+            key, self.key(SimpleNamespace(conv_mae_threshold=0.1, cache_dir="b"))
+        )
+        self.assertNotEqual(
+            key, self.key(SimpleNamespace(conv_mae_threshold=0.2, cache_dir="a"))
+        )
+        self.assertNotEqual(key, self.key(config, (torch.randn(2, 4, 32, 32),)))
+
+        # Another checkpoint
+        with torch.no_grad():
+            self.model.conv.weight.add_(1)
+        self.assertNotEqual(key, self.key(config))
+
+
+@unittest.skipUnless(
+    is_oneflow_available() and is_onediff_quant_available(),
+    "oneflow or onediff_quant is not available",
+)
+class TestQuantizedModelCache(unittest.TestCase):
+    @torch.inference_mode()
+    def test_save_and_load(self):
+        from onediff.infer_compiler.backends.oneflow.online_quantization_utils import (
+            _quantizable_modules,
+            find_weight_scales,
+            load_quantized_model_cache,
+            save_quantized_model_cache,
+        )
+        from onediff.optimization.quant_optimizer import quantize_model
+
+        model = SimpleModule().cuda().half()
+        float_model = copy.deepcopy(model)
+        quantizable_modules = _quantizable_modules(model)
+        weight_scales = find_weight_scales(quantizable_modules)
+        # Stands in for online quantization, which replaces the same layers
+        quantize_model(model, quantize_conv=False)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "quantized_models", "key.safetensors")
+            save_quantized_model_cache(path, model, quantizable_modules, weight_scales)
+            loaded_model = load_quantized_model_cache(path, float_model)
+
+        self.assertIsInstance(loaded_model.conv, torch.nn.Conv2d)
+        self.assertIs(type(loaded_model.linear), type(model.linear))
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+        self.assertTrue(torch.allclose(loaded_model(x), model(x), atol=1e-2))
+
+    @torch.inference_mode()
+    def test_broken_cache_leaves_model_unchanged(self):
+        from onediff.infer_compiler.backends.oneflow.online_quantization_utils import (
+            _load_quantized_model_cache,
+        )
+        from onediff.quantization.calibrate_info import save_calibrate_info
+
+        model = SimpleModule().cuda().half()
+        state_dict = copy.deepcopy(model.state_dict())
+        for calibration_info in [
+            # The first layer is fine, the second isn't in the model
+            {"conv": [0, 0, [1.0] * 8], "missing": [0, 0, [1.0] * 4]},
+            # Too few scales for the output channels of linear
+            {"conv": [0, 0, [1.0] * 8], "linear": [0, 0, [1.0] * 3]},
+        ]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, "key.safetensors")
+                save_calibrate_info(calibration_info, path)
+                self.assertFalse(_load_quantized_model_cache(path, model, bits=8))
+            self.assertIsInstance(model.conv, torch.nn.Conv2d)
+            self.assertIs(type(model.linear), torch.nn.Linear)
+            for name, tensor in model.state_dict().items():
+                self.assertTrue(torch.equal(tensor, state_dict[name]))
+
+    @torch.inference_mode()
+    def test_cached_matches_online_quantization(self):
+        from onediff.infer_compiler.backends.oneflow.online_quantization_utils import (
+            _quantizable_modules,
+            find_weight_scales,
+            load_quantized_model_cache,
+            online_quantize_model,
+            save_quantized_model_cache,
+        )
+        from onediff_quant.quantization import QuantizationConfig
+
+        # Every layer is quantized
+        quant_config = QuantizationConfig.from_settings(
+            quantize_conv=True,
+            quantize_linear=True,
+            conv_mae_threshold=1.0,
+            linear_mae_threshold=1.0,
+            conv_compute_density_threshold=0,
+            linear_compute_density_threshold=0,
+        )
+        cold_model = SimpleModule().cuda().half()
+        warm_model = copy.deepcopy(cold_model)
+        x = torch.randn(2, 4, 32, 32).cuda().half()
+
+        # The path of the first run, online quantization saved to the cache
+        quantizable_modules = _quantizable_modules(cold_model)
+        weight_scales = find_weight_scales(quantizable_modules)
+        cold_model, _ = online_quantize_model(
+            cold_model, (x,), {}, quant_config=quant_config, inplace=True
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "quantized_models", "key.safetensors")
+            save_quantized_model_cache(
+                path, cold_model, quantizable_modules, weight_scales
+            )
+            # The path of later runs
+            warm_model = load_quantized_model_cache(path, warm_model)
+
+        cold_modules = dict(cold_model.named_modules())
+        warm_modules = dict(warm_model.named_modules())
+        self.assertEqual(
+            {name: type(module) for name, module in cold_modules.items()},
+            {name: type(module) for name, module in warm_modules.items()},
+        )
+        # Same quantized weights and scales
+        warm_state_dict = warm_model.state_dict()
+        for name, tensor in cold_model.state_dict().items():
+            self.assertTrue(
+                torch.allclose(tensor.float(), warm_state_dict[name].float()), name
+            )
+        self.assertTrue(torch.allclose(warm_model(x), cold_model(x), atol=1e-2))
+
+
+if __name__ == "__main__":
+    unittest.main()
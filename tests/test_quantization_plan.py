@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+
+from onediff.quantization.plan import estimate_layer_costs, QuantizationPlan
+
+
+class Attention(nn.Module):
+    def __init__(self, dim):
+        super().__init__()
+        self.to_q = nn.Linear(dim, dim)
+        self.to_k = nn.Linear(dim, dim)
+        self.to_v = nn.Linear(dim, dim)
+        self.to_out = nn.ModuleList([nn.Linear(dim, dim)])
+
+    def forward(self, x):
+        q, k, v = self.to_q(x), self.to_k(x), self.to_v(x)
+        attn = torch.softmax(q @ k.transpose(-1, -2) / q.shape[-1] ** 0.5, dim=-1)
+        return self.to_out[0](attn @ v)
+
+
+class SimpleModel(nn.Module):
+    def __init__(self, dim=32):
+        super().__init__()
+        self.conv_in = nn.Conv2d(4, dim, 3, padding=1)
+        self.time_proj = nn.Linear(dim, dim)
+        self.conv = nn.Conv2d(dim, dim, 3, padding=1)
+        self.attn = Attention(dim)
+        self.proj = nn.Linear(dim, dim)
+        self.conv_out = nn.Conv2d(dim, 4, 3, padding=1)
+
+    def forward(self, x, t):
+        x = self.conv_in(x) + self.time_proj(t)[:, :, None, None]
+        x = self.conv(x)
+        b, c, h, w = x.shape
+        tokens = x.flatten(2).transpose(1, 2)
+        tokens = self.proj(self.attn(tokens))
+        return self.conv_out(tokens.transpose(1, 2).reshape(b, c, h, w))
+
+
+def run(model):
+    # 32 x 32 = 1024 positions, a single time embedding
+    return model(torch.randn(1, 4, 32, 32), torch.randn(1, 32))
+
+
+class TestQuantizationPlan(unittest.TestCase):
+    def setUp(self):
+        self.model = SimpleModel()
+
+    def test_estimate_layer_costs(self):
+        costs = {cost.name: cost for cost in estimate_layer_costs(self.model, run)}
+        self.assertEqual(list(costs)[0], "conv_in")
+        self.assertEqual(list(costs)[-1], "conv_out")
+        self.assertEqual(costs["conv"].macs, 1024 * 32 * 32 * 9)
+        self.assertEqual(costs["conv"].compute_density, 1024)
+        self.assertEqual(costs["time_proj"].compute_density, 1)
+        self.assertEqual(costs["attn.to_q"].kind, "linear")
+
+    def test_from_cost_model(self):
+        plan = QuantizationPlan.from_cost_model(self.model, run)
+        self.assertEqual(
+            plan.layers("int8"),
+            ["conv", "attn.to_q", "attn.to_k", "attn.to_v", "attn.to_out.0", "proj"],
+        )
+        self.assertEqual(plan.layers("fp16"), ["conv_in", "time_proj", "conv_out"])
+
+        plan = QuantizationPlan.from_cost_model(
+            self.model,
+            run,
+            precision="fp8",
+            keep_attention_projections=True,
+            keep_fp16=["pro*"],
+        )
+        self.assertEqual(plan.layers("fp8"), ["conv"])
+
+        costs = estimate_layer_costs(self.model, run)
+        plan = QuantizationPlan.from_cost_model(
+            self.model,
+            None,
+            costs=costs,
+            keep_first_last_conv=False,
+            conv_compute_density_threshold=2048,
+            allowed_layers=["conv_in", "conv", "proj"],
+        )
+        self.assertEqual(plan.layers("int8"), ["proj"])
+
+    def test_save_and_load(self):
+        plan = QuantizationPlan({"conv": "int8", "proj": "fp8", "conv_out": "fp16"})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "plan.json")
+            plan.save(path)
+            self.assertEqual(QuantizationPlan.load(path), plan)
+        with self.assertRaises(ValueError):
+            QuantizationPlan({"conv": "int4"})
+
+    def test_oneflow_backend_rejects_fp8(self):
+        plan = QuantizationPlan({"proj": "fp8"})
+        with self.assertRaises(ValueError):
+            plan.apply(self.model, backend="oneflow")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import copy
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+
+from onediff.quantization.sensitivity import (
+    _chunks,
+    _errors,
+    LayerSensitivity,
+    load_sensitivity_report,
+    pareto_front,
+    save_sensitivity_report,
+    select_layers,
+    sensitivity_sweep,
+)
+
+RECORDS = [
+    LayerSensitivity(("conv_in",), mae=0.04, ssim=0.95, latency_saving=1.0),
+    LayerSensitivity(("down.0",), mae=0.01, ssim=0.99, latency_saving=2.0),
+    LayerSensitivity(("down.1",), mae=0.02, ssim=0.98, latency_saving=0.5),
+    LayerSensitivity(("mid.0", "mid.1"), mae=0.0, ssim=1.0, latency_saving=0.1),
+    # slower once quantized
+    LayerSensitivity(("up.0",), mae=0.0, ssim=1.0, latency_saving=-0.2),
+]
+
+
+class TestQuantizationSensitivity(unittest.TestCase):
+    def test_errors(self):
+        x = torch.randn(2, 4, 8, 8)
+        mae, ssim = _errors(x, x)
+        self.assertEqual(mae, 0.0)
+        self.assertAlmostEqual(ssim, 1.0)
+        mae, ssim = _errors({"sample": x}, {"sample": x + 0.5})
+        self.assertAlmostEqual(mae, 0.5)
+        self.assertLess(ssim, 1.0)
+
+    def test_pareto_front(self):
+        front = pareto_front(RECORDS)
+        self.assertEqual([r.name for r in front], ["mid.0,mid.1", "down.0"])
+
+    def test_select_layers(self):
+        self.assertEqual(
+            select_layers(RECORDS, max_error=0.03),
+            ["mid.0", "mid.1", "down.0", "down.1"],
+        )
+        self.assertEqual(select_layers(RECORDS, max_error=0.0), ["mid.0", "mid.1"])
+        self.assertEqual(
+            select_layers(RECORDS, max_error=0.015, metric="ssim"),
+            ["mid.0", "mid.1", "down.0"],
+        )
+
+    def test_select_layers_without_latency(self):
+        records = [
+            LayerSensitivity((name,), mae=mae, ssim=1.0 - mae)
+            for name, mae in [("a", 0.3), ("b", 0.1), ("c", 0.2)]
+        ]
+        self.assertEqual(select_layers(records, max_error=0.35), ["b", "c"])
+
+    def test_merge_shards(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, f"shard_{i}.json") for i in range(2)]
+            save_sensitivity_report(RECORDS[0::2], paths[0])
+            save_sensitivity_report(RECORDS[1::2], paths[1])
+            records = load_sensitivity_report(*paths)
+        self.assertEqual(
+            sorted(records, key=lambda r: r.name), sorted(RECORDS, key=lambda r: r.name)
+        )
+
+    def test_chunks(self):
+        groups = [("a",), ("b", "c"), ("d",), ("e", "f", "g")]
+        self.assertEqual(
+            list(_chunks(groups, 3)),
+            [[("a",), ("b", "c")], [("d",)], [("e", "f", "g")]],
+        )
+
+    def test_sweep_with_quantize_fn(self):
+        model = nn.Sequential(nn.Linear(8, 8), nn.ReLU(), nn.Linear(8, 8))
+        x = torch.randn(4, 8)
+        runs = []
+
+        def run_fn(model):
+            runs.append(None)
+            return model(x)
+
+        def quantize_fn(name, layer):
+            layer = copy.deepcopy(layer)
+            layer.weight.data = (layer.weight.data * 4).round() / 4
+            return layer
+
+        for mode, num_runs in [("output", 3), ("layer", 2)]:
+            runs.clear()
+            records = sensitivity_sweep(
+                model,
+                run_fn,
+                layers=["0", "2"],
+                mode=mode,
+                quantize_fn=quantize_fn,
+                measure_latency=mode == "output",
+                iters=1,
+                max_cached_layers=1,
+            )
+            self.assertEqual([r.name for r in records], ["0", "2"])
+            self.assertTrue(all(r.mae > 0 for r in records))
+            # Once for the reference and once per layer, or once per chunk of layers
+            self.assertEqual(len(runs), num_runs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+import torch
+
+from onediff.infer_compiler.backends.static_io_buffers import StaticIOBuffers
+
+
+class TestStaticIOBuffers(unittest.TestCase):
+    def test_inputs_are_copied_into_persistent_buffers(self):
+        buffers = StaticIOBuffers()
+        x = torch.randn(2, 4)
+        entry, inputs = buffers.copy_inputs("key", [x, x.t()])
+        self.assertTrue(torch.equal(inputs[0], x))
+        self.assertTrue(inputs[1].is_contiguous())
+
+        y = torch.randn(2, 4)
+        same_entry, same_inputs = buffers.copy_inputs("key", [y, y.t()])
+        self.assertIs(same_entry, entry)
+        self.assertEqual(same_inputs[0].data_ptr(), inputs[0].data_ptr())
+        self.assertTrue(torch.equal(same_inputs[0], y))
+
+        buffers.copy_inputs("key", [torch.randn(1, 4), y.t()])
+        self.assertEqual(len(buffers), 2)
+
+    def test_aliased_inputs_are_read_before_overwritten(self):
+        buffers = StaticIOBuffers()
+        a, b = torch.zeros(4), torch.ones(4)
+        _, inputs = buffers.copy_inputs("key", [a, b])
+        # Swap the buffers, the second one is read after the first one is written
+        _, inputs = buffers.copy_inputs("key", [inputs[1], inputs[0]])
+        self.assertTrue(torch.equal(inputs[0], b))
+        self.assertTrue(torch.equal(inputs[1], a))
+
+    def test_outputs_are_persistent(self):
+        buffers = StaticIOBuffers()
+        entry, _ = buffers.copy_inputs("key", [torch.randn(4)])
+        (output,) = buffers.copy_outputs(entry, [torch.zeros(4)])
+        (next_output,) = buffers.copy_outputs(entry, [torch.ones(4)])
+        self.assertIs(next_output, output)
+        self.assertTrue(torch.equal(output, torch.ones(4)))
+
+    def test_persistent_outputs_are_not_copied(self):
+        buffers = StaticIOBuffers(persistent_outputs=True)
+        entry, _ = buffers.copy_inputs("key", [torch.randn(4)])
+        output = torch.zeros(4)
+        (returned,) = buffers.copy_outputs(entry, [output])
+        self.assertIs(returned, output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from onediff.infer_compiler.backends.stats import (
+    ModuleStats,
+    register_stats_exporter,
+    unregister_stats_exporter,
+)
+
+
+class TestModuleStats(unittest.TestCase):
+    def test_disabled_records_nothing(self):
+        stats = ModuleStats("UNet", enabled=False)
+        stats.inc("graph_pool_hits")
+        with stats.timer("execution_time"):
+            pass
+        stats.record_memory("graph_build_memory", 10.0)
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot["counters"], {})
+        self.assertEqual(snapshot["timers"], {})
+        self.assertEqual(snapshot["memory"], {})
+
+    def test_counters_timers_and_memory(self):
+        stats = ModuleStats("UNet", enabled=True)
+        stats.inc("graph_pool_hits")
+        stats.inc("graph_pool_hits")
+        stats.inc("graph_pool_misses")
+        stats.record_time("graph_build_time", 2.0)
+        stats.record_time("graph_build_time", 4.0)
+        with stats.timer("execution_time"):
+            pass
+        stats.record_memory("graph_build_memory", 10.0)
+        stats.record_memory("graph_build_memory", -2.5)
+
+        snapshot = stats.snapshot()
+        self.assertEqual(
+            snapshot["counters"], {"graph_pool_hits": 2, "graph_pool_misses": 1}
+        )
+        self.assertEqual(
+            snapshot["timers"]["graph_build_time"],
+            {"count": 2, "total": 6.0, "max": 4.0, "mean": 3.0},
+        )
+        self.assertEqual(snapshot["timers"]["execution_time"]["count"], 1)
+        self.assertEqual(snapshot["memory"], {"graph_build_memory": 7.5})
+
+        stats.reset()
+        self.assertEqual(stats.snapshot()["counters"], {})
+
+    def test_exporter(self):
+        records = []
+
+        def exporter(module_name, metric, kind, value):
+            records.append((module_name, metric, kind, value))
+
+        register_stats_exporter(exporter)
+        try:
+            stats = ModuleStats("VAE", enabled=True)
+            stats.inc("graph_builds")
+            stats.record_time("graph_load_time", 0.5)
+        finally:
+            unregister_stats_exporter(exporter)
+        stats.inc("graph_builds")
+
+        self.assertEqual(
+            records,
+            [
+                ("VAE", "graph_builds", "count", 1),
+                ("VAE", "graph_load_time", "time", 0.5),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()